@@ -21,14 +21,12 @@ with the keyboard
 import gnome15.g15locale as g15locale
 _ = g15locale.get_translation("gnome15-drivers").ugettext
 
-from cStringIO import StringIO
 from threading import RLock
 import cairo
 import gnome15.g15driver as g15driver
 import gnome15.g15globals as g15globals
-import gnome15.util.g15convert as g15convert
 import gnome15.util.g15uigconf as g15uigconf
-import gnome15.util.g15cairo as g15cairo
+import gnome15.util.g15pack as g15pack
 import gnome15.g15exceptions as g15exceptions
 import sys
 import os
@@ -203,38 +201,9 @@ class Driver(g15driver.AbstractDriver):
         if not self.is_connected():
             return
                 
-        width = img.get_width()
-        height = img.get_height()
-        
-        # Create a new flipped, rotated image. The G19 expects the image to scan vertically, but
-        # the cairo image surface will be horizontal. Rotating then flipping the image is the
-        # quickest way to convert this. 16 bit color (5-6-5) is also required. Unfortunately this format
-        # was disabled for a long time, as was only re-enabled in version 1.8.6.
-        try:
-            back_surface = cairo.ImageSurface (4, height, width)
-        except Exception as e:
-            logger.debug('Could not create ImageSurface. Trying earlier API.', exc_info = e)
-            # Earlier version of Cairo
-            back_surface = cairo.ImageSurface (cairo.FORMAT_ARGB32, height, width)
-        
-        back_context = cairo.Context (back_surface)        
-        g15cairo.rotate_around_center(back_context, width, height, 270)
-        g15cairo.flip_horizontal(back_context, width, height)
-        back_context.set_source_surface(img, 0, 0)
-        back_context.set_operator (cairo.OPERATOR_SOURCE);
-        back_context.paint()
-        
-        if back_surface.get_format() == cairo.FORMAT_ARGB32:
-            file_str = StringIO()
-            data = back_surface.get_data()
-            for i in range(0, len(data), 4):
-                r = ord(data[i + 2])
-                g = ord(data[i + 1])
-                b = ord(data[i + 0])
-                file_str.write(self._rgb_to_uint16(r, g, b))                
-            buf = array.array('B', file_str.getvalue())   
-        else:   
-            buf = array.array('B', str(back_surface.get_data()))   
+        # The G19 expects the image to scan vertically, but the cairo image surface will be
+        # horizontal, so the packer transposes the image while converting to 16 bit colour (5-6-5).
+        buf = array.array('B', self.rgb_packer.pack(img))
                   
         expected_size = MAX_X * MAX_Y * ( self.get_bpp() / 8 )
         if len(buf) != expected_size:
@@ -299,6 +268,9 @@ class Driver(g15driver.AbstractDriver):
             logger.error("Failed to connect.", exc_info = e)
             raise g15exceptions.NotConnectedException()
         
+        # Converts frames to the format and orientation the G19 expects
+        self.rgb_packer = g15pack.RGB565Packer(MAX_X, MAX_Y, True)
+        
         # Start listening for keys
         self.lg19.add_input_processor(self)  
 
@@ -351,17 +323,3 @@ class Driver(g15driver.AbstractDriver):
         except usb.USBError as e:
             logger.debug('Error updating control.', exc_info = e)
             self._on_receive_error(e)
-            
-    def _rgb_to_uint16(self, r, g, b):
-        rBits = r * 32 / 255
-        gBits = g * 64 / 255
-        bBits = b * 32 / 255
-
-        rBits = rBits if rBits <= 31 else 31
-        gBits = gBits if gBits <= 63 else 63
-        bBits = bBits if bBits <= 31 else 31        
-
-        valueH = (rBits << 3) | (gBits >> 3)
-        valueL = (gBits << 5) | bBits
-
-        return chr(valueL & 0xff) + chr(valueH & 0xff)
@@ -17,7 +17,6 @@
 import gnome15.g15locale as g15locale
 _ = g15locale.get_translation("gnome15-drivers").ugettext
 
-from cStringIO import StringIO
 from pyinputevent.uinput import UInputDevice
 from pyinputevent.pyinputevent import InputEvent, SimpleDevice
 from pyinputevent.keytrans import *
@@ -28,6 +27,7 @@ import pyinputevent.scancodes as S
 import gnome15.g15driver as g15driver
 import gnome15.util.g15scheduler as g15scheduler
 import gnome15.util.g15uigconf as g15uigconf
+import gnome15.util.g15pack as g15pack
 import gnome15.g15globals as g15globals
 import gnome15.g15uinput as g15uinput
 import gconf
@@ -38,8 +38,6 @@ import cairo
 import re
 import usb
 import fb
-from PIL import Image
-from PIL import ImageMath
 import array
 import struct
 import dbus
@@ -980,6 +978,7 @@ class Driver(g15driver.AbstractDriver):
         g15driver.AbstractDriver.__init__(self, "kernel")
         self.notify_handles = []
         self.fb = None
+        self.last_buf = None
         self.var_info = None
         self.on_close = on_close
         self.key_thread = None
@@ -1076,87 +1075,34 @@ class Driver(g15driver.AbstractDriver):
     def paint(self, img):  
         if not self.fb:
             return 
-        width = img.get_width()
-        height = img.get_height()
-        character_width = width / 8
-        fixed = self.fb.get_fixed_info()
-        padding = fixed.line_length - character_width
-        file_str = StringIO()
         
         if self.get_model_name() == g15driver.MODEL_G19:
-            try:
-                back_surface = cairo.ImageSurface (4, width, height)
-            except Exception as e:
-                logger.debug("Could not create ImageSurface. Trying earlier API.", exc_info = e)
-                # Earlier version of Cairo
-                back_surface = cairo.ImageSurface (cairo.FORMAT_ARGB32, width, height)
-            back_context = cairo.Context (back_surface)
-            back_context.set_source_surface(img, 0, 0)
-            back_context.set_operator (cairo.OPERATOR_SOURCE);
-            back_context.paint()
-                
-            if back_surface.get_format() == cairo.FORMAT_ARGB32:
-                """
-                If the creation of the type 4 image failed (i.e. earlier version of Cairo)
-                then we have to convert it ourselves. This is slow. 
-                
-                TODO Replace with C routine 
-                """
-                file_str = StringIO()
-                data = back_surface.get_data()
-                for i in range(0, len(data), 4):
-                    r = ord(data[i + 2])
-                    g = ord(data[i + 1])
-                    b = ord(data[i + 0])
-                    file_str.write(self.rgb_to_uint16(r, g, b))             
-                buf = file_str.getvalue()
-            else:   
-                buf = str(back_surface.get_data())
+            buf = self.rgb_packer.pack(img)
+            row_bytes = self.rgb_packer.width * 2
         else:
-            width, height = self.get_size()
-            arrbuf = array.array('B', self.empty_buf)
-            
-            argb_surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, width, height)
-            argb_context = cairo.Context(argb_surface)
-            argb_context.set_source_surface(img)
-            argb_context.paint()
-            
-            '''
-            Now convert the ARGB to a PIL image so it can be converted to a 1 bit monochrome image, with all
-            colours dithered. It would be nice if Cairo could do this :( Any suggestions?
-            ''' 
-            pil_img = Image.frombuffer("RGBA", (width, height), argb_surface.get_data(), "raw", "RGBA", 0, 1)
-            pil_img = ImageMath.eval("convert(pil_img,'1')",pil_img=pil_img)
-            pil_img = ImageMath.eval("convert(pil_img,'P')",pil_img=pil_img)
-            pil_img = pil_img.point(lambda i: i >= 250,'1')
+            buf = self.mono_packer.pack(img, g15_invert_control.value == 0)
+            row_bytes = self.mono_packer.line_length
             
-            # Invert the screen if required
-            if g15_invert_control.value == 0:            
-                pil_img = pil_img.point(lambda i: 1^i)
-            
-            # Data is 160x43, 1 byte per pixel. Will have value of 0 or 1.
-            width, height = self.get_size()
-            data = list(pil_img.getdata())
-            fixed = self.fb.get_fixed_info()
-            v = 0
-            b = 1
-            
-            # TODO Replace with C routine
-            for row in range(0, height):
-                for col in range(0, width):
-                    if data[( row * width ) + col]:
-                        v += b
-                    b = b << 1
-                    if b == 256:
-                        # Full byte
-                        b = 1          
-                        i = row * fixed.line_length + col / 8
-                        arrbuf[i] = v   
-                        v = 0 
-            buf = arrbuf.tostring()
+        last_buf = self.last_buf
+        if buf == last_buf:
+            # Nothing has changed, so don't write to the framebuffer at all
+            return
+        
+        start = 0
+        end = len(buf)
+        if last_buf is not None and len(last_buf) == len(buf):
+            # Only write the rows that have actually changed. The whole frame
+            # is compared, not just any damaged region, as dithering when 
+            # packing may change pixels outside of it 
+            while start < end and buf[start:start + row_bytes] == last_buf[start:start + row_bytes]:
+                start += row_bytes
+            while end > start and buf[end - row_bytes:end] == last_buf[end - row_bytes:end]:
+                end -= row_bytes
                 
         if self.fb and self.fb.buffer:
-            self.fb.buffer[0:len(buf)] = buf
+            if end > start:
+                self.fb.buffer[start:end] = buf[start:end]
+            self.last_buf = buf
             
     def process_svg(self, document):  
         if self.get_bpp() == 1:
@@ -1220,6 +1166,7 @@ class Driver(g15driver.AbstractDriver):
         
     def _on_connect(self):
         self.notify_handles = []
+        self.last_buf = None
         # Check hardware again
         self._init_driver()
 
@@ -1243,10 +1190,11 @@ class Driver(g15driver.AbstractDriver):
                 self.fb.dump()
             self.var_info = self.fb.get_var_info()
                     
-            # Create an empty string buffer for use with monochrome LCD
-            self.empty_buf = ""
-            for i in range(0, self.fb.get_fixed_info().smem_len):
-                self.empty_buf += chr(0)
+            # Create the packers for use with colour and monochrome LCD
+            fixed = self.fb.get_fixed_info()
+            width, height = self.get_size()
+            self.rgb_packer = g15pack.RGB565Packer(width, height)
+            self.mono_packer = g15pack.MonoPacker(width, height, fixed.line_length, fixed.smem_len)
             
         # Connect to DBUS        
         system_bus = dbus.SystemBus()
@@ -1154,7 +1154,7 @@ class G15Config:
             self.notify_handles.append(self.conf_client.notify_add(self._get_full_key("locked"), self._active_profile_changed))
             self.notify_handles.append(self.conf_client.notify_add(self._get_full_key("enabled"), self._device_enabled_configuration_changed))
             self.notify_handles.append(self.conf_client.notify_add(self._get_full_key("driver"), self._driver_configuration_changed))
-            self.selected_profile = g15profile.get_active_profile(self.selected_device)  
+            self.selected_profile = g15profile.edit_profile(g15profile.get_active_profile(self.selected_device))
             self._set_cycle_seconds_value_from_configuration()
             self._set_cycle_screens_value_from_configuration()
         self.selected_profile = None
@@ -1175,7 +1175,7 @@ class G15Config:
         
     def _select_profile(self, widget):
         (model, path) = self.profiles_tree.get_selection().get_selected()
-        self.selected_profile = g15profile.get_profile(self.selected_device, model[path][2])
+        self.selected_profile = g15profile.edit_profile(g15profile.get_profile(self.selected_device, model[path][2]))
         self._load_profile(self.selected_profile)
         
     def _select_macro(self, widget):
@@ -1522,11 +1522,11 @@ class G15Config:
             new_profile = g15profile.G15Profile(self.selected_device, g15profile.generate_profile_id())
             new_profile.name = new_profile_name
             g15profile.create_profile(new_profile)
-            self.selected_profile = g15profile.get_profile(self.selected_device, new_profile.id)
+            self.selected_profile = g15profile.edit_profile(g15profile.get_profile(self.selected_device, new_profile.id))
             self._load_profile_list()
         
     def _copy_profile(self, widget):
-        dupe_profile = g15profile.get_profile(self.selected_device, self.selected_profile.id)
+        dupe_profile = g15profile.load_profile(self.selected_device, self.selected_profile.id)
         dialog = self.widget_tree.get_object("CopyProfileDialog") 
         dialog.set_transient_for(self.main_window)
         
@@ -1609,7 +1609,8 @@ class G15Config:
                 active_id = active.id
             self.selected_profile = None
             default_profile = g15profile.get_default_profile(self.selected_device)
-            self.profiles = g15profile.get_profiles(self.selected_device)
+            # Profiles may be edited here, so work on copies of them
+            self.profiles = [ g15profile.edit_profile(p) for p in g15profile.get_profiles(self.selected_device) ]
             locked = g15profile.is_locked(self.selected_device)
             for profile in self.profiles: 
                 weight = 400
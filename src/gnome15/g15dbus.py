@@ -24,6 +24,8 @@ import util.g15icontools as g15icontools
 import g15driver
 import g15devices
 import gobject
+import time
+from threading import RLock
 
 
 from cStringIO import StringIO
@@ -40,18 +42,260 @@ CONTROL_ACQUISITION_IF_NAME="org.gnome15.Control"
 SCREEN_IF_NAME="org.gnome15.Screen"
 DEVICE_IF_NAME="org.gnome15.Device"
 
+"""
+Minimum number of seconds between two signals of the same name and coalescing
+key (e.g. the title of one page). Values that arrive in between are held, and
+only the latest is sent once the interval has passed
+"""
+DEFAULT_RATE_LIMITS = { "PageTitleChanged" : 0.25 }
+
+"""
+Names of key states as sent in KeysEvent signals
+"""
+KEY_STATE_NAMES = { g15driver.KEY_STATE_UP : "up", g15driver.KEY_STATE_DOWN : "down" }
+
 # Logging
 import logging
 logger = logging.getLogger(__name__)
+
+class SignalQueue(object):
+    """
+    Outbound pipeline for frequent signals. Signals are queued from any thread
+    and sent together from a single idle callback on the main loop, so a burst
+    of events costs one wake up rather than one per event. Within each batch :-
+    
+    Key presses and releases for the same object are merged into as few 
+    KeysPressed and KeysReleased signals as possible (keeping their order).
+    If a client of the object has asked for them, they are also sent as a 
+    single KeysEvent signal of ( key, state ) pairs.
+    
+    Signals queued with a coalescing key replace any pending signal with the 
+    same name and key, so only the latest value is sent. These may also be
+    rate limited (see DEFAULT_RATE_LIMITS).
+    
+    Counts of the signals emitted and suppressed are kept by signal name.
+    """
+    
+    def __init__(self, rate_limits = DEFAULT_RATE_LIMITS):
+        """
+        Keyword arguments:
+        rate_limits    -- dictionary of minimum interval in seconds, keyed by signal name
+        """
+        self.rate_limits = dict(rate_limits)
+        self.emitted = {}
+        self.suppressed = {}
+        self._pending = []
+        self._coalesced = {}
+        self._keys = {}
+        self._key_events = set()
+        self._held = {}
+        self._last_sent = {}
+        self._idle_source = None
+        self._lock = RLock()
+        
+    def queue(self, obj, signal_name, args, coalesce_key = None):
+        """
+        Queue a signal to be sent on the next iteration of the main loop.
+        
+        Keyword arguments:
+        obj            -- service object that owns the signal
+        signal_name    -- name of signal method
+        args           -- list of signal arguments
+        coalesce_key   -- if not None, replace any waiting signal with the same name and key
+        """
+        self._lock.acquire()
+        try:
+            if coalesce_key is None:
+                self._pending.append([ obj, signal_name, args, None ])
+            else:
+                key = ( obj, signal_name, coalesce_key )
+                if key in self._coalesced:
+                    self._coalesced[key][2] = args
+                    self._count(self.suppressed, signal_name)
+                    return
+                if key in self._held:
+                    self._held[key][0] = args
+                    self._count(self.suppressed, signal_name)
+                    return
+                interval = self.rate_limits.get(signal_name, 0)
+                wait = self._last_sent.get(key, 0) + interval - time.time() if interval > 0 else 0
+                if wait > 0:
+                    self._held[key] = [ args, gobject.timeout_add(int(wait * 1000) + 1, self._release, key) ]
+                    return
+                entry = [ obj, signal_name, args, key ]
+                self._coalesced[key] = entry
+                self._pending.append(entry)
+            self._schedule()
+        finally:
+            self._lock.release()
+            
+    def queue_keys(self, obj, keys, state, key_event = False):
+        """
+        Queue key presses or releases to be sent on the next iteration of the
+        main loop.
+        
+        Keyword arguments:
+        obj            -- service object that owns the signals
+        keys           -- list of key names
+        state          -- key state (g15driver.KEY_STATE_UP or g15driver.KEY_STATE_DOWN)
+        key_event      -- also send the batch as a KeysEvent signal
+        """
+        self._lock.acquire()
+        try:
+            events = self._keys.get(obj)
+            if events is None:
+                events = []
+                self._keys[obj] = events
+                self._pending.append([ obj, "KeysEvent", events, None ])
+            elif events[-1][1] == state:
+                # Will be sent in the same signal as the previous keys
+                self._count(self.suppressed, "KeysReleased" if state == g15driver.KEY_STATE_UP else "KeysPressed")
+            for k in keys:
+                events.append(( k, state ))
+            if key_event:
+                self._key_events.add(obj)
+            self._schedule()
+        finally:
+            self._lock.release()
+            
+    def discard_referring(self, obj, value):
+        """
+        Discard every waiting signal of an object that has the given value as
+        one of its arguments, for example when the page it refers to is
+        being deleted.
+        
+        Keyword arguments:
+        obj            -- service object that owns the signals
+        value          -- argument value (such as a page's bus name)
+        """
+        self._lock.acquire()
+        try:
+            discarded = [ entry for entry in self._pending 
+                          if entry[0] is obj and entry[1] != "KeysEvent" and value in entry[2] ]
+            for entry in discarded:
+                self._pending.remove(entry)
+                if entry[3] is not None:
+                    self._coalesced.pop(entry[3], None)
+                    self._last_sent.pop(entry[3], None)
+            for key in [ k for k, held in self._held.items() if k[0] is obj and value in held[0] ]:
+                gobject.source_remove(self._held.pop(key)[1])
+                self._last_sent.pop(key, None)
+        finally:
+            self._lock.release()
+            
+    def clear(self):
+        """
+        Discard all waiting signals. The counters are not reset.
+        """
+        self._lock.acquire()
+        try:
+            if self._idle_source is not None:
+                gobject.source_remove(self._idle_source)
+                self._idle_source = None
+            for args, source in self._held.values():
+                gobject.source_remove(source)
+            self._pending = []
+            self._coalesced = {}
+            self._keys = {}
+            self._key_events = set()
+            self._held = {}
+            self._last_sent = {}
+        finally:
+            self._lock.release()
+            
+    def get_stats(self):
+        """
+        Get a dictionary of the counts of signals emitted and suppressed, each
+        a dictionary keyed by signal name.
+        """
+        self._lock.acquire()
+        try:
+            return { "emitted" : dict(self.emitted), "suppressed" : dict(self.suppressed) }
+        finally:
+            self._lock.release()
+    
+    """
+    Private
+    """
+    def _count(self, counters, signal_name, amount = 1):
+        counters[signal_name] = counters.get(signal_name, 0) + amount
+        
+    def _schedule(self):
+        if self._idle_source is None:
+            self._idle_source = gobject.idle_add(self._flush)
+            
+    def _release(self, key):
+        self._lock.acquire()
+        try:
+            held = self._held.pop(key, None)
+            if held is not None:
+                entry = [ key[0], key[1], held[0], key ]
+                self._coalesced[key] = entry
+                self._pending.append(entry)
+                self._schedule()
+        finally:
+            self._lock.release()
+        return False
+        
+    def _flush(self):
+        self._lock.acquire()
+        try:
+            self._idle_source = None
+            pending = self._pending
+            key_events = self._key_events
+            self._pending = []
+            self._coalesced = {}
+            self._keys = {}
+            self._key_events = set()
+            now = time.time()
+            for obj, signal_name, args, key in pending:
+                if key is not None and signal_name in self.rate_limits:
+                    self._last_sent[key] = now
+        finally:
+            self._lock.release()
+            
+        for obj, signal_name, args, key in pending:
+            try:
+                if signal_name == "KeysEvent":
+                    self._emit_keys(obj, args, obj in key_events)
+                else:
+                    getattr(obj, signal_name)(*args)
+                    self._count(self.emitted, signal_name)
+            except Exception as e:
+                logger.warning("Failed to send %s signal", signal_name, exc_info = e)
+        return False
+    
+    def _emit_keys(self, obj, events, key_event):
+        # One signal for each run of keys in the same state
+        start = 0
+        for i in range(1, len(events) + 1):
+            if i == len(events) or events[i][1] != events[start][1]:
+                run = [ k for k, state in events[start:i] ]
+                if events[start][1] == g15driver.KEY_STATE_UP:
+                    obj.KeysReleased(run)
+                    self._count(self.emitted, "KeysReleased")
+                else:
+                    obj.KeysPressed(run)
+                    self._count(self.emitted, "KeysPressed")
+                start = i
+        if key_event:
+            obj.KeysEvent([ ( k, KEY_STATE_NAMES[state] ) for k, state in events ])
+            self._count(self.emitted, "KeysEvent")
+
+"""
+The signal pipeline shared by all service objects
+"""
+signals = SignalQueue()
     
 class AbstractG15DBUSService(dbus.service.Object):
     
     def __init__(self, conn=None, object_path=None, bus_name=None):
         dbus.service.Object.__init__(self, conn, object_path, bus_name)
         self._reserved_keys = []
+        self._receive_key_events = False
         
     def action_performed(self, binding):
-        self.Action(binding.action)
+        signals.queue(self, "Action", [ binding.action ])
                     
     def handle_key(self, keys, state, post):
         if not post:
@@ -60,12 +304,13 @@ class AbstractG15DBUSService(dbus.service.Object):
                 if k in self._reserved_keys:
                     p.append(k)
             if len(p) > 0:
-                if state == g15driver.KEY_STATE_UP:
-                    gobject.idle_add(self.KeysReleased,p)
-                elif state == g15driver.KEY_STATE_DOWN:
-                    gobject.idle_add(self.KeysPressed, p)
+                if state in KEY_STATE_NAMES:
+                    signals.queue_keys(self, p, state, self._is_receive_key_events())
                 return True
             
+    def _is_receive_key_events(self):
+        return self._receive_key_events
+            
     def _set_receive_actions(self, enabled):
         if enabled and self in self._screen.key_handler.action_listeners:
             raise Exception("Already receiving actions")
@@ -142,6 +387,7 @@ class G15DBUSClient():
         self.bus_name = bus_name
         self.pages = []
         self.acquisitions = []
+        self.receive_key_events = False
         
     def cleanup(self):
         for p in list(self.pages):
@@ -216,8 +462,9 @@ class G15DBUSScreenService(AbstractG15DBUSService):
         logger.debug("Sending page changed signal for %s", page.id)
         if page.id in self._dbus_pages:
             dbus_page = self._dbus_pages[page.id]
-            self.PageChanged(dbus_page._bus_name)
-            logger.debug("Sent page changed signal for %s", page.id)
+            # Only the last page change in each main loop iteration is sent
+            signals.queue(self, "PageChanged", [ dbus_page._bus_name ], "")
+            logger.debug("Queued page changed signal for %s", page.id)
         else:
             logger.warning("Got page_changed event when no such page (%s) exists", page.id)
         
@@ -238,8 +485,8 @@ class G15DBUSScreenService(AbstractG15DBUSService):
             return
         logger.debug("Sending title changed signal for %s", page.id)
         dbus_page = self._dbus_pages[page.id]
-        self.PageTitleChanged(dbus_page._bus_name, title)
-        logger.debug("Sent title changed signal for %s", page.id)
+        signals.queue(self, "PageTitleChanged", [ dbus_page._bus_name, title ], dbus_page._bus_name)
+        logger.debug("Queued title changed signal for %s", page.id)
     
     def deleting_page(self, page):
         if g15scheduler.run_on_gobject(self.deleting_page, page):
@@ -255,6 +502,8 @@ class G15DBUSScreenService(AbstractG15DBUSService):
             dbus_page = self._dbus_pages[page.id]
             if dbus_page in page.key_handlers: 
                 page.key_handlers.remove(dbus_page)
+            # Nothing queued about the page may be sent after it is deleted
+            signals.discard_referring(self, dbus_page._bus_name)
             self.PageDeleting(dbus_page._bus_name, )
         else:
             logger.warning("DBUS Page %s is deleting, but it never existed. Huh? %s",
@@ -426,6 +675,11 @@ class G15DBUSScreenService(AbstractG15DBUSService):
     @dbus.service.method(SCREEN_IF_NAME, in_signature='b')
     def SetReceiveActions(self, enabled):
         self._set_receive_actions(enabled)
+        
+    @dbus.service.method(SCREEN_IF_NAME, in_signature='b', sender_keyword = 'sender')
+    def SetReceiveKeyEvents(self, enabled, sender = None):
+        # KeysEvent signals are sent while any connected client has asked for them
+        self._get_client(sender).receive_key_events = enabled
     
     """
     DBUS Signals
@@ -482,6 +736,10 @@ class G15DBUSScreenService(AbstractG15DBUSService):
     @dbus.service.signal(SCREEN_IF_NAME, signature='as')
     def KeysReleased(self, keys):
         pass
+    
+    @dbus.service.signal(SCREEN_IF_NAME, signature='a(ss)')
+    def KeysEvent(self, events):
+        pass
                     
     @dbus.service.signal(SCREEN_IF_NAME, signature='s')
     def Action(self, binding):
@@ -514,6 +772,12 @@ class G15DBUSScreenService(AbstractG15DBUSService):
             values.append(c.value)
         return values
     
+    def _is_receive_key_events(self):
+        for client in self._clients.values():
+            if client.receive_key_events:
+                return True
+        return False
+    
     def _get_screen_path(self):
         return "%s/%s" % ( SCREEN_NAME, self._screen.device.uid )
     
@@ -620,6 +884,10 @@ class G15DBUSPageService(AbstractG15DBUSService):
     @dbus.service.method(PAGE_IF_NAME, in_signature='', out_signature='b')
     def GetReceiveActions(self):
         return self in self._screen_service._screen.action_listeners
+            
+    @dbus.service.method(PAGE_IF_NAME, in_signature='b')
+    def SetReceiveKeyEvents(self, enabled):
+        self._receive_key_events = enabled
     
     @dbus.service.method(PAGE_IF_NAME, out_signature='n')
     def GetPriority(self):
@@ -754,6 +1022,10 @@ class G15DBUSPageService(AbstractG15DBUSService):
     def KeysReleased(self, keys):
         pass
                     
+    @dbus.service.signal(PAGE_IF_NAME, signature='a(ss)')
+    def KeysEvent(self, events):
+        pass
+                    
     @dbus.service.signal(PAGE_IF_NAME, signature='s')
     def Action(self, binding):
         pass    
@@ -831,6 +1103,7 @@ class G15DBUSService(AbstractG15DBUSService):
         for screen in self._dbus_screens:
             self._silently_remove_from_connector(self._dbus_screens[screen])    
         self._silently_remove_from_connector(self)
+        signals.clear()
         
     def _silently_remove_from_connector(self, obj):
         try:
@@ -954,6 +1227,17 @@ class G15DBUSService(AbstractG15DBUSService):
     def IsStopping(self):
         return self._service.shutting_down
 
+    @dbus.service.method(IF_NAME, in_signature='', out_signature='a{sa{sd}}')
+    def GetQueueStats(self):
+        stats = {}
+        for queue_name, queue_stats in g15scheduler.get_stats().items():
+            stats[queue_name] = dict((k, float(v)) for k, v in queue_stats.items())
+        return stats
+
+    @dbus.service.method(IF_NAME, in_signature='', out_signature='a{sa{su}}')
+    def GetSignalStats(self):
+        return signals.get_stats()
+
     @dbus.service.method(IF_NAME, out_signature='as')
     def GetDevices(self):
         l = []
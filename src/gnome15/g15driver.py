@@ -681,6 +681,15 @@ class AbstractDriver(object):
         """
         raise NotImplementedError( "Not implemented" )
     
+    def paint_region(self, image, region):
+        """
+        Repaint part of the screen. The image is the complete frame, but only
+        the area given by region (x, y, width, height) has changed since the
+        last frame painted. Drivers that can transfer part of a frame should
+        override this, by default the whole frame is painted.
+        """
+        self.paint(image)
+    
     
     def update_control(self, control):
         """
@@ -62,6 +62,55 @@ class KeyState():
     def __repr__(self):
         return "%s = %s [consumed = %s]" % (self.key, g15profile.to_key_state_name(self.state_id), str(self.consumed) )      
     
+class KeyIndex():
+    """
+    Index of macros (or action bindings) by the keys that activate them. Each
+    key is given a bit, so the set of keys needed by a macro is a mask that 
+    may be compared against the masks of the keys currently in each state.
+    Indexes that share the same bits dictionary may be tested against the 
+    same masks.
+    """
+    def __init__(self, bits):
+        """
+        Keyword arguments:
+        bits        -- dictionary of key to bit, shared between indexes
+        """
+        self.bits = bits
+        self.entries = []
+        self.by_key = {}
+        
+    def add(self, keys, item):
+        """
+        Add a macro or binding to the index
+        
+        Keyword arguments:
+        keys        -- keys that activate the item
+        item        -- macro or action binding
+        """
+        mask = 0
+        for k in keys:
+            bit = self.bits.get(k)
+            if bit is None:
+                bit = 1 << len(self.bits)
+                self.bits[k] = bit
+            mask |= bit
+        entry = ( mask, item )
+        self.entries.append(entry)
+        for k in set(keys):
+            self.by_key.setdefault(k, []).append(entry)
+            
+    def get_candidates(self, key = None):
+        """
+        Get a list of ( mask, item ) tuples for the items that use a key (in
+        the order they were added), or all items if key is None.
+        
+        Keyword arguments:
+        key        -- key or None for all items
+        """
+        if key is None:
+            return self.entries
+        return self.by_key.get(key, [])
+    
 class G15KeyHandler():
     """
     Main class for handling key events. There should be one instance of this
@@ -93,6 +142,12 @@ class G15KeyHandler():
         self.__normal_held_macros = []
         self.__notify_handles = []
         self.__key_states = {}
+        self.__key_bits = {}
+        self.__uinput_index = KeyIndex(self.__key_bits)
+        self.__normal_index = KeyIndex(self.__key_bits)
+        self.__normal_held_index = KeyIndex(self.__key_bits)
+        self.__action_keys = None
+        self.__action_index = KeyIndex(self.__key_bits)
         
     def get_key_states(self):
         # Get the current state of the keys
@@ -160,6 +215,61 @@ class G15KeyHandler():
         self.__normal_macros = []
         self.__uinput_macros = []
         self._build_macros()
+        self._build_index()
+        
+    def _build_index(self):
+        """
+        Index the macros of the current memory bank, and the action bindings, 
+        by the keys that activate them. This means a key event need only
+        consider the macros that use the key, and the state of all the keys 
+        a macro needs can be tested at once.
+        """
+        bits = {}
+        uinput_index = KeyIndex(bits)
+        for m in self.__uinput_macros:
+            uinput_index.add(m.keys, m)
+        normal_index = KeyIndex(bits)
+        for m in self.__normal_macros:
+            normal_index.add(m.keys, m)
+        normal_held_index = KeyIndex(bits)
+        for m in self.__normal_held_macros:
+            normal_held_index.add(m.keys, m)
+        action_index = KeyIndex(bits)
+        if self.__action_keys:
+            for action in self.__action_keys:
+                binding = self.__action_keys[action]
+                action_index.add(binding.keys, binding)
+        
+        self.__key_bits = bits
+        self.__uinput_index = uinput_index
+        self.__normal_index = normal_index
+        self.__normal_held_index = normal_held_index
+        self.__action_index = action_index
+        
+    def _get_state_masks(self):
+        """
+        Get masks of the keys that are not consumed, for each state. Returns
+        a tuple of masks for the keys that are up (including those with a
+        defeated release), up, down and held.
+        """
+        up_all = up = down = held = 0
+        bits = self.__key_bits
+        for k, key_state in self.__key_states.items():
+            bit = bits.get(k)
+            if bit is None or key_state.is_consumed():
+                continue
+            if key_state.state_id == g15driver.KEY_STATE_UP:
+                up_all |= bit
+                if not key_state.defeat_release:
+                    up |= bit
+            elif key_state.state_id == g15driver.KEY_STATE_DOWN:
+                down |= bit
+            elif key_state.state_id == g15driver.KEY_STATE_HELD:
+                held |= bit
+        return ( up_all, up, down, held )
+    
+    def _get_key_states_for(self, keys):
+        return [ self.__key_states[k] for k in keys ]
         
     def _do_key_received(self, keys, state_id):
         """
@@ -197,17 +307,17 @@ class G15KeyHandler():
                     a press of the Macro key equals a "press" of the virtual key,
                     a release of the Macro key equals a "release" of the virtual key etc.  
                     """
-                    self._handle_uinput_macros()
+                    self._handle_uinput_macros(key)
                     
                     """
                     Now the ordinary macros, processed on key_up
                     """
-                    self._handle_normal_macros()
+                    self._handle_normal_macros(key)
                     
                     """
                     Now the actions
                     """
-                    self._handle_actions()
+                    self._handle_actions(key)
                 
             """
             Now do the legacy 'post' handling.
@@ -230,98 +340,86 @@ class G15KeyHandler():
             """
             self.__screen.redraw()
             
-    def _handle_actions(self):
+    def _handle_actions(self, key = None):
         """
         This handles the default action bindings. The actions may have
         already re-mapped as a macro, in which case they will be ignored 
         here.
+        
+        Keyword arguments:
+        key        -- key that changed state, or None to check all bindings
         """
         action_keys = self.__screen.driver.get_action_keys()
+        if action_keys is not self.__action_keys:
+            self.__action_keys = action_keys
+            self._build_index()
         if action_keys:
-            for action in action_keys:
-                binding = action_keys[action]
-                f = 0
-                for k in binding.keys:
-                    if k in self.__key_states and \
-                            binding.state == self.__key_states[k].state_id and \
-                            not self.__key_states[k].is_consumed():
-                        f += 1
-                if f == len(binding.keys):
+            up_all, up, down, held = self._get_state_masks()
+            state_masks = { g15driver.KEY_STATE_UP : up_all,
+                            g15driver.KEY_STATE_DOWN : down,
+                            g15driver.KEY_STATE_HELD : held }
+            for mask, binding in self.__action_index.get_candidates(key):
+                if mask & state_masks.get(binding.state, 0) == mask:
                     self._action_performed(binding)
                     for k in binding.keys:
                         self.__key_states[k].consume_until_release = True
+                    up_all, up, down, held = self._get_state_masks()
+                    state_masks = { g15driver.KEY_STATE_UP : up_all,
+                                    g15driver.KEY_STATE_DOWN : down,
+                                    g15driver.KEY_STATE_HELD : held }
         
-    def _handle_normal_macros(self):
+    def _handle_normal_macros(self, key = None):
         """
         First check for any KEY_STATE_HELD macros. We do these first so KEY_STATE_UP
         macros don't consume the key states
+        
+        Keyword arguments:
+        key        -- key that changed state, or None to check all macros
         """        
-        for m in self.__normal_held_macros:
-            held = []
-            for k in m.keys:
-                if k in self.__key_states:
-                    key_state = self.__key_states[k]
-                    if not key_state.is_consumed() and key_state.state_id == g15driver.KEY_STATE_HELD:
-                        held.append(key_state)
-                        
-            if len(held) == len(m.keys):
-                self._handle_macro(m, g15driver.KEY_STATE_HELD, held)
+        up_all, up, down, held = self._get_state_masks()
+        for mask, m in self.__normal_held_index.get_candidates(key):
+            if mask & held == mask:
+                self._handle_macro(m, g15driver.KEY_STATE_HELD, self._get_key_states_for(m.keys))
+                up_all, up, down, held = self._get_state_masks()
         
         
         """
         Search for all the non-uinput macros that would be activated by the
         current key state. In this case, KEY_STATE_UP macros are looked for
         """
-        for m in self.__normal_macros:
-            up = []
-            held = []
-            down = []
-            for k in m.keys:
-                if k in self.__key_states:
-                    key_state = self.__key_states[k]
-                    if not key_state.is_consumed() and key_state.state_id == g15driver.KEY_STATE_DOWN:
-                        down.append(key_state)
-                    if not key_state.is_consumed() and key_state.state_id == g15driver.KEY_STATE_UP and not key_state.defeat_release:
-                        up.append(key_state)
-                    if not key_state.is_consumed() and key_state.state_id == g15driver.KEY_STATE_HELD:
-                        held.append(key_state)
-                        
-            if len(up) == len(m.keys):
-                self._handle_macro(m, g15driver.KEY_STATE_UP, up)
-            if len(down) == len(m.keys):
-                self._handle_macro(m, g15driver.KEY_STATE_DOWN, down)
-            if len(held) == len(m.keys):
-                self._handle_macro(m, g15driver.KEY_STATE_HELD, held)
+        for mask, m in self.__normal_index.get_candidates(key):
+            if mask & up == mask:
+                self._handle_macro(m, g15driver.KEY_STATE_UP, self._get_key_states_for(m.keys))
+            elif mask & down == mask:
+                self._handle_macro(m, g15driver.KEY_STATE_DOWN, self._get_key_states_for(m.keys))
+            elif mask & held == mask:
+                self._handle_macro(m, g15driver.KEY_STATE_HELD, self._get_key_states_for(m.keys))
+            else:
+                continue
+            up_all, up, down, held = self._get_state_masks()
                 
             
-    def _handle_uinput_macros(self):
+    def _handle_uinput_macros(self, key = None):
         """
         Search for all the uinput macros that would be activated by the
         current key state, and emit events of the same type.
+        
+        Keyword arguments:
+        key        -- key that changed state, or None to check all macros
         """
         uinput_repeat = False
-        for m in self.__uinput_macros:
-            down = []
-            up = []
-            held = []
-            for k in m.keys:
-                if k in self.__key_states:
-                    key_state = self.__key_states[k]
-                    if not key_state.is_consumed():
-                        if key_state.state_id == g15driver.KEY_STATE_UP and not key_state.defeat_release:
-                            up.append(key_state)
-                        if key_state.state_id == g15driver.KEY_STATE_DOWN:
-                            down.append(key_state)
-                        if key_state.state_id == g15driver.KEY_STATE_HELD:
-                            held.append(key_state)
-                        
-            if len(down) == len(m.keys):
-                self._handle_uinput_macro(m, g15driver.KEY_STATE_DOWN, down)
-            if len(up) == len(m.keys):
-                self._handle_uinput_macro(m, g15driver.KEY_STATE_UP, up)
-            if len(held) == len(m.keys):
-                self._handle_uinput_macro(m, g15driver.KEY_STATE_HELD, held)
+        up_all, up, down, held = self._get_state_masks()
+        for mask, m in self.__uinput_index.get_candidates(key):
+            if mask & down == mask:
+                self._handle_uinput_macro(m, g15driver.KEY_STATE_DOWN, self._get_key_states_for(m.keys))
+            elif mask & up == mask:
+                self._handle_uinput_macro(m, g15driver.KEY_STATE_UP, self._get_key_states_for(m.keys))
+            elif mask & held == mask:
+                self._handle_uinput_macro(m, g15driver.KEY_STATE_HELD, self._get_key_states_for(m.keys))
                 uinput_repeat = True
+            else:
+                continue
+            up_all, up, down, held = self._get_state_masks()
                                 
         """
         Simulate a uinput repeat by just handling an empty key list.
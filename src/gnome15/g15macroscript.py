@@ -0,0 +1,151 @@
+#  Gnome15 - Suite of tools for the Logitech G series keyboards and headsets
+#  Copyright (C) 2010 Brett Smith <tanktarta@blueyonder.co.uk>
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Compiles macro scripts into a list of operations that may be executed without
+any further parsing. Each line of a script is one of :-
+
+Delay <milliseconds>
+Press <character>
+Release <character>
+Upress <uinput code> <device type>
+Urelease <uinput code> <device type>
+Wait <release|hold>
+Label <name>
+Goto <label>
+
+Operation names, labels and the arguments of Wait are case insensitive. Labels
+are resolved to positions, uinput codes are looked up and arguments are
+checked when the script is compiled. Invalid lines are reported once, and
+then ignored when the script runs.
+"""
+
+import g15driver
+import g15uinput
+
+# Logging
+import logging
+logger = logging.getLogger(__name__)
+
+"""
+Operation codes
+"""
+OP_DELAY = 0
+OP_PRESS = 1
+OP_RELEASE = 2
+OP_UPRESS = 3
+OP_URELEASE = 4
+OP_WAIT = 5
+OP_GOTO = 6
+
+class CompiledScript(object):
+    """
+    A compiled macro script. The operations are tuples of the operation
+    code and up to two (already converted) arguments :-
+
+    ( OP_DELAY, seconds, None )
+    ( OP_PRESS, character, None )
+    ( OP_RELEASE, character, None )
+    ( OP_UPRESS, uinput code, device type )
+    ( OP_URELEASE, uinput code, device type )
+    ( OP_WAIT, key state to wait for, None )
+    ( OP_GOTO, index of operation to continue at, None )
+    """
+
+    def __init__(self, text, activate_on, ops, errors):
+        self.text = text
+        self.activate_on = activate_on
+        self.ops = ops
+        self.errors = errors
+
+def compile_script(text, activate_on):
+    """
+    Compile a macro script.
+
+    Keyword arguments:
+    text          -- script text
+    activate_on   -- key state the macro is activated on, which determines
+                     which Wait operations are allowed
+    """
+    ops = []
+    errors = []
+    labels = {}
+    gotos = []
+
+    def error(line_no, message, *args):
+        message = "%s (line %d of macro script)" % ( message % args, line_no + 1 )
+        logger.error(message)
+        errors.append(message)
+
+    for line_no, line in enumerate(text.split("\n")):
+        split = line.strip().split(" ")
+        op = split[0].lower()
+        if op == "":
+            continue
+        if len(split) < 2:
+            error(line_no, "Insufficient arguments in macro script. '%s'", line)
+            continue
+
+        val = split[1]
+        if op == "label":
+            labels[val.lower()] = len(ops)
+        elif op == "goto":
+            gotos.append(( line_no, len(ops), val.lower() ))
+            ops.append(( OP_GOTO, -1, None ))
+        elif op == "delay":
+            try:
+                ops.append(( OP_DELAY, float(val) / 1000.0, None ))
+            except ValueError:
+                error(line_no, "Invalid delay '%s'", val)
+        elif op == "press":
+            ops.append(( OP_PRESS, val, None ))
+        elif op == "release":
+            ops.append(( OP_RELEASE, val, None ))
+        elif op in [ "upress", "urelease" ]:
+            if len(split) < 3:
+                error(line_no, "Invalid operation in macro script. '%s'", line)
+            elif not split[2] in g15uinput.DEVICE_TYPES:
+                error(line_no, "Unknown uinput device type %s.", split[2])
+            elif not val in g15uinput.capabilities:
+                error(line_no, "Unknown uinput key %s.", val)
+            else:
+                ops.append(( OP_UPRESS if op == "upress" else OP_URELEASE, g15uinput.capabilities[val], split[2] ))
+        elif op == "wait":
+            val = val.lower()
+            if val == "release":
+                if activate_on == g15driver.KEY_STATE_UP:
+                    error(line_no, "WaitRelease cannot be used with macros that activate on release")
+                else:
+                    ops.append(( OP_WAIT, g15driver.KEY_STATE_UP, None ))
+            elif val == "hold":
+                if activate_on == g15driver.KEY_STATE_DOWN:
+                    ops.append(( OP_WAIT, g15driver.KEY_STATE_HELD, None ))
+                else:
+                    error(line_no, "WaitHold cannot be used with macros that activate on hold or release")
+            else:
+                error(line_no, "Wait may only have an argument of release or hold")
+        else:
+            error(line_no, "Invalid operation in macro script. '%s'", line)
+
+    # Resolve the labels. Unknown labels are ignored, so just continue with the next operation
+    for line_no, index, label in gotos:
+        if label in labels:
+            ops[index] = ( OP_GOTO, labels[label], None )
+        else:
+            logger.warning("Unknown goto label %s in macro script. Ignoring", label)
+            ops[index] = ( OP_GOTO, index + 1, None )
+
+    return CompiledScript(text, activate_on, ops, errors)
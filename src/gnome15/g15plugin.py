@@ -23,6 +23,12 @@ import g15screen
 import sys
 import gobject
 
+"""
+Queue refreshing plugins are refreshed on. Slow refreshes (RSS, weather, mail)
+may run alongside each other here without holding up jobs on the default queue
+"""
+REFRESH_QUEUE = "refreshQueue"
+
 class G15Plugin():
     
     """
@@ -263,8 +269,12 @@ class G15RefreshingPlugin(G15PagePlugin):
     '''
         
     def _reschedule_refresh(self):
-        self._cancel_refresh()
-        self._schedule_refresh()
+        if self.timer != None and not isinstance(self.timer, int):
+            # Re-use the existing timer
+            self.timer.reschedule(self.get_next_tick())
+        else:
+            self._cancel_refresh()
+            self._schedule_refresh()
         
     def _cancel_refresh(self):
         if self.timer != None:
@@ -278,9 +288,10 @@ class G15RefreshingPlugin(G15PagePlugin):
         if self.schedule_on_gobject:
             self.timer = gobject.timeout_add(int(self.get_next_tick() * 1000), self._refresh)
         else:
-            self.timer = g15scheduler.schedule("%s-Redraw" % self.page_id,
-                                               self.get_next_tick(),
-                                               self._refresh)
+            self.timer = g15scheduler.queue(REFRESH_QUEUE,
+                                            "%s-Redraw" % self.page_id,
+                                            self.get_next_tick(),
+                                            self._refresh)
         
     def _refresh(self):
         if self.page and (not self.only_refresh_when_visible or self.screen.is_visible(self.page)):
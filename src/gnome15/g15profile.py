@@ -33,6 +33,7 @@ import g15actions
 import g15devices
 import g15uinput
 import g15driver
+import g15macroscript
 import ConfigParser
 import codecs
 import os.path
@@ -41,6 +42,7 @@ import pyinotify
 import logging
 import re
 import zipfile
+from threading import RLock
 from cStringIO import StringIO
  
 logger = logging.getLogger(__name__)
@@ -55,12 +57,154 @@ to be informed when macro profiles change
 profile_listeners = []
 
 wm = pyinotify.WatchManager()
-mask = pyinotify.IN_DELETE | pyinotify.IN_MODIFY | pyinotify.IN_CREATE | pyinotify.IN_ATTRIB  # watched events
+mask = pyinotify.IN_DELETE | pyinotify.IN_MODIFY | pyinotify.IN_CREATE | pyinotify.IN_ATTRIB | \
+    pyinotify.IN_MOVED_TO | pyinotify.IN_MOVED_FROM  # watched events
 
 # Create macro profiles directory
 conf_dir = os.path.join(g15globals.user_config_dir, "macro_profiles")
 g15os.mkdir_p(conf_dir)
 
+class ProfileStore(object):
+    """
+    Process wide store of loaded profiles. Each profile file is parsed once,
+    and the same G15Profile instance is then handed to every caller until the
+    file changes. These instances are marked as shared, and may not be changed
+    (use edit_profile() to get a copy that may be changed and saved). Changes are detected by the inotify watch on the user's
+    profile directory, or by saving or deleting through G15Profile. Profiles
+    in directories registered by plugins are not watched, so these are checked
+    against the modification time of the file instead.
+    
+    Every invalidation increments the generation, so anything built from the
+    profiles (such as the key handler's macro lists) may cheaply tell if it
+    needs to be rebuilt.
+    """
+    
+    def __init__(self):
+        self.generation = 0
+        self._lock = RLock()
+        self._profiles = {}
+        self._listings = {}
+        
+    def get_profile(self, device, profile_dir, profile_id):
+        """
+        Get the shared instance of a profile, loading it if it is not yet
+        known. None is returned if the directory contains no such profile.
+        
+        Keyword arguments:
+        device        -- device associated with profile
+        profile_dir   -- directory containing the profile
+        profile_id    -- ID of profile
+        """
+        profile_id = str(profile_id)
+        if not profile_id in self.get_profile_ids(profile_dir):
+            return None
+        path = os.path.join(profile_dir, "%s.macros" % profile_id)
+        key = ( device.uid, path )
+        self._lock.acquire()
+        try:
+            entry = self._profiles.get(key)
+            generation = self.generation
+        finally:
+            self._lock.release()
+        stamp = self._get_stamp(path)
+        if entry is not None and entry[0] == stamp:
+            return entry[1]
+        
+        # Parse outside of the lock, the inotify thread must not be held up
+        profile = G15Profile(device, profile_id, file_path = path)
+        profile.shared = True
+        self._lock.acquire()
+        try:
+            if self.generation == generation:
+                self._profiles[key] = ( stamp, profile )
+        finally:
+            self._lock.release()
+        return profile
+    
+    def get_profile_ids(self, profile_dir):
+        """
+        Get the IDs of all profiles in a directory, in the order they are
+        listed by the file system.
+        
+        Keyword arguments:
+        profile_dir   -- directory containing the profiles
+        """
+        stamp = self._get_stamp(profile_dir)
+        self._lock.acquire()
+        try:
+            entry = self._listings.get(profile_dir)
+            generation = self.generation
+        finally:
+            self._lock.release()
+        if entry is not None and entry[0] == stamp:
+            return entry[1]
+        
+        profile_ids = []
+        if os.path.exists(profile_dir):
+            for filename in os.listdir(profile_dir):
+                if not filename.startswith(".") and filename.endswith(".macros"):
+                    profile_ids.append(".".join(filename.split(".")[:-1]))
+        self._lock.acquire()
+        try:
+            if self.generation == generation:
+                self._listings[profile_dir] = ( stamp, profile_ids )
+        finally:
+            self._lock.release()
+        return profile_ids
+        
+    def invalidate(self, path):
+        """
+        Discard anything loaded from a profile file (or the directory
+        containing it) and increment the generation.
+        
+        Keyword arguments:
+        path          -- path of profile file that changed
+        """
+        path = os.path.abspath(path)
+        self._lock.acquire()
+        try:
+            for key in [ k for k in self._profiles if k[1] == path ]:
+                del self._profiles[key]
+            self._listings.pop(os.path.dirname(path), None)
+            self.generation += 1
+        finally:
+            self._lock.release()
+            
+    def clear(self):
+        """
+        Discard all loaded profiles and increment the generation.
+        """
+        self._lock.acquire()
+        try:
+            self._profiles.clear()
+            self._listings.clear()
+            self.generation += 1
+        finally:
+            self._lock.release()
+            
+    """
+    Private
+    """
+    def _get_stamp(self, path):
+        if path.startswith(conf_dir + os.sep):
+            # Changes are reported by inotify
+            return None
+        try:
+            st = os.stat(path)
+            return ( st.st_mtime, st.st_size )
+        except OSError:
+            return -1
+
+profile_store = ProfileStore()
+
+def get_generation():
+    """
+    Get the current generation of the profile store. This changes every time
+    a profile is created, modified or deleted, so may be compared with a
+    previously obtained value to tell if anything built from profiles is stale.
+    """
+    return profile_store.generation
+
 class EventHandler(pyinotify.ProcessEvent):
     """
     Event handle the listens for the inotify events and informs all callbacks
@@ -77,6 +221,7 @@ class EventHandler(pyinotify.ProcessEvent):
     def _notify(self, event):
         ids = self._get_profile_ids(event)
         if ids:
+            profile_store.invalidate(event.pathname)
             for profile_listener in profile_listeners:
                 profile_listener(ids[0], ids[1])
         
@@ -91,12 +236,18 @@ class EventHandler(pyinotify.ProcessEvent):
 
     def process_IN_DELETE(self, event):
         self._notify(event)
+        
+    def process_IN_MOVED_TO(self, event):
+        self._notify(event)
+        
+    def process_IN_MOVED_FROM(self, event):
+        self._notify(event)
 
 notifier = pyinotify.ThreadedNotifier(wm, EventHandler())
 notifier.name = "ProfilePyInotify"
 notifier.setDaemon(True)
 notifier.start()
-wdd = wm.add_watch(conf_dir, mask, rec=True)
+wdd = wm.add_watch(conf_dir, mask, rec=True, auto_add=True)
 
 
 '''
@@ -131,8 +282,17 @@ Defaults
 """
 DEFAULT_REPEAT_DELAY = -1.0
 
+"""
+Python's regular expressions are limited to 100 named groups, so the 
+patterns of many profiles are combined into several expressions of at
+most this many alternatives
+"""
+MAX_PATTERNS_PER_EXPRESSION = 90
+
 
 __profile_dirs = []
+__matchers = {}
+__matchers_lock = RLock()
 
 def add_profile_dir(profile_dir):
     '''
@@ -168,22 +328,18 @@ def get_profile_by_name(device, name):
 
 def get_profiles(device):
     '''
-    Get list of all configured macro profiles for the specified device.
+    Get list of all configured macro profiles for the specified device. The
+    profiles are shared instances from the profile store, see get_profile().
     
     Keyword arguments:
     device        -- device associated with profiles
     '''
     profiles = []
     for profile_dir in get_all_profile_dirs(device):
-        if os.path.exists(profile_dir):
-            for profile in os.listdir(profile_dir):
-                if not profile.startswith(".") and profile.endswith(".macros"):
-                    profile_id = ".".join(profile.split(".")[:-1])
-                    profile_object = G15Profile(device, profile_id, \
-                                               file_path = "%s/%s" % \
-                                               ( profile_dir, profile ))
-                    if device.model_id in profile_object.models:
-                        profiles.append(profile_object)
+        for profile_id in profile_store.get_profile_ids(profile_dir):
+            profile_object = profile_store.get_profile(device, profile_dir, profile_id)
+            if profile_object is not None and device.model_id in profile_object.models:
+                profiles.append(profile_object)
                         
     if len(profiles) == 0:
         return [ create_default(device) ]
@@ -216,7 +372,7 @@ def create_default(device):
         default_profile.activate_on_focus = True
         default_profile.activate_on_launch = False
         create_profile(default_profile)
-        wdd = wm.add_watch(conf_dir, mask, rec=True)
+        wdd = wm.add_watch(conf_dir, mask, rec=True, auto_add=True)
     return get_default_profile(device)
 
 def create_profile(profile):
@@ -238,8 +394,24 @@ def generate_profile_id():
 def get_profile(device, profile_id):
     """
     Get a profile given the device it is associated with and it's ID. The
-    profile will be fully loaded on return. The object returned will be a 
-    new instance.
+    profile will be fully loaded on return. The object returned is shared
+    with all other callers until the profile file changes, so may not be
+    changed. Use edit_profile() or load_profile() to get a private copy.
+    
+    Keyword arguments:
+    device        -- device associated with profile
+    profile_id    -- ID of profile to load
+    """
+    for profile_dir in get_all_profile_dirs(device):
+        profile = profile_store.get_profile(device, profile_dir, profile_id)
+        if profile is not None:
+            return profile
+    
+def load_profile(device, profile_id):
+    """
+    Load a profile given the device it is associated with and it's ID. Unlike
+    get_profile(), the file is always read and the object returned will be a 
+    new instance that may be freely modified.
     
     Keyword arguments:
     device        -- device associated with profile
@@ -250,6 +422,20 @@ def get_profile(device, profile_id):
         if os.path.exists(path):
             return G15Profile(device, profile_id, file_path = path);
 
+def edit_profile(profile):
+    """
+    Get a copy of a profile that may be changed and saved. Shared profiles
+    (from get_profile(), get_profiles() or get_active_profile()) are loaded
+    again from disk, anything else is returned as is. Other callers will see
+    the changes once the copy is saved.
+    
+    Keyword arguments:
+    profile       -- profile to edit
+    """
+    if not profile.shared:
+        return profile
+    return G15Profile(profile.device, profile.id, file_path = profile.filename)
+
 def get_active_profile(device):
     """
     Get the currently active profile for the specified device. This will
@@ -379,9 +565,25 @@ def find_profile_for_command(args, device):
         
     logger.info("Processed command '%s'", command_line)
     
-    for p in get_profiles(device):
-        if p.can_launch(command_line):
-            return p
+    return get_matcher(device).match_command(command_line)
+
+def get_matcher(device):
+    """
+    Get the ProfileMatcher for a device. The matcher is built on first use,
+    and rebuilt whenever the profile store generation changes.
+    
+    Keyword arguments:
+    device      --  device
+    """
+    __matchers_lock.acquire()
+    try:
+        matcher = __matchers.get(device.uid)
+        if matcher is None or matcher.generation != get_generation():
+            matcher = ProfileMatcher(device)
+            __matchers[device.uid] = matcher
+        return matcher
+    finally:
+        __matchers_lock.release()
         
 def to_key_state_name(key_state_id):
     """
@@ -407,6 +609,168 @@ def clone_macro(macro):
     m.type = macro.type
     m.repeat_delay = macro.repeat_delay
     return m
+
+class PatternIndex(object):
+    """
+    Finds which of a list of profiles has a pattern matching some text, 
+    using as few regular expression searches as possible. The patterns are
+    combined into alternations, so text that matches nothing (by far the
+    most common case) is scanned once per expression rather than once per
+    profile. When more than one pattern matches, the profile that was added
+    first wins, just as if each pattern had been tried in turn.
+    
+    Patterns that cannot be combined (those containing back references or
+    inline flags, or group names that clash with other patterns) are 
+    searched separately.
+    """
+    
+    def __init__(self, patterns, flags = 0):
+        """
+        Keyword arguments:
+        patterns      -- list of ( profile, regular expression ) tuples
+        flags         -- flags to compile the expressions with
+        """
+        self.expressions = []
+        self.separate = []
+        self._flags = flags
+        self._prefixes = {}
+        chunk = []
+        for index, ( profile, pattern ) in enumerate(patterns):
+            try:
+                compiled = re.compile(pattern, flags)
+            except re.error as e:
+                logger.warning("Ignoring invalid pattern '%s' in profile %s. %s", pattern, profile.name, e)
+                continue
+            if ( compiled.groups > 0 and re.search(r"\\[1-9]|\(\?P=", pattern) ) or \
+                    re.search(r"\(\?[iLmsux]+\)", pattern):
+                # Back references would be renumbered, and inline flags would
+                # apply to every pattern in the expression
+                self.separate.append(( index, profile, compiled ))
+                continue
+            chunk.append(( index, profile, pattern, compiled ))
+            if len(chunk) == MAX_PATTERNS_PER_EXPRESSION:
+                self._add_expression(chunk)
+                chunk = []
+        if len(chunk) > 0:
+            self._add_expression(chunk)
+            
+    def search(self, text):
+        """
+        Get the first profile with a pattern that matches the text, or None.
+        
+        Keyword arguments:
+        text          -- text to search
+        """
+        found = None
+        for expression, chunk in self.expressions:
+            # Chunks are in the order the patterns were added, so the first
+            # with a match holds the first matching combined pattern
+            member = self._first_match(expression, chunk, text)
+            if member is not None:
+                found = ( member[0], member[1] )
+                break
+        for index, profile, compiled in self.separate:
+            if found is not None and index > found[0]:
+                break
+            if compiled.search(text):
+                found = ( index, profile )
+                break
+        return found[1] if found is not None else None
+            
+    """
+    Private
+    """
+    def _first_match(self, expression, chunk, text):
+        # The leftmost match in the text may not be from the first pattern
+        # that matches, so keep searching just the patterns before it
+        member = None
+        while True:
+            match = expression.search(text)
+            if match is None:
+                return member
+            position = int(match.lastgroup[5:])
+            member = chunk[position]
+            if position == 0:
+                return member
+            expression = self._get_prefix(chunk, position)
+            
+    def _get_prefix(self, chunk, length):
+        key = ( chunk[0][0], length )
+        expression = self._prefixes.get(key)
+        if expression is None:
+            expression = self._combine(chunk[:length])
+            self._prefixes[key] = expression
+        return expression
+            
+    def _combine(self, chunk):
+        alternatives = [ "(?P<_g15p%d>%s)" % ( i, c[2] ) for i, c in enumerate(chunk) ]
+        return re.compile("|".join(alternatives), self._flags)
+    
+    def _add_expression(self, chunk):
+        try:
+            self.expressions.append(( self._combine(chunk), chunk ))
+        except ( re.error, AssertionError ) as e:
+            logger.debug("Could not combine patterns, searching them separately", exc_info = e)
+            self.separate += [ ( c[0], c[1], c[3] ) for c in chunk ]
+            self.separate.sort(key = lambda s: s[0])
+
+class ProfileMatcher(object):
+    """
+    Chooses the profiles to activate when a window gains focus or an 
+    application is launched, using a PatternIndex built from the window
+    names and launch patterns of all of a device's profiles. Matchers are
+    obtained using get_matcher(), which builds a new one whenever the
+    profiles change.
+    """
+    
+    def __init__(self, device):
+        """
+        Keyword arguments:
+        device        -- device
+        """
+        self.device = device
+        self.generation = get_generation()
+        self._last_window = None
+        
+        default_profile = get_default_profile(device)
+        window_patterns = []
+        launch_patterns = []
+        for profile in get_profiles(device):
+            if profile.activate_on_focus and profile.window_name and profile != default_profile:
+                pattern = profile.window_name if profile.window_name_regex else re.escape(profile.window_name)
+                window_patterns.append(( profile, pattern ))
+            if profile.launch_pattern:
+                launch_patterns.append(( profile, profile.launch_pattern ))
+                
+        self._windows = PatternIndex(window_patterns, re.IGNORECASE | re.UNICODE)
+        self._commands = PatternIndex(launch_patterns)
+        
+    def match_window(self, window_name):
+        """
+        Get the profile that should be activated when a window with the
+        given name (or application name) gains focus, or None if no profile
+        other than the default is interested. The last result is remembered,
+        as the same window usually gains focus repeatedly.
+        
+        Keyword arguments:
+        window_name   -- window or application name
+        """
+        last = self._last_window
+        if last is not None and last[0] == window_name:
+            return last[1]
+        profile = self._windows.search(window_name)
+        self._last_window = ( window_name, profile )
+        return profile
+    
+    def match_command(self, command_line):
+        """
+        Get the profile that should be used to launch a command. See
+        find_profile_for_command().
+        
+        Keyword arguments:
+        command_line  -- command line, with each argument wrapped in quotes
+        """
+        return self._commands.search(command_line)
         
 
 class G15Macro(object):
@@ -440,6 +804,7 @@ class G15Macro(object):
         self.repeat_mode = REPEAT_WHILE_HELD
         self.type = MACRO_SCRIPT
         self.repeat_delay = DEFAULT_REPEAT_DELAY 
+        self._script = None
         section_name = "m%d" % self.memory
         if not self.profile.parser.has_section(section_name):
             self.profile.parser.add_section(section_name)
@@ -475,6 +840,18 @@ class G15Macro(object):
             raise Exception("Macro of type %s, is not a type that maps to a uinput code." % self.type)
         return g15uinput.capabilities[self.macro][1] if self.macro in g15uinput.capabilities else 0
     
+    def get_script(self):
+        """
+        Get the compiled form of this macro's script (see g15macroscript). The
+        script is compiled once, and recompiled only if the macro text or the
+        state it activates on changes.
+        """
+        script = self._script
+        if script is None or script.text != self.macro or script.activate_on != self.activate_on:
+            script = g15macroscript.compile_script(self.macro, self.activate_on)
+            self._script = script
+        return script
+    
     def set_keys(self, keys):
         """
         Set the list of keys this macro requires to activate.
@@ -678,6 +1055,7 @@ class G15Profile(object):
         
         self.device = device
         self.read_only = False
+        self.shared = False
         self.parser = ConfigParser.ConfigParser({
                                                      })        
         self.name = None
@@ -701,6 +1079,7 @@ class G15Profile(object):
         self.monitor = [ "stdout" ]
         self.models = [ device.model_id ]
         self.window_name = ""
+        self.window_name_regex = False
         self.base_profile = None
         self.version = 2.1
         self.plugins_mode = ALL_PLUGINS
@@ -729,7 +1108,7 @@ class G15Profile(object):
         Keyword arguments:
         filename    --    file to save copy to
         """
-        profile_copy = get_profile(self.device, self.id)
+        profile_copy = load_profile(self.device, self.id)
         
         archive_file = zipfile.ZipFile(filename, "w", compression = zipfile.ZIP_DEFLATED)
         try:
@@ -787,6 +1166,7 @@ class G15Profile(object):
         """
         if self.read_only:
             raise Exception("Cannot write to read-only profile")
+        self._check_not_shared()
         logger.info("Saving macro profile %s, %s", self.id, self.name)
         if filename is None:
             filename = self.filename
@@ -800,6 +1180,10 @@ class G15Profile(object):
         self.parser.set("DEFAULT", "version", str(self.version))
         self.parser.set("DEFAULT", "icon", self.icon)
         self.parser.set("DEFAULT", "window_name", self.window_name)
+        if self.window_name_regex:
+            self.parser.set("DEFAULT", "window_name_regex", str(self.window_name_regex))
+        else:
+            self._remove_if_exists("window_name_regex")
         if self.version == 1.0:
             self.parser.set("DEFAULT", "base_profile", str(self.base_profile) if self.base_profile is not None else "-1")
         else:   
@@ -850,6 +1234,7 @@ class G15Profile(object):
         self._write(filename)
         
     def set_id(self, profile_id):
+        self._check_not_shared()
         self.id = str(profile_id)
         self.read_only = False
         self.filename = "%s/%s/%s.macros" % ( conf_dir, self.device.uid, self.id )
@@ -878,6 +1263,7 @@ class G15Profile(object):
         memory     --     memory bank number
         rgb        --     colour to assign to bank
         """
+        self._check_not_shared()
         self.mkey_color[memory] = rgb
         
     def get_mkey_color(self, memory):
@@ -895,6 +1281,7 @@ class G15Profile(object):
         Delete this macro profile
         """
         os.remove(self.filename)
+        profile_store.invalidate(self.filename)
         
     def delete_macro(self, activate_on, memory, keys):
         """
@@ -906,6 +1293,7 @@ class G15Profile(object):
         memory        -- memory bank number (starts at 1)
         keys          -- keys that activate the macro
         """
+        self._check_not_shared()
         section_name = self._get_section_name(activate_on, memory)     
         key_list_key = get_keys_key(keys)
         logger.info("Deleting macro M%d, for %s", memory, key_list_key)
@@ -966,6 +1354,7 @@ class G15Profile(object):
         type          --     macro type
         macro         --     content of macro
         """
+        self._check_not_shared()
         key_list_key = get_keys_key(keys)  
         logger.info("Creating macro M%d, for %s", memory, key_list_key)
         new_macro = G15Macro(self, memory, key_list_key, activate_on)
@@ -1049,6 +1438,7 @@ class G15Profile(object):
         self.background = self.parser.get("DEFAULT", "background").strip() if self.parser.has_option("DEFAULT", "background") else ""
         self.author = self.parser.get("DEFAULT", "author").strip() if self.parser.has_option("DEFAULT", "author") else ""
         self.window_name = self.parser.get("DEFAULT", "window_name").strip() if self.parser.has_option("DEFAULT", "window_name") else ""
+        self.window_name_regex = self.parser.getboolean("DEFAULT", "window_name_regex") if self.parser.has_option("DEFAULT", "window_name_regex") else False
         self.models = self.parser.get("DEFAULT", "models").strip().split(",") if self.parser.has_option("DEFAULT", "models") else [ self.device.model_id ]
         self.plugins_mode = self.parser.get("DEFAULT", "plugins_mode").strip() if self.parser.has_option("DEFAULT", "plugins_mode") else ALL_PLUGINS
         self.selected_plugins = self.parser.get("DEFAULT", "selected_plugins").strip().split(",") \
@@ -1118,6 +1508,10 @@ class G15Profile(object):
     def _comparator(self, o1, o2):
         return o1.compare(o2)
                     
+    def _check_not_shared(self):
+        if self.shared:
+            raise Exception("Profile %s is shared and may not be changed. Use edit_profile() to get a copy that may be changed" % self.id)
+        
     def _remove_if_exists(self, name, section = "DEFAULT"):
         if self.parser.has_option(section, name):
             self.parser.remove_option(section, name)
@@ -1159,6 +1553,7 @@ class G15Profile(object):
                 os.utime(save_file, None)
             finally:
                 fhandle.close()
+            profile_store.invalidate(save_file)
         else:
             self.parser.write(save_file)
         
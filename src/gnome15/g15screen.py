@@ -34,6 +34,12 @@ PRI_NORMAL = 50
 PRI_LOW = 20
 PRI_INVISIBLE = 0
 
+"""
+Default maximum frame rates for monochrome and colour LCDs. 
+"""
+DEFAULT_MAX_FPS = 10
+DEFAULT_COLOR_MAX_FPS = 30
+
 """
 Paint stages
 """
@@ -58,12 +64,14 @@ import g15keyboard
 import g15theme
 import g15actions
 import time
+import math
 import threading
 import cairo
 import gconf
 import os.path
 import sys
 import logging
+from collections import OrderedDict
 from threading import RLock
 from g15exceptions import NotConnectedException
 from g15exceptions import RetryException
@@ -244,7 +252,10 @@ class Painter():
         
     def paint(self, canvas):
         """
-        Subclasses must override to do the actual painting
+        Subclasses must override to do the actual painting. If only part of
+        the screen needs repainting, the canvas will already be clipped to
+        the damaged area. To repaint just the area a painter has changed,
+        pass the region to G15Screen.redraw().
         
         Keyword arguments:
         canvas            -- canvas
@@ -252,6 +263,143 @@ class Painter():
         raise Exception("Not implemented")
     
     
+class RedrawRequest():
+    """
+    A redraw that has been requested but not yet performed
+    """
+    
+    def __init__(self, page, direction, transitions, redraw_content):
+        self.page = page
+        self.direction = direction
+        self.transitions = transitions
+        self.redraw_content = redraw_content
+        
+    def merge(self, direction, transitions, redraw_content):
+        self.direction = direction
+        self.transitions = self.transitions or transitions
+        self.redraw_content = self.redraw_content or redraw_content
+        
+class RedrawScheduler():
+    """
+    Governs the rate at which a screen is redrawn. Rather than every call to
+    G15Screen.redraw() producing a frame, requests are held until the next
+    frame is due. Any requests made while one is pending are merged into it
+    (one per page), so no matter how quickly redraws are requested, at most
+    one frame is waiting to be drawn and frames are never drawn faster than
+    the maximum frame rate.
+    """
+    
+    def __init__(self, screen):
+        self.screen = screen
+        self.max_fps = DEFAULT_MAX_FPS
+        self.pending = OrderedDict()
+        self.scheduled = False
+        self.last_frame = 0
+        self.requests = 0
+        self.frames = 0
+        self.dropped_frames = 0
+        self.lock = RLock()
+        
+    def set_max_fps(self, max_fps):
+        """
+        Set the maximum number of frames to draw per second. Zero means no
+        limit.
+        
+        Keyword arguments:
+        max_fps            -- maximum frames per second
+        """
+        self.max_fps = max_fps
+        
+    def request(self, page, direction, transitions, redraw_content):
+        """
+        Request a redraw. If one is already pending for the same page, the
+        two are merged.
+        
+        Keyword arguments:
+        page            -- page to redraw (None for the current page)
+        direction       -- direction for any transition
+        transitions     -- run transitions if the page has changed
+        redraw_content  -- repaint the page content as well as any painters
+        """
+        self.lock.acquire()
+        try:
+            self.requests += 1
+            if len(self.pending) > 0:
+                # Will be drawn in the frame that is already due
+                self.dropped_frames += 1
+            if page in self.pending:
+                self.pending[page].merge(direction, transitions, redraw_content)
+            else:
+                self.pending[page] = RedrawRequest(page, direction, transitions, redraw_content)
+                
+            if not self.scheduled:
+                self.scheduled = True
+                delay = self._get_delay()
+                if delay > 0:
+                    g15scheduler.queue(REDRAW_QUEUE, "redraw", delay, self._draw_frame)
+                else:
+                    g15scheduler.execute(REDRAW_QUEUE, "redraw", self._draw_frame)
+        finally:
+            self.lock.release()
+            
+    def clear(self):
+        """
+        Discard any redraws that are pending
+        """
+        self.lock.acquire()
+        try:
+            self.pending.clear()
+            self.scheduled = False
+        finally:
+            self.lock.release()
+            
+    def frame_drawn(self):
+        """
+        Called when a frame has been drawn, to start the interval until the
+        next one may be drawn
+        """
+        self.lock.acquire()
+        try:
+            self.frames += 1
+            self.last_frame = time.time()
+        finally:
+            self.lock.release()
+            
+    def get_stats(self):
+        """
+        Get a dictionary of statistics about the redraws requested and frames
+        drawn
+        """
+        self.lock.acquire()
+        try:
+            return { "max_fps" : self.max_fps,
+                     "requests" : self.requests,
+                     "frames" : self.frames,
+                     "dropped_frames" : self.dropped_frames,
+                     "pending" : len(self.pending),
+                     "queue_depth" : g15scheduler.get_queue_depth(REDRAW_QUEUE) }
+        finally:
+            self.lock.release()
+    
+    """
+    Private
+    """
+    def _get_delay(self):
+        if self.max_fps <= 0:
+            return 0
+        return self.last_frame + ( 1.0 / self.max_fps ) - time.time()
+    
+    def _draw_frame(self):
+        self.lock.acquire()
+        try:
+            requests = list(self.pending.values())
+            self.pending.clear()
+            self.scheduled = False
+        finally:
+            self.lock.release()
+        if len(requests) > 0:
+            self.screen._do_redraw_requests(requests)
+    
 class G15Screen():
     
     def __init__(self, plugin_manager_module, service, device):
@@ -286,11 +434,15 @@ class G15Screen():
         self.memory_bank_color_control = None
         self.acquired_controls = {}
         self.painters = []
+        self.frame_listeners = []
         self.fader = None
         self.mkey = 1
         self.temp_acquired_controls = {}
         self.key_handler = g15keyboard.G15KeyHandler(self)
         self.glass_pane = g15theme.Component("glasspane")
+        self.damage_lock = RLock()
+        self.damaged = None
+        self.redraw_scheduler = RedrawScheduler(self)
         
         if not self._load_driver():
             raise Exception("Driver failed to load") 
@@ -314,10 +466,7 @@ class G15Screen():
             choose_profile = None
             # Active window has changed, see if we have a profile that matches it
             if application_name is not None:
-                for profile in g15profile.get_profiles(self.device):
-                    if not profile.get_default() and profile.activate_on_focus and len(profile.window_name) > 0 and application_name.lower().find(profile.window_name.lower()) != -1:
-                        choose_profile = profile 
-                        break
+                choose_profile = g15profile.get_matcher(self.device).match_window(application_name)
                 
             # No applicable profile found. Look for a default profile, and see if it is set to activate by default
             active_profile = g15profile.get_active_profile(self.device)
@@ -361,6 +510,7 @@ class G15Screen():
         self.notify_handles.append(self.conf_client.notify_add("%s/cycle_screens" % screen_key, self.resched_cycle))
         self.notify_handles.append(self.conf_client.notify_add("%s/active_profile" % screen_key, self.active_profile_changed))
         self.notify_handles.append(self.conf_client.notify_add("%s/driver" % screen_key, self.driver_changed))
+        self.notify_handles.append(self.conf_client.notify_add("%s/max_fps" % screen_key, self._max_fps_changed))
         for control in self.driver.get_controls():
             self.notify_handles.append(self.conf_client.notify_add("%s/%s" % (screen_key, control.id), self._control_changed))
         logger.info("Starting for %s is complete.", self.device.uid)
@@ -946,13 +1096,22 @@ class G15Screen():
         self.draw_lock = threading.Lock()
         self.visible_page = None
         self.old_canvas = None
+        self.old_surface = None
+        self.old_transform = None
+        self.damaged = None
         self.transition_function = None
         self.painter_function = None
         self.mkey = 1
         self.reverting = { }
         self.deleting = { }
+        self._max_fps_changed()
         self._do_redraw()
              
+    def _max_fps_changed(self, client = None, connection_id = None, entry = None, args = None):
+        default_fps = DEFAULT_COLOR_MAX_FPS if self.driver is not None and self.driver.get_bpp() == 16 else DEFAULT_MAX_FPS
+        self.redraw_scheduler.set_max_fps(g15gconf.get_int_or_default(self.conf_client, "/apps/gnome15/%s/max_fps" % self.device.uid, default_fps))
+        logger.info("Maximum frame rate for %s is %d", self.device.uid, self.redraw_scheduler.max_fps)
+        
     def _control_changed(self, client, connection_id, entry, args):
         control_id = entry.get_key().split("/")[-1]
         control = self.driver.get_control(control_id)
@@ -1135,20 +1294,35 @@ class G15Screen():
         return o_transition
     
     def cycle_to(self, page, transitions=True):
-        g15scheduler.clear_jobs(REDRAW_QUEUE)
+        self._clear_redraws()
         g15scheduler.execute(REDRAW_QUEUE, "cycleTo", self._do_cycle_to, page, transitions)
             
     def cycle(self, number, transitions=True):
-        g15scheduler.clear_jobs(REDRAW_QUEUE)
+        self._clear_redraws()
         g15scheduler.execute(REDRAW_QUEUE, "doCycle", self._do_cycle, number, transitions)
             
-    def redraw(self, page=None, direction="up", transitions=True, redraw_content=True, queue=True):
+    def redraw(self, page=None, direction="up", transitions=True, redraw_content=True, queue=True, region=None):
+        """
+        Redraw the screen. 
+        
+        Keyword arguments:
+        page            -- page that has changed (None for the current page)
+        direction       -- direction for any transition
+        transitions     -- run transitions if the page has changed
+        redraw_content  -- repaint the page content as well as any painters
+        queue           -- run on the redraw queue (otherwise on the calling thread)
+        region          -- (x, y, width, height) of the page that has changed, or None if all of it has
+        
+        Queued redraws are governed by the redraw scheduler, so may be merged
+        with others and are drawn no faster than the maximum frame rate.
+        """
         if page:
             logger.debug("Redrawing %s", page.id)
         else:
             logger.debug("Redrawing current page")
+        self.damage(region)
         if queue:
-            g15scheduler.execute(REDRAW_QUEUE, "redraw", self._do_redraw, page, direction, transitions, redraw_content)
+            self.redraw_scheduler.request(page, direction, transitions, redraw_content)
         else:
             self._do_redraw(page, direction, transitions, redraw_content)
             
@@ -1169,9 +1343,34 @@ class G15Screen():
             self.driver.release_control(self.memory_bank_color_control)
             self.memory_bank_color_control = None
             
+    def get_redraw_stats(self):
+        """
+        Get statistics about redraws, including the number of frames dropped
+        (merged with another) and the depth of the redraw queue.
+        """
+        return self.redraw_scheduler.get_stats()
+        
     def get_current_surface(self):
         return self.local_data.surface
     
+    def damage(self, region=None):
+        """
+        Mark part of the screen as needing to be repainted on the next redraw. 
+        Until the next redraw, any further damage is added to this. redraw()
+        calls this itself, so normally there is no need to call it directly.
+        
+        Keyword arguments:
+        region          -- (x, y, width, height) in page coordinates, or None for the whole screen
+        """
+        self.damage_lock.acquire()
+        try:
+            if region is None:
+                self.damaged = None
+            elif self.damaged is not None:
+                self.damaged.append(region)
+        finally:
+            self.damage_lock.release()
+    
     def get_desktop_scale(self):
         sx = float(self.available_size[2]) / float(self.width)
         sy = float(self.available_size[3]) / float(self.height)
@@ -1304,6 +1503,10 @@ class G15Screen():
             surface = self.surface
             
             painters = sorted(self.painters, key=lambda painter: painter.z_order)
+            transform = self._get_content_transform()
+            
+            # Take the damage reported since the last redraw. 
+            damaged = self._take_damage()
             
             # If the visible page is changing, creating a new surface. Both surfaces are
             # then passed to any transition functions registered
@@ -1312,9 +1515,21 @@ class G15Screen():
                 if visible_page.priority == PRI_NORMAL and not self.stopping:   
                     self.service.conf_client.set_string("/apps/gnome15/%s/last_page" % self.device.uid, visible_page.id)  
                 surface = cairo.ImageSurface (cairo.FORMAT_ARGB32, self.width, self.height)
+                damaged = None
+            elif damaged is not None and ( self.old_surface is None or self.content_surface is None or \
+                                           transform != self.old_transform or self.painter_function != None ):
+                damaged = None
+                
+            # If only part of the page is damaged, the last frame is reused and only the damaged area repainted 
+            clip = None
+            if damaged is not None:
+                surface = self.old_surface
+                clip = self._get_device_rectangles(damaged, transform)
                 
             self.local_data.surface = surface
             canvas = cairo.Context (surface)
+            if clip is not None:
+                self._clip(canvas, clip)
             self.clear_canvas(canvas)
             
             # Background painters
@@ -1341,36 +1556,30 @@ class G15Screen():
             # Call the screen's painter
             if self.visible_page != None:
                 logger.debug("Drawing page %s " \
-                             "(direction = %s, transitions = %s, redraw_content = %s",
+                             "(direction = %s, transitions = %s, redraw_content = %s, damaged = %s",
                              self.visible_page.id,
                              direction,
                              str(transitions),
-                             str(redraw_content))
+                             str(redraw_content),
+                             str(damaged))
             
                          
                 # Paint the content to a new surface so it can be cached
                 if self.content_surface == None or redraw_content:
-                    self.content_surface = cairo.ImageSurface (cairo.FORMAT_ARGB32, self.width, self.height)
-                    content_canvas = cairo.Context(self.content_surface)
+                    if damaged is None:
+                        self.content_surface = cairo.ImageSurface (cairo.FORMAT_ARGB32, self.width, self.height)
+                        content_canvas = cairo.Context(self.content_surface)
+                    else:
+                        # Just erase and repaint the damaged area of the cached content
+                        content_canvas = cairo.Context(self.content_surface)
+                        self._clip(content_canvas, self._get_page_rectangles(damaged))
+                        content_canvas.set_operator(cairo.OPERATOR_CLEAR)
+                        content_canvas.paint()
+                        content_canvas.set_operator(cairo.OPERATOR_OVER)
                     self.configure_canvas(content_canvas)
                     self.visible_page.paint(content_canvas)
                 
-                tx = self.available_size[0]
-                ty = self.available_size[1]
-                
-                # Scale to the available space, and center
-                sx = float(self.available_size[2]) / float(self.width)
-                sy = float(self.available_size[3]) / float(self.height)
-                scale = min(sx, sy)
-                sx = scale
-                sy = scale
-                
-                if tx == 0 and self.available_size[3] != self.size[1]:
-                    sx = 1
-                
-                if ty == 0 and self.available_size[2] != self.size[0]:
-                    sy = 1
-                
+                tx, ty, sx, sy = transform
                 canvas.save()
                 canvas.translate(tx, ty)
                 canvas.scale(sx, sy)
@@ -1396,13 +1605,106 @@ class G15Screen():
             # Now apply any global transformations and paint
             if self.painter_function != None:
                 self.painter_function(surface)
+            elif clip is not None:
+                self.driver.paint_region(surface, self._get_bounds(clip))
             else:
                 self.driver.paint(surface)
+            self.redraw_scheduler.frame_drawn()
+
+            # Callables interested in every frame (e.g. recorders). Called
+            # with the draw lock held, so they should only copy the surface
+            for listener in list(self.frame_listeners):
+                listener(surface)
                 
             self.old_canvas = canvas
             self.old_surface = surface
+            self.old_transform = transform
         finally:
             self.draw_lock.release()
+            
+    def _take_damage(self):
+        """
+        Get the damage reported since the last redraw and start collecting
+        again. None is returned if the whole screen should be repainted.
+        """
+        self.damage_lock.acquire()
+        try:
+            damaged = self.damaged
+            self.damaged = []
+            if damaged is not None and len(damaged) == 0:
+                # Nothing reported, so the redraw did not come via redraw(). Repaint everything
+                return None
+            return damaged
+        finally:
+            self.damage_lock.release()
+            
+    def _get_content_transform(self):
+        """
+        Get the translation and scale used to fit the page content into the
+        available space (centered)
+        """
+        tx = self.available_size[0]
+        ty = self.available_size[1]
+        
+        # Scale to the available space, and center
+        sx = float(self.available_size[2]) / float(self.width)
+        sy = float(self.available_size[3]) / float(self.height)
+        scale = min(sx, sy)
+        sx = scale
+        sy = scale
+        
+        if tx == 0 and self.available_size[3] != self.size[1]:
+            sx = 1
+        
+        if ty == 0 and self.available_size[2] != self.size[0]:
+            sy = 1
+            
+        return ( tx, ty, sx, sy )
+    
+    def _get_page_rectangles(self, damaged):
+        """
+        Get the damaged rectangles, expanded to whole pixels and limited to
+        the size of the page
+        """
+        rects = []
+        for x, y, w, h in damaged:
+            x1 = max(0, int(math.floor(x)))
+            y1 = max(0, int(math.floor(y)))
+            x2 = min(self.width, int(math.ceil(x + w)))
+            y2 = min(self.height, int(math.ceil(y + h)))
+            if x2 > x1 and y2 > y1:
+                rects.append(( x1, y1, x2 - x1, y2 - y1 ))
+        return rects
+    
+    def _get_device_rectangles(self, damaged, transform):
+        """
+        Get the damaged rectangles in device coordinates. When the content is
+        scaled, a pixel is added around each rectangle to allow for filtering.
+        """
+        tx, ty, sx, sy = transform
+        margin = 0 if sx == 1 and sy == 1 else 1
+        rects = []
+        for x, y, w, h in self._get_page_rectangles(damaged):
+            rects.append(( x * sx + tx - margin, y * sy + ty - margin, 
+                           w * sx + ( margin * 2 ), h * sy + ( margin * 2 ) ))
+        return self._get_page_rectangles(rects)
+    
+    def _get_bounds(self, rects):
+        """
+        Get the smallest rectangle that contains all of the given rectangles
+        """
+        if len(rects) == 0:
+            return ( 0, 0, 0, 0 )
+        x1 = min(r[0] for r in rects)
+        y1 = min(r[1] for r in rects)
+        x2 = max(r[0] + r[2] for r in rects)
+        y2 = max(r[1] + r[3] for r in rects)
+        return ( x1, y1, x2 - x1, y2 - y1 )
+    
+    def _clip(self, canvas, rects):
+        for r in rects:
+            canvas.rectangle(r[0], r[1], r[2], r[3])
+        canvas.clip()
         
     def configure_canvas(self, canvas):        
         canvas.set_antialias(self.driver.get_antialias())
@@ -1414,6 +1716,15 @@ class G15Screen():
         canvas.set_font_options(fo)
         return fo
     
+    def _clear_redraws(self):
+        # The redraw queue is shared by every screen, so only remove the jobs of this one
+        g15scheduler.clear_jobs(REDRAW_QUEUE, self._is_own_job)
+        self.redraw_scheduler.clear()
+
+    def _is_own_job(self, function):
+        owner = getattr(function, "__self__", None)
+        return owner is self or owner is self.redraw_scheduler
+
     def _do_cycle_to(self, page, transitions=True):            
         self.page_model_lock.acquire()
         try :
@@ -1478,6 +1789,28 @@ class G15Screen():
         if len(self.pages) > 0:            
             self._cycle_pages(number, self._get_pages_of_priority(PRI_NORMAL))
                 
+    def _do_redraw_requests(self, requests):
+        """
+        Draw a single frame satisfying all of the redraws requested since
+        the last frame.
+        """
+        self.page_model_lock.acquire()
+        try:
+            current_page = self._get_next_page_to_display()
+            frame = None
+            for request in requests:
+                if request.page == None or request.page == current_page:
+                    if frame is None or not frame.redraw_content:
+                        frame = request
+                    else:
+                        frame.merge(request.direction, request.transitions, True)
+                elif request.page.panel_painter != None and frame is None:
+                    frame = RedrawRequest(None, request.direction, request.transitions, False)
+            if frame is not None:
+                self._draw_page(current_page, frame.direction, frame.transitions, frame.redraw_content)
+        finally:
+            self.page_model_lock.release()
+            
     def _do_redraw(self, page=None, direction="up", transitions=True, redraw_content=True):
         self.page_model_lock.acquire()
         try :           
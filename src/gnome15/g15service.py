@@ -31,11 +31,14 @@ import g15devices
 import g15desktop
 import g15uinput
 import g15network
+import g15macroscript
+import g15windows
 import g15accounts
 import g15driver
 import gconf
 import util.g15scheduler as g15scheduler
 import util.g15gconf as g15gconf
+import util.g15cairo as g15cairo
 import util.g15os as g15os
 import Xlib.X 
 import Xlib.ext
@@ -46,6 +49,7 @@ import time
 import dbus
 import signal
 import g15pluginmanager
+import g15plugin
 import g15actions
 from threading import Thread
 import gtk.gdk
@@ -74,6 +78,12 @@ VERSION = g15globals.version
 SERVICE_QUEUE = "serviceQueue"
 MACRO_HANDLER_QUEUE = "macroHandler"
 
+# Number of plugin refreshes that may run at once
+REFRESH_QUEUE_WORKERS = 3
+
+# Number of seconds a macro script may fall behind its delays before its timing is restarted
+MAX_MACRO_DRIFT = 0.05
+
 special_X_keysyms = {
     ' ' : "space",
     '\t' : "Tab",
@@ -149,6 +159,7 @@ class MacroHandler(object):
         self.use_x_test = None
         self.x_test_available = None
         self.window = None
+        self.keysyms = {}
         
     def cancel(self):
         """
@@ -352,6 +363,13 @@ class MacroHandler(object):
                     self.buffered_executions.append(b)
         
     def _get_keysym(self, ch) :
+        keysym = self.keysyms.get(ch)
+        if keysym is None:
+            keysym = self._lookup_keysym(ch)
+            self.keysyms[ch] = keysym
+        return keysym
+    
+    def _lookup_keysym(self, ch) :
         keysym = Xlib.XK.string_to_keysym(ch)
         if keysym == 0 :
             # Unfortunately, although this works to get the correct keysym
@@ -423,22 +441,20 @@ class MacroScriptExecution(object):
     def __init__(self, macro, handler):
         self.macro = macro
         self.handler = handler
-        self.l = -1
-        self.macros = self.macro.macro.split("\n")
+        self.pc = 0
+        self.ops = self.macro.get_script().ops
         self.wait_for_state = -2
         self.wait_for_keys = []
         self.down = 0
         self.all_keys_up = False
         self.cancelled = False
+        self.batch = g15uinput.EventBatch()
+        self.deadline = None
         
-        # First parse to get where the labels are
-        self.labels = {}
-        for l in range(0, len(self.macros)):
-            macro_text = self.macros[l]
-            split = macro_text.split(" ")
-            op = split[0].lower()
-            if op == "label" and len(op) > 1:
-                self.labels[split[1].lower()] = l
+        profile = self.macro.profile
+        self.send_delays = profile.send_delays and not profile.fixed_delays
+        self.press_delay = 0.0 if not profile.fixed_delays else ( float(profile.press_delay) / 1000.0 )
+        self.release_delay = 0.0 if not profile.fixed_delays else ( float(profile.release_delay) / 1000.0 )
                 
     def handle_key(self, keys, state_id, post):
         
@@ -461,90 +477,71 @@ class MacroScriptExecution(object):
             return True
                 
     def execute(self):
-        while True:
-            if self.down == 0 and ( self.handler.cancelled or self.cancelled ):
-                logger.warning("Macro cancelled")
-                break
-            self.l += 1
-            if self.l == len(self.macros):
-                break
-            macro_text = self.macros[self.l]
-            split = macro_text.split(" ")
-            op = split[0].lower()
-            if len(split) > 1:
-                val = split[1]
-                if op == "goto":
-                    val = val.lower()
-                    if val in self.labels:
-                        self.l = self.labels[val]
-                    else:
-                        logger.warning("Unknown goto label %s in macro script. Ignoring", val)
-                elif op == "delay":
-                    if not self.handler.cancelled and self.macro.profile.send_delays and not self.macro.profile.fixed_delays:
-                        time.sleep(float(val) / 1000.0 if not self.macro.profile.fixed_delays else self.macro.profile.delay_amount)
-                elif op == "press":
+        # Delays are timed from here, not from before any wait
+        self.deadline = None
+        ops = self.ops
+        try:
+            while True:
+                if self.down == 0 and ( self.handler.cancelled or self.cancelled ):
+                    logger.warning("Macro cancelled")
+                    break
+                if self.pc >= len(ops):
+                    break
+                op, val, target = ops[self.pc]
+                self.pc += 1
+                if op == g15macroscript.OP_GOTO:
+                    self.pc = val
+                elif op == g15macroscript.OP_DELAY:
+                    if not self.handler.cancelled and self.send_delays:
+                        self._sleep(val)
+                elif op == g15macroscript.OP_UPRESS:
+                    if self.down > 0:
+                        self._sleep(self.release_delay)
+                    self.down += 1
+                    self.batch.emit(target, val, 1)
+                    self._sleep(self.press_delay)
+                elif op == g15macroscript.OP_URELEASE:
+                    self.down -= 1
+                    self.batch.emit(target, val, 0)
+                elif op == g15macroscript.OP_PRESS:
+                    self.batch.flush()
                     if self.down > 0:
-                        self.handler.release_delay(self.macro)
+                        self._sleep(self.release_delay)
                     self.handler.send_string(val, True)
                     self.down += 1
-                    self.handler.press_delay(self.macro)
-                elif op == "release":
+                    self._sleep(self.press_delay)
+                elif op == g15macroscript.OP_RELEASE:
+                    self.batch.flush()
                     self.handler.send_string(val, False)
                     self.down -= 1
-                elif op == "upress":
-                    if len(split) < 3:                        
-                        logger.error("Invalid operation in macro script. '%s'", macro_text)
-                    else:
-                        if self.down > 0:
-                            self.handler.release_delay(self.macro)
-                        self.down += 1
-                        self._send_uinput(split[2], val, 1)
-                        self.handler.press_delay(self.macro)
-                elif op == "urelease":
-                    if len(split) < 3:                        
-                        logger.error("Invalid operation in macro script. '%s'", macro_text)
-                    else:
-                        self.down -= 1
-                        self._send_uinput(split[2], val, 0)
-                elif op == "wait":
+                elif op == g15macroscript.OP_WAIT:
                     if self.all_keys_up:
                         logger.warning("All keys for the macro %s are already up, " \
                                     "the rest of the script will be ignored", self.macro.name)
                         return False
-                    else:
-                        val = val.lower()
-                        if val == "release":
-                            if self.macro.activate_on == g15driver.KEY_STATE_UP:
-                                logger.error("WaitRelease cannot be used with macros that activate on release")
-                            else:
-                                self.wait_for_state = g15driver.KEY_STATE_UP
-                                self.wait_for_keys = list(self.macro.keys)
-                                return True
-                        elif val == "hold":
-                            if self.macro.activate_on == g15driver.KEY_STATE_DOWN:
-                                self.wait_for_state = g15driver.KEY_STATE_HELD
-                                self.wait_for_keys = list(self.macro.keys)
-                                return True
-                            else:                        
-                                logger.error("WaitHold cannot be used with macros that activate on hold or release")
-                        else:                        
-                            logger.error("Wait may only have an argument of release or hold")
-                elif op == "label":
-                    # Ignore label / comment
-                    pass
-                else:
-                    logger.error("Invalid operation in macro script. '%s'", macro_text)
-                
-            else:
-                if len(split) > 0:
-                    logger.error("Insufficient arguments in macro script. '%s'", macro_text)
-                    
-        
-    def _send_uinput(self, target, val, state):
-        if val in g15uinput.capabilities:
-            g15uinput.emit(target, g15uinput.capabilities[val], state, True)
-        else:                        
-            logger.error("Unknown uinput key %s.", val)
+                    self.wait_for_state = val
+                    self.wait_for_keys = list(self.macro.keys)
+                    return True
+        finally:
+            self.batch.flush()
+            
+    def _sleep(self, delay):
+        """
+        Sleep until a delay after the end of the previous delay, rather than
+        after now. This means the time taken to send the events between delays
+        does not accumulate, so a long script keeps to its timing. If the
+        script falls too far behind, the timing is started afresh rather than 
+        sending a burst of events to catch up.
+        """
+        if delay <= 0:
+            return
+        self.batch.flush()
+        now = time.time()
+        if self.deadline is None or now - self.deadline > MAX_MACRO_DRIFT:
+            self.deadline = now
+        self.deadline += delay
+        if self.deadline > now:
+            time.sleep(self.deadline - now)
 
 class G15Service(g15desktop.G15AbstractService):
     
@@ -565,6 +562,7 @@ class G15Service(g15desktop.G15AbstractService):
         self.font_faces = {}
         self.stopping = False
         self.window_title_listener = None
+        self.window_tracker = None
         self.active_application_name = None
         self.active_window_title = None
         self.ignore_next_sigint = False
@@ -632,6 +630,9 @@ class G15Service(g15desktop.G15AbstractService):
                 except Exception as e:
                     logger.debug("Error stopping account change notification", exc_info = e)
                     pass
+                if self.window_tracker is not None:
+                    self.window_tracker.stop()
+                    self.window_tracker = None
                 logger.info("Informing listeners we are stopping")
                 for listener in self.service_listeners:
                     listener.service_stopping()                    
@@ -741,23 +742,16 @@ class G15Service(g15desktop.G15AbstractService):
             logger.debug("Could not check active application", exc_info = e)
             pass
         
-    def _check_active_application_with_wnck(self, event=None):
-        try:
-            import wnck
-            window = wnck.screen_get_default().get_active_window()
-            if window is not None and not window.is_skip_pager():
-                app = window.get_application()
-                active_application_name = app.get_name() if app is not None else ""
-                if active_application_name != self.active_application_name:
-                    self.active_application_name = active_application_name
-                    self.active_window_title = active_application_name
-                    logger.info("Active application is now %s", self.active_application_name)
-                    for screen in self.screens:
-                        screen.set_active_application_name(active_application_name)
-        except Exception as e:
-            logger.warning("Failed to activate profile for active window", exc_info = e)
-            
-        gobject.timeout_add(500, self._check_active_application_with_wnck)
+    def _tracked_window_changed(self, application_name, window_title):
+        self.active_window_title = window_title
+        if application_name != self.active_application_name:
+            self.active_application_name = application_name
+            logger.info("Active application is now %s", self.active_application_name)
+            for screen in self.screens:
+                try:
+                    screen.set_active_application_name(application_name)
+                except Exception as e:
+                    logger.warning("Failed to activate profile for active window", exc_info = e)
         
     def _check_state_of_all_devices(self, quickly = False):
         logger.info("Checking state of %d devices", len(self.devices))
@@ -843,6 +837,8 @@ class G15Service(g15desktop.G15AbstractService):
         self.notify_handles.append(self.conf_client.notify_add("/apps/gnome15/key_hold_duration", self._hidden_configuration_changed))
         self.notify_handles.append(self.conf_client.notify_add("/apps/gnome15/use_x_test", self._hidden_configuration_changed))
         self.notify_handles.append(self.conf_client.notify_add("/apps/gnome15/disable_svg_glow", self._hidden_configuration_changed))
+        self.notify_handles.append(self.conf_client.notify_add("/apps/gnome15/refresh_queue_workers", self._hidden_configuration_changed))
+        self.notify_handles.append(self.conf_client.notify_add("/apps/gnome15/image_cache_size", self._hidden_configuration_changed))
         
             
         # Monitor active application    
@@ -1046,12 +1042,12 @@ class G15Service(g15desktop.G15AbstractService):
             if active_window:
                 self._active_window_changed("", active_window)
         except Exception as e:
-            logger.info("BAMF not available, falling back to polling WNCK.")
+            logger.info("BAMF not available, falling back to WNCK.")
             logger.debug("BAMF attempt below :", exc_info = e)
             try :                
-                import wnck
-                wnck.__file__
-                self._check_active_application_with_wnck()
+                self.window_tracker = g15windows.WindowTracker()
+                self.window_tracker.listeners.append(self._tracked_window_changed)
+                self.window_tracker.start()
             except Exception as e:
                 logger.warning("Python Wnck not available either, no automatic profile switching", exc_info = e)
             
@@ -1080,6 +1076,8 @@ class G15Service(g15desktop.G15AbstractService):
         self.all_off_on_disconnect = g15gconf.get_bool_or_default(self.conf_client, '/apps/gnome15/all_off_on_disconnect', True)
         self.fade_keyboard_backlight_on_close = g15gconf.get_bool_or_default(self.conf_client, '/apps/gnome15/fade_keyboard_backlight_on_close', True)
         self.start_in_threads = g15gconf.get_bool_or_default(self.conf_client, '/apps/gnome15/start_in_threads', False)
+        g15cairo.image_cache.set_max_bytes(g15gconf.get_int_or_default(self.conf_client, '/apps/gnome15/image_cache_size', 16) * 1024 * 1024)
+        g15scheduler.configure_queue(g15plugin.REFRESH_QUEUE, max(1, g15gconf.get_int_or_default(self.conf_client, '/apps/gnome15/refresh_queue_workers', REFRESH_QUEUE_WORKERS)))
         self._mark_all_pages_dirty()
         
     def _mark_all_pages_dirty(self):
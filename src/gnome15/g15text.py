@@ -17,12 +17,28 @@
 import pango
 import pangocairo
 import cairo
+import math
 import gobject
+import util.g15cache as g15cache
 import logging
 logger = logging.getLogger(__name__)
 
 # Shared pango context
 pango_context = pangocairo.cairo_font_map_get_default().create_context()
+
+"""
+Cache sizes. Shaped layouts are shared by all text handlers, as are the
+rendered text masks that allow repeated and outlined text to be drawn with
+a single blit.
+"""
+LAYOUT_CACHE_SIZE = 256
+MASK_CACHE_SIZE = 256
+
+layout_cache = g15cache.LRUCache(LAYOUT_CACHE_SIZE)
+mask_cache = g15cache.LRUCache(MASK_CACHE_SIZE)
+
+# Positions of the copies of the text that make up an outline (shadow)
+OUTLINE_OFFSETS = [ ( x, y ) for x in range(-1, 2) for y in range(-1, 2) if x != 0 or y != 0 ]
  
 """
 Handles drawing and measuring of text on a screen. 
@@ -38,6 +54,12 @@ def new_text(screen = None):
         return G15PangoText(screen.driver.get_antialias())
     else:
         return G15PangoText(True)
+    
+def get_cache_stats():
+    """
+    Get the statistics for the layout and mask caches
+    """
+    return { "layouts" : layout_cache.get_stats(), "masks" : mask_cache.get_stats() }
 
 class G15Text(object):
     
@@ -68,14 +90,28 @@ class G15Text(object):
             fo.set_hint_metrics(cairo.HINT_METRICS_OFF)            
     
 class G15PangoText(G15Text):
+    """
+    Text handler that uses Pango. Shaped layouts are cached, keyed on all of
+    the attributes that affect them, so setting the same text and attributes
+    again costs a dictionary lookup. When drawing on a canvas that is only
+    translated, the text is rendered once to a mask that is then cached and
+    blitted with the current source.
+    """
     
     def __init__(self, antialias):
         G15Text.__init__(self, antialias)
         pangocairo.context_set_font_options(pango_context, self._create_font_options())   
         self.__pango_cairo_context = None
         self.__layout = None
+        self.__layout_key = None
         self.valign = pango.ALIGN_CENTER
-        self.__layout = pango.Layout(pango_context)
+        
+        # Layout settings not given to set_attributes() are kept from the previous call
+        self.__align = pango.ALIGN_LEFT
+        self.__spacing = 0
+        self.__width = -1
+        self.__wrap = pango.WRAP_WORD
+        self.__attributes = None
         
     def set_canvas(self, canvas):           
         G15Text.set_canvas(self, canvas)
@@ -111,32 +147,71 @@ class G15PangoText(G15Text):
             font_desc_name += " %s" % style
         if font_pt_size:
             font_desc_name += " " + str(font_pt_size)
-        font_desc = pango.FontDescription(font_desc_name)
-        if font_absolute_size is not None:
-            font_desc.set_absolute_size(font_absolute_size)
-        self.__layout.set_font_description(font_desc)        
         
         if align != None:
-            self.__layout.set_alignment(align)
+            self.__align = align
         if spacing != None:
-            self.__layout.set_spacing(spacing)
+            self.__spacing = spacing
         if width != None:
-            self.__layout.set_width(width)
+            self.__width = width
         if pxwidth != None:
-            self.__layout.set_width(int(pango.SCALE * pxwidth))
+            self.__width = int(pango.SCALE * pxwidth)
         if wrap:
-            self.__layout.set_wrap(wrap)
+            self.__wrap = wrap
         if attributes:
-            self.__layout.set_attributes(attributes)
+            self.__attributes = attributes
             
-        self.__layout.set_text(text)
-        self.metrics = pango_context.get_metrics(self.__layout.get_font_description())
+        key = ( text, font_desc_name, font_absolute_size, int(self.__align), self.__spacing, 
+                self.__width, int(self.__wrap), self.antialias )
+        if self.__attributes is None:
+            cached = layout_cache.get(key)
+            if cached is not None:
+                self.__layout_key = key
+                self.__layout, self.metrics = cached
+                return
+        
+        font_desc = pango.FontDescription(font_desc_name)
+        if font_absolute_size is not None:
+            font_desc.set_absolute_size(font_absolute_size)
+        layout = pango.Layout(pango_context)
+        layout.set_font_description(font_desc)
+        layout.set_alignment(self.__align)
+        layout.set_spacing(self.__spacing)
+        layout.set_width(self.__width)
+        layout.set_wrap(self.__wrap)
+        if self.__attributes:
+            layout.set_attributes(self.__attributes)
+        layout.set_text(text)
+        self.__layout = layout
+        self.metrics = pango_context.get_metrics(font_desc)
+        
+        if self.__attributes is None:
+            # Cached layouts are never changed, each set_attributes() uses a new one
+            self.__layout_key = key
+            layout_cache.put(key, ( layout, self.metrics ))
+        else:
+            # The attribute list may be changed by the caller, so cannot be part of a key
+            self.__layout_key = None
         
     def measure(self):
         text_extents = self.__layout.get_extents()[1]
         return text_extents[0] / pango.SCALE, text_extents[1] / pango.SCALE, text_extents[2] / pango.SCALE, text_extents[3] / pango.SCALE
     
     def draw(self, x = None, y = None):
+        self._draw(x, y, [ ( 0, 0 ) ])
+        
+    def draw_outline(self, x = None, y = None):
+        """
+        Draw the text offset by one pixel in each direction, used to draw a 
+        shadow or outline around text drawn with draw(). The copies are
+        drawn together as one.
+        """
+        self._draw(x, y, OUTLINE_OFFSETS)
+        
+    """
+    Private
+    """
+    def _draw(self, x, y, offsets):
         self.__pango_cairo_context.save()
         
         if self.bounds is not None:
@@ -153,9 +228,55 @@ class G15PangoText(G15Text):
             elif self.valign == pango.ALIGN_CENTER:
                 y += ( self.bounds[3] - ( self.metrics.get_ascent()  / 1000.0 ) ) / 2
                 
-        if x is not None and y is not None:                
-            self.__pango_cairo_context.move_to(x, y)
+        if x is None or y is None:
+            x, y = self.__pango_cairo_context.get_current_point()
             
-        self.__pango_cairo_context.show_layout(self.__layout)
+        if not self._draw_mask(x, y, offsets):
+            for ox, oy in offsets:
+                self.__pango_cairo_context.move_to(x + ox, y + oy)
+                self.__pango_cairo_context.show_layout(self.__layout)
         self.__pango_cairo_context.restore()
         
+    def _draw_mask(self, x, y, offsets):
+        """
+        Draw the text using a cached mask. Only possible if the canvas is
+        just translated (so the mask's pixels line up with the canvas's), 
+        and the layout is cached.
+        """
+        if self.__layout_key is None:
+            return False
+        xx, yx, xy, yy, x0, y0 = self.__pango_cairo_context.get_matrix()
+        if xx != 1 or yy != 1 or xy != 0 or yx != 0:
+            return False
+        
+        # The mask is rendered at the same position within a pixel as the text would be 
+        dx = x + x0
+        dy = y + y0
+        ix = math.floor(dx)
+        iy = math.floor(dy)
+        key = ( self.__layout_key, round(dx - ix, 3), round(dy - iy, 3), tuple(offsets) )
+        cached = mask_cache.get(key)
+        if cached is None:
+            cached = self._create_mask(dx - ix, dy - iy, offsets)
+            mask_cache.put(key, cached)
+        mask, mx, my = cached
+        if mask is not None:
+            self.__pango_cairo_context.mask_surface(mask, ix + mx - x0, iy + my - y0)
+        return True
+    
+    def _create_mask(self, fx, fy, offsets):
+        ink = self.__layout.get_pixel_extents()[0]
+        if ink[2] <= 0 or ink[3] <= 0:
+            return ( None, 0, 0 )
+        
+        # Leave room for the offsets and any antialiasing
+        pad = 2 + max(max(abs(ox), abs(oy)) for ox, oy in offsets)
+        mx = ink[0] - pad
+        my = ink[1] - pad
+        mask = cairo.ImageSurface(cairo.FORMAT_A8, ink[2] + ( pad * 2 ), ink[3] + ( pad * 2 ))
+        mask_context = pangocairo.CairoContext(cairo.Context(mask))
+        mask_context.set_source_rgba(0, 0, 0, 1)
+        for ox, oy in offsets:
+            mask_context.move_to(fx + ox - mx, fy + oy - my)
+            mask_context.show_layout(self.__layout)
+        return ( mask, mx, my )
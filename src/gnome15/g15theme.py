@@ -52,8 +52,10 @@ import g15locale
 import util.g15cairo as g15cairo
 import util.g15svg as g15svg
 import util.g15icontools as g15icontools
+import util.g15cache as g15cache
 import xml.sax.saxutils as saxutils
 import base64
+import hashlib
 import dbusmenu
 import logging
 import time
@@ -68,6 +70,9 @@ import ConfigParser
 BASE_PX=18.0
 DEBUG_SVG=False
 
+# The number of rendered SVG documents each theme keeps for reuse
+RENDER_CACHE_SIZE=6
+
 # The color in SVG theme files that by default gets replaced with the current 'highlight' color
 DEFAULT_HIGHLIGHT_COLOR="#ff0000"
 
@@ -145,6 +150,235 @@ class Render(object):
         self.text_boxes = text_boxes
         self.attributes = attributes
         self.processing_result = processing_result
+        self.cache_key = None
+        self.svg = None
+        self.substituted = False
+        
+def is_delete_required(properties, var, condition):
+    """
+    Get if an element with a "del" title should be removed given the current
+    property values. With a condition of True, the element is removed if the
+    property has a value, otherwise it is removed if the property is blank. 
+    
+    Keyword arguments:
+    properties    -- theme properties
+    var           -- name of property
+    condition     -- condition
+    """
+    return ( condition and var in properties and properties[var] != "" and properties[var] != False ) or \
+        ( not condition and ( not var in properties or properties[var] == "" or properties[var] == False ) )
+
+def get_progress_width(bounds, value):
+    """
+    Get the width of a progress bar element for a percentage
+    
+    Keyword arguments:
+    bounds        -- bounds of the full size progress element
+    value         -- percentage
+    """
+    value = float(value)
+    if value == 0:
+        value = 0.1
+    return str(int((bounds[2] / 100.0) * value))
+
+def get_image_url(val):
+    """
+    Get the URL to use as the link of an svg:image element given a property value.
+    Surfaces are embedded as PNG data.
+    
+    Keyword arguments:
+    val           -- file URL, path, data or cairo surface
+    """
+    file_str = StringIO()
+    if isinstance(val, str) and str(val).startswith("file:"):
+        file_str.write(val[5:])
+    elif isinstance(val, str) and str(val).startswith("/"):
+        file_str.write(val)
+    else:
+        file_str.write("data:image/png;base64,")
+        img_data = StringIO()
+        if isinstance(val, cairo.Surface):
+            val.write_to_png(img_data)
+            file_str.write(base64.b64encode(img_data.getvalue()))
+        else: 
+            file_str.write(val)
+    return file_str.getvalue()
+
+def get_template_names(text):
+    """
+    Get the names of all of the properties a string.Template string refers to
+    
+    Keyword arguments:
+    text          -- template text
+    """
+    names = set()
+    for match in Template.pattern.finditer(text):
+        name = match.group("named") or match.group("braced")
+        if name:
+            names.add(name)
+    return names
+
+class DocumentSlot(object):
+    """
+    Part of a compiled document that depends on the values of some theme
+    properties. 
+    """
+    def __init__(self, names):
+        self.names = names
+        
+    def apply(self, properties):
+        """
+        Update the document with the current values of the properties this
+        slot depends on. Subclasses must override.
+        
+        Keyword arguments:
+        properties        -- theme properties
+        """
+        raise Exception("Not implemented")
+    
+class TextSlot(DocumentSlot):
+    """
+    Text, tail or attribute of an element that contains property references 
+    """
+    def __init__(self, element, attribute, text):
+        DocumentSlot.__init__(self, get_template_names(text))
+        self.element = element
+        self.attribute = attribute
+        self.template = Template(text)
+        
+    def apply(self, properties):
+        text = self.template.safe_substitute(properties)
+        if self.attribute == "text":
+            self.element.text = text
+        elif self.attribute == "tail":
+            self.element.tail = text
+        else:
+            self.element.set(self.attribute, text)
+
+class DeleteSlot(DocumentSlot):
+    """
+    Element that is removed depending on whether a property has a value. The
+    element is swapped with a placeholder so it may be put back later. While
+    removed, it is kept in a holder element that has the same namespaces as
+    the document, so it is serialized the same when put back.
+    """
+    def __init__(self, element, var, condition, holder):
+        DocumentSlot.__init__(self, set([var]))
+        self.element = element
+        self.holder = holder
+        self.var = var
+        self.condition = condition
+        self.placeholder = etree.Comment("del %s" % var)
+        self.deleted = False
+        
+    def apply(self, properties):
+        delete = is_delete_required(properties, self.var, self.condition)
+        if delete and not self.deleted:
+            self.element.getparent().replace(self.element, self.placeholder)
+            self.holder.append(self.element)
+        elif self.deleted and not delete:
+            self.placeholder.getparent().replace(self.placeholder, self.element)
+        self.deleted = delete
+        
+class ProgressSlot(DocumentSlot):
+    """
+    Width of a progress bar element
+    """
+    def __init__(self, element, property_key):
+        DocumentSlot.__init__(self, set([property_key]))
+        self.element = element
+        self.property_key = property_key
+        self.bounds = g15svg.get_bounds(element)
+        self.width = element.get("width")
+        
+    def apply(self, properties):
+        if self.property_key in properties:
+            self.element.set("width", get_progress_width(self.bounds, properties[self.property_key]))
+        else:
+            self.element.set("width", self.width)
+    
+class ImageSlot(DocumentSlot):
+    """
+    Link of an svg:image element that is taken from a property 
+    """
+    def __init__(self, element, property_key):
+        self.href = element.get("{http://www.w3.org/1999/xlink}href") or ""
+        DocumentSlot.__init__(self, get_template_names(self.href) | set([property_key]))
+        self.element = element
+        self.property_key = property_key
+        self.template = Template(self.href)
+        
+    def apply(self, properties):
+        if self.property_key in properties and properties[self.property_key] != None:
+            href = get_image_url(properties[self.property_key])
+        else:
+            href = self.template.safe_substitute(properties)
+        self.element.set("{http://www.w3.org/1999/xlink}href", href)
+    
+class DocumentTemplate(object):
+    """
+    A copy of a theme's document with everything that does not depend on the
+    theme properties already processed, and a list of slots for the parts that
+    do. Updating the template with new property values only touches the slots
+    for properties that have changed.
+    """
+    def __init__(self, document, colors):
+        self.document = document
+        self.colors = colors
+        
+        # Unused prefixes (such as svg: aliasing the default namespace) are removed,
+        # so elements that are moved in and out of the document keep their prefix
+        etree.cleanup_namespaces(document)
+        root = document.getroot()
+        self.holder = etree.Element(root.tag, nsmap = root.nsmap)
+        self.slots = {}
+        self.values = None
+        
+    def add_slot(self, slot):
+        for name in slot.names:
+            if not name in self.slots:
+                self.slots[name] = []
+            self.slots[name].append(slot)
+        
+    def update(self, properties):
+        """
+        Update the document with the latest properties.
+        
+        Keyword arguments:
+        properties        -- theme properties
+        """
+        if self.values is None:
+            changed = self.slots.keys()
+        else:
+            changed = []
+            for name in self.slots:
+                if ( name in properties ) != ( name in self.values ) or \
+                    ( name in properties and ( properties[name] != self.values[name] or \
+                                               type(properties[name]) != type(self.values[name]) ) ):
+                    changed.append(name)
+                    
+        string_properties = {}
+        for key in properties:
+            val = properties[key]
+            string_properties[key] = val if isinstance(val, basestring) else str(val) 
+            
+        applied = set()
+        for name in changed:
+            for slot in self.slots[name]:
+                if not slot in applied:
+                    applied.add(slot)
+                    slot.apply(string_properties if isinstance(slot, TextSlot) else properties)
+        self.values = dict(properties)
+
+class RenderedSVG(object):
+    """
+    A parsed SVG document ready for painting. Once it has been painted more than
+    once, it is also rasterized so further paints are a single blit.
+    """
+    def __init__(self, handle):
+        self.handle = handle
+        self.surface = None
+        self.paints = 0
         
 class ScrollState(object):
     
@@ -413,13 +647,14 @@ class Component(object):
         g15screen.check_on_redraw()
         self.get_tree_lock().acquire()
         try:
-            # Remove any children that we currently have, but are not in the new list
+            # Remove any children that we currently have, but are not in the new list.
+            # The base methods are used so subclasses only need to update once
             for c in list(set(self._children) - set(children)):
-                self.remove_child(c)
+                Component.remove_child(self, c)
                 
             # Add any new children
             for c in list(set(children) - set(self._children)):
-                self.add_child(c)
+                Component.add_child(self, c)
                 
             # Now just change out child list to the new one so the order is correct
             self._children = Childlist(children)
@@ -501,6 +736,57 @@ class Component(object):
         
     def is_visible(self):
         return self.parent != None and self.parent.is_visible()
+    
+    def get_page_bounds(self):
+        """
+        Get the bounds of this component's view relative to the page it is
+        on, or None if it has no view.
+        """
+        if self.view_bounds is None:
+            return None
+        x = self.view_bounds[0]
+        y = self.view_bounds[1]
+        c = self.parent
+        while c is not None:
+            if c.view_bounds is not None:
+                x += c.view_bounds[0]
+                y += c.view_bounds[1]
+            y -= c.base
+            c = c.parent
+        return ( x, y, self.view_bounds[2], self.view_bounds[3] )
+    
+    def get_scroll_bounds(self):
+        """
+        Get the bounds (relative to the page) of the components in this tree
+        that will change on the next do_scroll(), or None if the whole page
+        will.
+        """
+        bounds = []
+        for c in self._children:
+            b = c.get_scroll_bounds()
+            if b is None:
+                return None
+            bounds += b
+        if self.theme and self.get_allow_scrolling() and self.theme.is_scroll_required():
+            b = self.get_page_bounds() if self.parent is not None else None
+            if b is None:
+                return None
+            bounds.append(b)
+        return bounds
+    
+    def redraw(self, queue = True):
+        """
+        Redraw the page this component is on. Only the area occupied by this
+        component (and its scrollbar, if it has one) is repainted.
+        """
+        root = self.get_root()
+        if root is not self and isinstance(root, G15Page):
+            screen = root.get_screen()
+            if screen and self.scrollbar is not None and self.scrollbar.get_root() is root:
+                scrollbar_bounds = self.scrollbar.get_page_bounds()
+                if scrollbar_bounds is not None:
+                    screen.damage(scrollbar_bounds)
+            root.redraw(queue, self.get_page_bounds())
                 
     def on_configure(self):
         pass
@@ -660,10 +946,10 @@ class G15Page(Component):
         if not self.focused_component and component.focusable:
             self.next_focus(False)  
             
-    def redraw(self, queue = True):
+    def redraw(self, queue = True, region = None):
         screen = self.get_screen()
         if screen:
-            screen.redraw(self, queue)
+            screen.redraw(self, queue = queue, region = region)
             
     def next_focus(self, redraw = True):
         focus_list = self._add_to_focus_list(self, [])
@@ -794,7 +1080,7 @@ class G15Page(Component):
         try:
             scroll = self.check_for_scroll()
             if scroll and self.theme_scroll_timer == None:
-                self.theme_scroll_timer = g15scheduler.schedule("ScrollRedraw", self.screen.service.scroll_delay, self.scroll_and_reschedule)
+                self.theme_scroll_timer = g15scheduler.schedule("ScrollRedraw", self.screen.service.scroll_delay, self.scroll_and_reschedule, priority = g15scheduler.PRIORITY_HIGH)
             elif not scroll and self.theme_scroll_timer != None:
                 self.theme_scroll_timer.cancel()
                 self.theme_scroll_timer = None
@@ -804,9 +1090,17 @@ class G15Page(Component):
     def scroll_and_reschedule(self):
         self.scroll_lock.acquire()
         try:
+            # Only the components that scroll need repainting
+            regions = self.get_scroll_bounds()
             self.do_scroll()
             self.theme_scroll_timer = None
-            self.redraw()
+            screen = self.get_screen()
+            if regions and screen:
+                for region in regions[1:]:
+                    screen.damage(region)
+                self.redraw(region = regions[0])
+            else:
+                self.redraw()
         finally:
             self.scroll_lock.release()
             
@@ -1056,9 +1350,9 @@ class Menu(Component):
                 if self.scroll_timer is not None:
                     self.scroll_timer.cancel()
                 if self.get_screen().service.animated_menus:
-                    self.scroll_timer = g15scheduler.schedule("ScrollTo", self.get_screen().service.animation_delay, self.get_root().redraw)
+                    self.scroll_timer = g15scheduler.schedule("ScrollTo", self.get_screen().service.animation_delay, self.redraw, priority = g15scheduler.PRIORITY_HIGH)
                 else:
-                    self.get_root().redraw()
+                    self.redraw()
             
             Component.paint(self, canvas)
         finally:
@@ -1457,6 +1751,10 @@ class G15Theme(object):
         self.component = None
         self.auto_dirty = auto_dirty
         self.render = None
+        self.render_cache = g15cache.LRUCache(RENDER_CACHE_SIZE)
+        self.incremental = True
+        self.document_template = None
+        self.measured_text = False
         self.scroll_state = {}
         self.nsmap = {
             'sodipodi': 'http://sodipodi.sourceforge.net/DTD/sodipodi-0.dtd',
@@ -1476,10 +1774,15 @@ class G15Theme(object):
     def clear_scroll(self):
         for s in self.scroll_state:
             self.scroll_state[s].reset()
+        self._invalidate_render()
         
     def _set_component(self, component):
         self.render_lock.acquire()
         try:
+            # Any previously rendered documents are no longer valid
+            self.render_cache.clear()
+            self.document_template = None
+            
             if self.component is not None and component is None:
                 # Give the python portion of the theme chance to de-initialize
                 if self.instance is not None and hasattr(self.instance, 'destroy'):
@@ -1545,7 +1848,10 @@ class G15Theme(object):
                     raise Exception("Must either supply theme directory or SVG text")
                     
                 self.process_svg()
-                self.bounds = g15svg.get_bounds(self.document.getroot())
+                root = self.document.getroot()
+                self.bounds = g15svg.get_bounds(root)
+                self.measured_text = len(root.xpath('//svg:text[@clip-path]',namespaces=self.nsmap)) > 0 or \
+                    len(root.xpath('//svg:rect[@class=\'textbox\']',namespaces=self.nsmap)) > 0
         finally:
             self.render_lock.release()
         
@@ -1685,6 +1991,8 @@ class G15Theme(object):
     
     def mark_dirty(self):
         self.dirty = True
+        if self.render is not None and self.render.cache_key is not None:
+            self.render_cache.remove(self.render.cache_key)
             
     def draw(self, canvas, properties = {}, attributes = {}):
         if self.render != None and self.auto_dirty:
@@ -1701,7 +2009,6 @@ class G15Theme(object):
             self.text.set_canvas(canvas)
             
             try:
-                document = deepcopy(self.document)
                 processing_result = None
                 
                 # Give the python portion of the theme chance to draw stuff under the SVG
@@ -1710,39 +2017,15 @@ class G15Theme(object):
                         self.instance.paint_background(properties, attributes)
                     except Exception as e:
                         logger.debug("Error painting background", exc_info = e)
-                    
-                root = document.getroot()
-                         
-                # Process the SVG         
-                self._process_deletes(root, properties)
-                self._process_components(root)
-                self._set_progress_bars(root, properties) 
-                self._set_relative_image_paths(root)
-                self._convert_image_urls(root, properties)
-                self._do_shadow("shadow", self.screen.driver.get_color_as_hexrgb(g15driver.HINT_BACKGROUND, (255, 255,255)), root)
-                self._do_shadow("reverseshadow", self.screen.driver.get_color_as_hexrgb(g15driver.HINT_FOREGROUND, (0, 0, 0)), root)
-                self._set_highlight_color(root)
-                
-                text_boxes = []
-                self._handle_text_boxes(root, text_boxes, properties, canvas)        
-                    
-                # Pass the SVG document to the SVG processor if there is one
-                if self.svg_processor != None:
-                    self.svg_processor(document, properties, attributes)
-                
-                # Pass the SVG document to the theme's python code to manipulate the document if required
-                if self.instance is not None and hasattr(self.instance, 'process_svg'):
-                    try:
-                        processing_result = self.instance.process_svg(self.driver,
-                                                                      root,
-                                                                      properties,
-                                                                      self.nsmap)
-                    except Exception as e:
-                        logger.debug("Error processing SVG", exc_info = e)
-                    
-                self._set_default_style(root)
-                    
-                self.render = Render(document, properties, text_boxes, attributes, processing_result)
+                        
+                document_template = self._get_document_template()
+                if document_template is not None:
+                    # Only the parts of the document that depend on changed properties are updated
+                    document_template.update(properties)
+                    self.render = Render(document_template.document, properties, [], attributes, processing_result)
+                    self.render.substituted = True
+                else:
+                    self.render = self._process_document(canvas, properties, attributes)
                 self.dirty = False
             finally:
                 self.render_lock.release()
@@ -1754,6 +2037,17 @@ class G15Theme(object):
             
     def is_scroll_required(self):
         return len(self.scroll_state) > 0
+    
+    def is_incremental(self):
+        """
+        Get if this theme may be drawn incrementally. This is only possible when
+        the document is only changed by the theme properties, so not if there
+        are child components or custom SVG processing. Text that is measured
+        (i.e. scrolled or wrapped) also requires the full processing.
+        """
+        return self.incremental and not self.measured_text and self.svg_processor is None and \
+            not ( self.instance is not None and hasattr(self.instance, 'process_svg') ) and \
+            not ( self.component is not None and len(self.component.child_map) > 0 )
             
     def do_scroll(self):
         try:
@@ -1761,6 +2055,7 @@ class G15Theme(object):
             if len(self.scroll_state) > 0:
                 for key in self.scroll_state:
                     self.scroll_state[key].next()
+                self._invalidate_render()
                 return True
         finally:
             self.render_lock.release()
@@ -1769,6 +2064,111 @@ class G15Theme(object):
     Private
     """
     
+    def _process_document(self, canvas, properties, attributes):
+        """
+        Process a copy of the whole document with the current properties. 
+        
+        Keyword arguments:
+        canvas        -- canvas
+        properties    -- theme properties
+        attributes    -- theme attributes
+        """
+        processing_result = None
+        document = deepcopy(self.document)
+        root = document.getroot()
+                 
+        # Process the SVG         
+        self._process_deletes(root, properties)
+        self._process_components(root)
+        self._set_progress_bars(root, properties) 
+        self._set_relative_image_paths(root)
+        self._convert_image_urls(root, properties)
+        self._do_shadow("shadow", self.screen.driver.get_color_as_hexrgb(g15driver.HINT_BACKGROUND, (255, 255,255)), root)
+        self._do_shadow("reverseshadow", self.screen.driver.get_color_as_hexrgb(g15driver.HINT_FOREGROUND, (0, 0, 0)), root)
+        self._set_highlight_color(root)
+        
+        text_boxes = []
+        self._handle_text_boxes(root, text_boxes, properties, canvas)        
+            
+        # Pass the SVG document to the SVG processor if there is one
+        if self.svg_processor != None:
+            self.svg_processor(document, properties, attributes)
+        
+        # Pass the SVG document to the theme's python code to manipulate the document if required
+        if self.instance is not None and hasattr(self.instance, 'process_svg'):
+            try:
+                processing_result = self.instance.process_svg(self.driver,
+                                                              root,
+                                                              properties,
+                                                              self.nsmap)
+            except Exception as e:
+                logger.debug("Error processing SVG", exc_info = e)
+            
+        self._set_default_style(root)
+            
+        return Render(document, properties, text_boxes, attributes, processing_result)
+    
+    def _get_theme_colors(self):
+        driver = self.screen.driver
+        return ( driver.get_color_as_hexrgb(g15driver.HINT_BACKGROUND, (255, 255,255)),
+                 driver.get_color_as_hexrgb(g15driver.HINT_FOREGROUND, (0, 0, 0)),
+                 driver.get_control_for_hint(g15driver.HINT_HIGHLIGHT) is not None and \
+                    driver.get_color_as_hexrgb(g15driver.HINT_HIGHLIGHT, (255, 0, 0 )),
+                 self._get_default_fill() )
+    
+    def _get_document_template(self):
+        """
+        Get the compiled document used to draw incrementally, compiling it if
+        required. None will be returned if this theme can not be drawn 
+        incrementally.
+        """
+        if not self.is_incremental():
+            self.document_template = None
+            return None
+        
+        colors = self._get_theme_colors()
+        if self.document_template is not None and self.document_template.colors == colors:
+            return self.document_template
+        
+        document = deepcopy(self.document)
+        root = document.getroot()
+        
+        # Process everything that does not depend on properties
+        self._set_relative_image_paths(root)
+        self._do_shadow("shadow", colors[0], root)
+        self._do_shadow("reverseshadow", colors[1], root)
+        self._set_highlight_color(root)
+        self._set_default_style(root)
+        
+        document_template = DocumentTemplate(document, colors)
+        for element in root.xpath('//svg:*[@title]',namespaces=self.nsmap):
+            args = element.get("title").split(" ")
+            if args[0] == "del":
+                var = args[1]
+                condition = not var.startswith("!")
+                document_template.add_slot(DeleteSlot(element, var if condition else var[1:], condition, document_template.holder))
+        for element in root.xpath('//svg:rect[@class=\'progress\']',namespaces=self.nsmap):
+            id = element.get("id")
+            if id.endswith("_progress"):
+                document_template.add_slot(ProgressSlot(element, id[:-9]))
+        image_elements = set()
+        for element in root.xpath('//svg:image[@title]',namespaces=self.nsmap):
+            image_elements.add(element)
+            document_template.add_slot(ImageSlot(element, element.get("title")))
+        for element in root.iter():
+            if not isinstance(element.tag, basestring):
+                continue
+            if element.text and "$" in element.text:
+                document_template.add_slot(TextSlot(element, "text", element.text))
+            if element.tail and "$" in element.tail:
+                document_template.add_slot(TextSlot(element, "tail", element.tail))
+            for key, val in element.items():
+                if "$" in val and not ( element in image_elements and key == "{http://www.w3.org/1999/xlink}href" ):
+                    document_template.add_slot(TextSlot(element, key, val))
+        
+        self.document_template = document_template
+        return document_template
+    
     def _process_components(self, root):
         """
         Find all elements that are associated with child components in the component this
@@ -1807,8 +2207,7 @@ class G15Theme(object):
                     if var.startswith("!"):
                         var = var[1:]
                         condition = False
-                    if ( condition and var in properties and properties[var] != "" and properties[var] != False ) or \
-                        ( not condition and ( not var in properties or properties[var] == "" or properties[var] == False ) ):
+                    if is_delete_required(properties, var, condition):
                         element.getparent().remove(element)
     
     def _set_progress_bars(self, root, properties):
@@ -1827,10 +2226,7 @@ class G15Theme(object):
             if id.endswith("_progress"):
                 property_key = id[:-9]
                 if property_key in properties:
-                    value = float(properties[property_key])
-                    if value == 0:
-                        value = 0.1
-                    element.set("width", str(int((bounds[2] / 100.0) * value)))
+                    element.set("width", get_progress_width(bounds, properties[property_key]))
                 else:
                     logger.warning("Found progress element with an ID that doesn't exist in " + \
                                    "theme properties. Theme directory is %s, variant is %s." % (self.dir, self.variant ))
@@ -1872,21 +2268,7 @@ class G15Theme(object):
         for element in root.xpath('//svg:image',namespaces=self.nsmap):
             id = element.get("title")
             if id != None and id in properties and properties[id] != None:
-                file_str = StringIO()
-                val = properties[id]
-                if isinstance(val, str) and str(val).startswith("file:"):
-                    file_str.write(val[5:])
-                elif isinstance(val, str) and str(val).startswith("/"):
-                    file_str.write(val)
-                else:
-                    file_str.write("data:image/png;base64,")
-                    img_data = StringIO()
-                    if isinstance(val, cairo.Surface):
-                        val.write_to_png(img_data)
-                        file_str.write(base64.b64encode(img_data.getvalue()))
-                    else: 
-                        file_str.write(val)
-                element.set("{http://www.w3.org/1999/xlink}href", file_str.getvalue())
+                element.set("{http://www.w3.org/1999/xlink}href", get_image_url(properties[id]))
     
     def _set_default_style(self, root):        
         """
@@ -1897,11 +2279,8 @@ class G15Theme(object):
         root        -- root document element
         """
         root_style = root.get("style")
-        fg_c = self.screen.driver.get_control_for_hint(g15driver.HINT_FOREGROUND)
-        fg_h = None
-        if fg_c != None:
-            val = fg_c.value
-            fg_h = "#%02x%02x%02x" % ( val[0],val[1],val[2] )
+        fg_h = self._get_default_fill()
+        if fg_h != None:
             if root_style != None:
                 root_styles = self.parse_css(root_style)
             else:
@@ -1909,6 +2288,12 @@ class G15Theme(object):
             root_styles["fill"] = fg_h
             root.set("style", self.format_styles(root_styles))
     
+    def _get_default_fill(self):
+        fg_c = self.screen.driver.get_control_for_hint(g15driver.HINT_FOREGROUND)
+        if fg_c != None:
+            val = fg_c.value
+            return "#%02x%02x%02x" % ( val[0],val[1],val[2] )
+    
     def _handle_text_boxes(self, root, text_boxes, properties, canvas):
         
         # Look for text elements that have a clip path. If the rendered text is wider than
@@ -2058,30 +2443,9 @@ class G15Theme(object):
         pass
             
     def _render_document(self, canvas, render):
-            
-        encoded_properties = {}
-        # Encode entities in all the property values
-        for key in render.properties.keys():
-            encoded_properties[key] = saxutils.escape(str(render.properties[key]))
-                
-        xml = etree.tostring(render.document)
-        t = Template(xml)
-        xml = t.safe_substitute(encoded_properties)       
-        svg = rsvg.Handle()
-        try :
-            svg.write(xml)
-            if DEBUG_SVG:
-                print "------------------------------------------------------"
-                print xml
-                print "------------------------------------------------------"
-        except Exception as e:
-            logger.debug("Could not write SVG", exc_info = e)
-        try :
-            svg.close()
-        except Exception as e:
-            logger.debug("Could not close SVG", exc_info = e)
-        
-        svg.render_cairo(canvas)
+        if render.svg is None:
+            render.svg = self._get_rendered_svg(render)
+        self._paint_svg(canvas, render.svg)
          
         if len(render.text_boxes) > 0:
             rgb = self.screen.driver.get_color_as_ratios(g15driver.HINT_FOREGROUND, ( 0, 0, 0 ))
@@ -2099,6 +2463,87 @@ class G15Theme(object):
             except Exception as e:
                 logger.debug("Error painting foreground", exc_info = e)
             
+    def _get_rendered_svg(self, render):
+        """
+        Get the parsed SVG for a render. The final document (after property
+        substitution) is used as the cache key, so it accounts for the theme,
+        the property values and the driver colours that have been applied
+        while processing the document.
+        
+        Keyword arguments:
+        render        -- render to get SVG for
+        """
+        xml = etree.tostring(render.document)
+        if not render.substituted:
+            encoded_properties = {}
+            # Encode entities in all the property values
+            for key in render.properties.keys():
+                encoded_properties[key] = saxutils.escape(str(render.properties[key]))
+            t = Template(xml)
+            xml = t.safe_substitute(encoded_properties)
+        render.cache_key = hashlib.md5(xml).digest()
+        rendered = self.render_cache.get(render.cache_key)
+        if rendered is not None:
+            return rendered
+               
+        svg = rsvg.Handle()
+        try :
+            svg.write(xml)
+            if DEBUG_SVG:
+                print "------------------------------------------------------"
+                print xml
+                print "------------------------------------------------------"
+        except Exception as e:
+            logger.debug("Could not write SVG", exc_info = e)
+        try :
+            svg.close()
+        except Exception as e:
+            logger.debug("Could not close SVG", exc_info = e)
+            
+        rendered = RenderedSVG(svg)
+        self.render_cache.put(render.cache_key, rendered)
+        return rendered
+    
+    def _paint_svg(self, canvas, rendered):
+        """
+        Paint a parsed SVG document. Documents that are painted repeatedly are
+        rasterized the second time round, providing the canvas is not scaled or
+        rotated, and is at a whole pixel position.
+        
+        Keyword arguments:
+        canvas        -- canvas to paint on
+        rendered      -- parsed SVG
+        """
+        rendered.paints += 1
+        if rendered.surface is None and rendered.paints > 1:
+            xx, yx, xy, yy, x0, y0 = canvas.get_matrix()
+            if xx == 1 and yy == 1 and xy == 0 and yx == 0 and x0 == int(x0) and y0 == int(y0):
+                width = rendered.handle.props.width
+                height = rendered.handle.props.height
+                if width > 0 and height > 0:
+                    surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, width, height)
+                    surface_context = cairo.Context(surface)
+                    surface_context.set_antialias(canvas.get_antialias())
+                    surface_context.set_font_options(canvas.get_font_options())
+                    rendered.handle.render_cairo(surface_context)
+                    rendered.surface = surface
+                    
+        if rendered.surface is not None:
+            canvas.save()
+            canvas.set_source_surface(rendered.surface, 0, 0)
+            canvas.paint()
+            canvas.restore()
+        else:
+            rendered.handle.render_cairo(canvas)
+            
+    def _invalidate_render(self):
+        """
+        Forget the parsed SVG of the current render, as the document has been
+        changed in place (e.g. by scrolling)
+        """
+        if self.render is not None:
+            self.render.svg = None
+            
     def _render_text_box(self, canvas, text_box, rgb, bg_rgb):
         self._update_text(text_box, text_box.wrap)
         
@@ -2112,10 +2557,7 @@ class G15Theme(object):
                 canvas.set_source_rgb(bg_rgb[0], bg_rgb[1], bg_rgb[2])
             else:
                 canvas.set_source_rgb(rgb[0], rgb[1], rgb[2])
-            for x in range(-1, 2):
-                for y in range(-1, 2):
-                    if x != 0 or y != 0:
-                        self.text.draw(text_box.bounds[0] + x, text_box.bounds[1] + y - text_box.base)
+            self.text.draw_outline(text_box.bounds[0], text_box.bounds[1] - text_box.base)
         
         # Draw primary text to canvas                
         canvas.set_source_rgb(rgb[0], rgb[1], rgb[2])
@@ -21,36 +21,230 @@ is the GObject based bindings, which would be great except it means converting
 ALL of Gnome15 to use such bindings.
 
 This class is stop gap until a better solution can be found
+
+The system wide statistics (CPU, memory, network and uptime) are gathered by
+a single Sampler, which reads each file in /proc once per sample and shares
+the result between all callers as an immutable Snapshot. Anything that asks
+for statistics within DEFAULT_MAX_AGE seconds of the last sample gets the same
+snapshot, so the cost of sampling does not depend on how many plugins (or 
+how many CPUs and network interfaces) are being monitored.
 """
 
 import os
 import time
+from collections import namedtuple
+from threading import RLock
+
+# Logging
+import logging
+logger = logging.getLogger(__name__)
+
+"""
+Maximum age in seconds of a snapshot that will be returned by get_snapshot() (and
+so by the gtop compatible functions) before a new sample is taken
+"""
+DEFAULT_MAX_AGE = 0.25
+
+_scale = { 'kB': 1024, 'mB': 1024 * 1024,
+           'KB': 1024, 'MB': 1024 * 1024 }
+
+"""
+Times (in USER_HZ) a CPU has spent in each state
+"""
+CPU = namedtuple("CPU", "name user nice sys idle")
+
+"""
+System memory in bytes
+"""
+Mem = namedtuple("Mem", "total free cached")
+
+"""
+Total bytes received and sent by a network interface
+"""
+NetworkLoad = namedtuple("NetworkLoad", "net bytes_in bytes_out")
 
-class CPU():
-    def __init__(self, name):
-        self.name = name
-        self.user = 0
-        self.nice = 0
-        self.sys = 0
-        self.idle = 0
+"""
+Memory used by this process in bytes
+"""
+ProcessMemory = namedtuple("ProcessMemory", "size resident stack")
 
-class CPUS(CPU):
+"""
+All statistics gathered in one sample. cpu is the total for all CPUs, cpus
+has one entry per CPU. nets is the list of network interface names, and 
+netloads a dictionary of NetworkLoad keyed by interface name. uptime is a 
+tuple of the uptime and the idle time in seconds. Snapshots are shared, so
+the lists and dictionaries they contain must not be modified.
+"""
+Snapshot = namedtuple("Snapshot", "time cpu cpus mem nets netloads uptime process")
+
+"""
+A running process, as held in a ProcessTable. start_time is in clock ticks
+since boot, and args is the list of command line arguments (empty for 
+kernel threads)
+"""
+Process = namedtuple("Process", "pid start_time uid name args")
+
+class CPUS(object):
+    """
+    Totals of all CPUs, along with a list of each individual CPU, as returned
+    by cpu()
+    """
+    def __init__(self, snapshot):
+        self.name = "CPUS"
+        self.user = snapshot.cpu.user
+        self.nice = snapshot.cpu.nice
+        self.sys = snapshot.cpu.sys
+        self.idle = snapshot.cpu.idle
+        self.cpus = list(snapshot.cpus)
+        
+class Sampler(object):
+    """
+    Takes snapshots of the system statistics. The files in /proc are kept open
+    between samples, and each is read in one go and parsed in a single pass.
+    Functions in the listeners list are invoked with each new snapshot.
+    """
+    
     def __init__(self):
-        CPU.__init__(self, "CPUS")
-        cpudata = open('/proc/stat')
-        self.cpus = []
+        self.listeners = []
+        self.samples = 0
+        self._snapshot = None
+        self._files = {}
+        self._lock = RLock()
+        
+    def get_snapshot(self, max_age = DEFAULT_MAX_AGE):
+        """
+        Get the latest snapshot, taking a new sample if it is older than
+        max_age seconds.
+        
+        Keyword arguments:
+        max_age    -- maximum age of the snapshot in seconds
+        """
+        self._lock.acquire()
         try:
-            for line in cpudata:
-                if line.startswith("cpu"):
-                    (name, cuse, cn, csys, idle, tail) = line.split(None, 5)
-                    cpu = self if name == "cpu" else CPU(name)
-                    self.user = int(cuse)
-                    self.nice = int(cn)
-                    self.sys = int(csys)
-                    self.idle = int(idle)
-                    self.cpus.append(cpu)
+            snapshot = self._snapshot
+            if snapshot is not None and time.time() - snapshot.time <= max_age:
+                return snapshot
+            snapshot = self._sample()
+            self._snapshot = snapshot
+            self.samples += 1
         finally:
-            cpudata.close()
+            self._lock.release()
+        for listener in list(self.listeners):
+            listener(snapshot)
+        return snapshot
+    
+    def close(self):
+        """
+        Close the files held open between samples
+        """
+        self._lock.acquire()
+        try:
+            for fd in self._files.values():
+                os.close(fd)
+            self._files = {}
+        finally:
+            self._lock.release()
+    
+    """
+    Private
+    """
+    def _sample(self):
+        cpu, cpus = self._parse_stat(self._read("/proc/stat"))
+        nets, netloads = self._parse_net_dev(self._read("/proc/net/dev"))
+        uptime_vals = self._read("/proc/uptime").split()
+        return Snapshot(time.time(), cpu, cpus, 
+                        self._parse_meminfo(self._read("/proc/meminfo")),
+                        nets, netloads, 
+                        ( float(uptime_vals[0]), float(uptime_vals[1]) ),
+                        self._parse_status(self._read("/proc/self/status")))
+    
+    def _read(self, path):
+        for attempt in range(0, 2):
+            fd = self._files.get(path)
+            try:
+                if fd is None:
+                    fd = os.open(path, os.O_RDONLY)
+                    self._files[path] = fd
+                else:
+                    os.lseek(fd, 0, os.SEEK_SET)
+                chunks = []
+                while True:
+                    chunk = os.read(fd, 65536)
+                    if not chunk:
+                        break
+                    chunks.append(chunk)
+                return "".join(chunks)
+            except OSError as e:
+                # Try again with the file reopened
+                if fd is not None:
+                    del self._files[path]
+                    try:
+                        os.close(fd)
+                    except OSError:
+                        pass
+                if attempt == 1:
+                    raise
+                logger.debug("Failed to read %s, reopening", path, exc_info = e)
+    
+    def _parse_stat(self, text):
+        cpu = None
+        cpus = []
+        for line in text.split("\n"):
+            if not line.startswith("cpu"):
+                # The CPU lines are always first
+                break
+            fields = line.split(None, 5)
+            c = CPU(fields[0], int(fields[1]), int(fields[2]), int(fields[3]), int(fields[4]))
+            if c.name == "cpu":
+                cpu = c
+            else:
+                cpus.append(c)
+        return cpu, tuple(cpus)
+    
+    def _parse_meminfo(self, text):
+        values = {}
+        for line in text.split("\n"):
+            name, _, value = line.partition(":")
+            if name in [ "MemTotal", "MemFree", "Cached" ]:
+                values[name] = int(value.split()[0]) * 1024
+                if len(values) == 3:
+                    break
+        return Mem(values.get("MemTotal", 0), values.get("MemFree", 0), values.get("Cached", 0))
+    
+    def _parse_net_dev(self, text):
+        nets = []
+        netloads = {}
+        for line in text.split("\n")[2:]:
+            name, sep, data = line.partition(":")
+            if sep:
+                name = name.strip()
+                fields = data.split()
+                nets.append(name)
+                netloads[name] = NetworkLoad(name, int(fields[0]), int(fields[8]))
+        return tuple(nets), netloads
+    
+    def _parse_status(self, text):
+        values = {}
+        for line in text.split("\n"):
+            name, _, value = line.partition(":")
+            if name in [ "VmSize", "VmRSS", "VmStk" ]:
+                fields = value.split()
+                values[name] = int(fields[0]) * _scale.get(fields[1], 1)
+                if len(values) == 3:
+                    break
+        return ProcessMemory(values.get("VmSize", 0), values.get("VmRSS", 0), values.get("VmStk", 0))
+    
+sampler = Sampler()
+
+def get_snapshot(max_age = DEFAULT_MAX_AGE):
+    """
+    Get a snapshot of the system statistics, shared with all other callers. 
+    See Sampler.get_snapshot()
+    
+    Keyword arguments:
+    max_age    -- maximum age of the snapshot in seconds
+    """
+    return sampler.get_snapshot(max_age)
             
 class ProcState():
     
@@ -70,34 +264,6 @@ class ProcState():
     def _get_value(self, line):
         return line[line.index(':') + 1:].strip().split()
             
-class NetworkLoad():
-    
-    def __init__(self, net, bytes_in, bytes_out):
-        self.net = net
-        self.bytes_in = bytes_in
-        self.bytes_out = bytes_out
-        
-class Mem():
-    
-    def __init__(self):
-        self.total = 0
-        self.free = 0
-        self.cached = 0
-        memdata = open('/proc/meminfo')
-        try:
-            for line in memdata:
-                if line.startswith("MemTotal"):
-                    self.total = self._get_value(line)
-                elif line.startswith("MemFree"):
-                    self.free = self._get_value(line)
-                elif line.startswith("Cached"):
-                    self.cached = self._get_value(line)
-        finally:
-            memdata.close()
-            
-    def _get_value(self, line):
-        return int(line[line.index(':') + 1:line.index('kB')]) * 1024
-            
 def netload(net):
     """
     Get the network load details for the network interface described by the
@@ -106,44 +272,25 @@ def netload(net):
     Keyword arguments:
     net        --    network interface name
     """
-    prefix = '%6s:' % net
-    netdata = open('/proc/net/dev')
-    try:
-        for line in netdata:
-            if line.startswith(prefix):
-                data = line[line.index(':') + 1:].split()
-                return NetworkLoad(net, int(data[0]), int(data[8]))
-    finally:
-        netdata.close()
-    
+    return get_snapshot().netloads.get(net)
             
 def netlist():
     """
-    Returns a list of Net objects, one for each available network interface 
-    """
-    nets = []
-    f = open("/proc/net/dev", "r")
-    tmp = f.readlines(2000)
-    f.close()
-    for line in tmp:
-        line = line.strip()
-        line = line.split(' ')
-        if len(line) > 0 and line[0].endswith(":"):
-            nets.append(line[0][:-1])
-            
-    return nets
+    Returns a list of the names of all available network interfaces 
+    """
+    return list(get_snapshot().nets)
     
 def cpu():
     """
     Return an object containing data about all available CPUS
     """
-    return CPUS()
+    return CPUS(get_snapshot())
 
 def mem():
     """
-    Return an object containing data about all available CPUS
+    Return an object containing data about system memory
     """
-    return Mem()
+    return get_snapshot().mem
 
 def proclist():
     """
@@ -181,6 +328,75 @@ def proc_args(pid):
     finally:
         cmddata.close()
 
+class ProcessTable(object):
+    """
+    A table of all running processes, keyed by process ID, that is brought up
+    to date incrementally. Each refresh only reads /proc/<pid>/stat for 
+    processes that are already known, and only reads the full details of 
+    processes that have started since the last refresh. A process is 
+    identified by both its ID and start time, so a new process that re-uses
+    the ID of one that has exited is detected.
+    """
+    
+    def __init__(self):
+        self.processes = {}
+        self._lock = RLock()
+        
+    def refresh(self):
+        """
+        Bring the table up to date. Returns a tuple of two sets, the IDs of
+        processes that have started (or replaced a process with the same ID),
+        and the IDs of processes that have exited.
+        """
+        self._lock.acquire()
+        try:
+            processes = self.processes
+            pids = set(int(d) for d in os.listdir("/proc") if d.isdigit())
+            removed = set(processes) - pids
+            for pid in removed:
+                del processes[pid]
+            added = set()
+            for pid in pids:
+                process = processes.get(pid)
+                try:
+                    stat = self._read("/proc/%d/stat" % pid)
+                    # The name may contain spaces and brackets, so split after the last one 
+                    start_time = int(stat[stat.rindex(")") + 2:].split(None, 20)[19])
+                    if process is not None and process.start_time == start_time:
+                        continue
+                    processes[pid] = Process(pid, start_time, self._read_uid(pid), 
+                                             stat[stat.index("(") + 1:stat.rindex(")")],
+                                             self._read_args(pid))
+                    added.add(pid)
+                except (IOError, OSError, ValueError):
+                    # Exited since /proc was listed
+                    if process is not None:
+                        del processes[pid]
+                        removed.add(pid)
+            return added, removed
+        finally:
+            self._lock.release()
+    
+    """
+    Private
+    """
+    def _read(self, path):
+        f = open(path)
+        try:
+            return f.read()
+        finally:
+            f.close()
+            
+    def _read_uid(self, pid):
+        for line in self._read("/proc/%d/status" % pid).split("\n"):
+            if line.startswith("Uid:"):
+                return int(line[4:].split()[0])
+        return 0
+    
+    def _read_args(self, pid):
+        cmdline = self._read("/proc/%d/cmdline" % pid)
+        return cmdline.rstrip("\0").split("\0") if cmdline else []
+
 class Uptime:
     def __init__(self, uptime, idletime):
         self.uptime = uptime
@@ -191,14 +407,7 @@ def uptime():
     """
     Get the uptime of the computer
     """
-    cmddata = open('/proc/uptime')
-    try:
-        for line in cmddata:
-            vals = line.strip('\n').split(' ')
-    finally:
-        cmddata.close()
-
-    return Uptime(float(vals[0]), float(vals[1]))
+    return Uptime(*get_snapshot().uptime)
 
 if __name__ == "__main__":
     for d in proclist():
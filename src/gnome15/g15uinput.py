@@ -330,6 +330,46 @@ def emit(target, code, value, syn=True):
         uinput_devices[target].emit( code, value, syn)
     finally:
         locks[target].release()
+        
+class EventBatch(object):
+    """
+    Collects consecutive input events, so that a single SYN is sent to each
+    device that received events rather than one per event. The events are
+    written immediately, only the SYN is deferred until flush() is called.
+    
+    The kernel merges events for the same code within one SYN, so a press
+    and release of the same key would be lost. A SYN is sent first if an
+    event is emitted for a code that is already in the batch.
+    """
+    
+    def __init__(self):
+        self.targets = []
+        self.codes = set()
+        
+    def emit(self, target, code, value):
+        """
+        Emit an input event without a SYN. See emit() for the arguments.
+        """
+        if ( target, code ) in self.codes:
+            self.flush()
+        emit(target, code, value, False)
+        self.codes.add(( target, code ))
+        if not target in self.targets:
+            self.targets.append(target)
+            
+    def flush(self):
+        """
+        Emit a SYN for each device that has received events since the last
+        flush.
+        """
+        for target in self.targets:
+            locks[target].acquire()
+            try:
+                syn(target)
+            finally:
+                locks[target].release()
+        self.targets = []
+        self.codes.clear()
     
 def __get_keys(prefix, exclude = None):
     l = []
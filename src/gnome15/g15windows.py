@@ -0,0 +1,127 @@
+#  Gnome15 - Suite of tools for the Logitech G series keyboards and headsets
+#  Copyright (C) 2010 Brett Smith <tanktarta@blueyonder.co.uk>
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Tracks the active window using WNCK, for use when BAMF is not available.
+
+WNCK watches the _NET_ACTIVE_WINDOW and _NET_WM_NAME properties on behalf of
+the tracker, so there is no polling. Focus often flaps between windows (for
+example when a dialog opens and closes, or while alt-tabbing), so changes are
+only reported once the active window has settled for a short while.
+'''
+
+import gobject
+
+# Logging
+import logging
+logger = logging.getLogger(__name__)
+
+"""
+Number of milliseconds the active window must remain the same before a change
+is reported
+"""
+DEFAULT_SETTLE_TIME = 150
+
+class WindowTracker(object):
+    """
+    Informs listeners of the application name and window title of the active
+    window whenever either changes. Each listener is a function that accepts
+    the application name and the window title.
+    """
+
+    def __init__(self, settle_time = DEFAULT_SETTLE_TIME):
+        """
+        Keyword arguments:
+        settle_time        -- milliseconds to wait for focus to settle
+        """
+        import wnck
+        self.settle_time = settle_time
+        self.listeners = []
+        self.application_name = None
+        self.window_title = None
+        self._screen = wnck.screen_get_default()
+        self._screen_handle = None
+        self._window = None
+        self._window_handle = None
+        self._settle_source = None
+
+    def start(self):
+        """
+        Start tracking the active window. Listeners will be informed of the
+        current window once it has been determined.
+        """
+        self._screen.force_update()
+        self._screen_handle = self._screen.connect("active-window-changed", self._active_window_changed)
+        self._active_window_changed(self._screen, None)
+
+    def stop(self):
+        """
+        Stop tracking the active window.
+        """
+        self._cancel_settle()
+        self._disconnect_window()
+        if self._screen_handle is not None:
+            self._screen.disconnect(self._screen_handle)
+            self._screen_handle = None
+
+    """
+    Private
+    """
+    def _active_window_changed(self, screen, previous_window):
+        self._disconnect_window()
+        window = screen.get_active_window()
+        if window is not None and not window.is_skip_pager():
+            self._window = window
+            self._window_handle = window.connect("name-changed", self._window_name_changed)
+        self._settle()
+
+    def _window_name_changed(self, window):
+        self._settle()
+
+    def _disconnect_window(self):
+        if self._window_handle is not None:
+            self._window.disconnect(self._window_handle)
+            self._window_handle = None
+        self._window = None
+
+    def _settle(self):
+        self._cancel_settle()
+        self._settle_source = gobject.timeout_add(self.settle_time, self._settled)
+
+    def _cancel_settle(self):
+        if self._settle_source is not None:
+            gobject.source_remove(self._settle_source)
+            self._settle_source = None
+
+    def _settled(self):
+        self._settle_source = None
+        window = self._window
+        if window is None:
+            # Desktop or a window not shown in the pager, keep the current profile
+            return False
+
+        app = window.get_application()
+        application_name = app.get_name() if app is not None else ""
+        window_title = window.get_name()
+        if application_name != self.application_name or window_title != self.window_title:
+            self.application_name = application_name
+            self.window_title = window_title
+            for listener in list(self.listeners):
+                try:
+                    listener(application_name, window_title)
+                except Exception as e:
+                    logger.warning("Active window listener failed", exc_info = e)
+        return False
@@ -19,13 +19,29 @@
 # Free Software Foundation, Inc., 51 Franklin St, Fifth Floor,
 # Boston, MA 02110-1301, USA.
 """
-GdkPixbuf thumbnail sink
+GdkPixbuf thumbnail sink, and a sink that delivers video frames sized and
+formatted for the LCD
 """
 
 import gobject
 import gst
+import sys
+import cairo
+import array
+import ctypes
 import struct
 import time
+import threading
+
+# Logging
+import logging
+logger = logging.getLogger(__name__)
+
+try:
+    import numpy
+except Exception as e:
+    logger.debug("NumPy not available, video frames will be copied via strings", exc_info = e)
+    numpy = None
 
 big_to_cairo_alpha_mask = struct.unpack('=i', '\xFF\x00\x00\x00')[0]
 big_to_cairo_red_mask = struct.unpack('=i', '\x00\xFF\x00\x00')[0]
@@ -90,3 +106,296 @@ class CairoSurfaceThumbnailSink(gst.BaseSink):
         return self.do_render(buf)
 
 gobject.type_register(CairoSurfaceThumbnailSink)
+
+"""
+Number of surfaces in each frame pool. One is being displayed while the other
+is filled with the next frame (or is waiting to be displayed)
+"""
+FRAME_POOL_SIZE = 2
+
+"""
+Frames later than this are dropped by the sink, and upstream elements are
+told (by QoS events) to skip decoding them
+"""
+MAX_LATENESS = 20 * gst.MSECOND
+
+_NATIVE_ENDIANNESS = 1234 if sys.byteorder == "little" else 4321
+
+"""
+Caps for each cairo format video may be delivered in. Cairo's RGB24 is
+32 bits per pixel (the top 8 unused) and RGB16_565 is 16 bits per pixel, both
+in native byte order. A8 is used to carry grayscale for monochrome LCDs
+"""
+_FORMAT_CAPS = {
+    cairo.FORMAT_RGB24 : "video/x-raw-rgb, bpp = (int) 32, depth = (int) 24, "
+                         "endianness = (int) BIG_ENDIAN, "
+                         "red_mask = (int) %i, green_mask = (int) %i, blue_mask = (int) %i" 
+                         % ( big_to_cairo_red_mask, big_to_cairo_green_mask, big_to_cairo_blue_mask ),
+    cairo.FORMAT_A8 : "video/x-raw-gray, bpp = (int) 8, depth = (int) 8"
+}
+if hasattr(cairo, "FORMAT_RGB16_565"):
+    _FORMAT_CAPS[cairo.FORMAT_RGB16_565] = "video/x-raw-rgb, bpp = (int) 16, depth = (int) 16, " \
+                                           "endianness = (int) %d, " \
+                                           "red_mask = (int) 63488, green_mask = (int) 2016, blue_mask = (int) 31" \
+                                           % _NATIVE_ENDIANNESS
+
+def get_frame_format(bpp):
+    """
+    Get the cairo format video should be delivered in for an LCD
+    
+    Keyword arguments:
+    bpp            -- bits per pixel of the LCD, as returned by the driver
+    """
+    if bpp == 16 and getattr(cairo, "FORMAT_RGB16_565", None) in _FORMAT_CAPS:
+        return cairo.FORMAT_RGB16_565
+    elif bpp > 1:
+        return cairo.FORMAT_RGB24
+    return cairo.FORMAT_A8
+
+def get_frame_caps(frame_format, width = None, height = None):
+    """
+    Get the caps for video frames of a cairo format, optionally of a fixed
+    size.
+    
+    Keyword arguments:
+    frame_format   -- cairo format
+    width          -- width, or None for any width
+    height         -- height, or None for any height
+    """
+    caps = _FORMAT_CAPS[frame_format]
+    caps += ", width = (int) %s" % ( "[ 1, max ]" if width is None else width )
+    caps += ", height = (int) %s" % ( "[ 1, max ]" if height is None else height )
+    return gst.Caps("%s, framerate = (fraction) [ 0, 25 ]" % caps)
+
+class FramePool(object):
+    """
+    A small ring of cairo surfaces that video frames are copied into. The
+    surfaces are allocated when the frame size or format changes, and reused
+    for every frame after that.
+    
+    At most one frame waits to be displayed. If another frame arrives before
+    it has been taken by get_frame(), the LCD is behind and the new frame is
+    dropped without being copied.
+    """
+    
+    def __init__(self, size = FRAME_POOL_SIZE):
+        """
+        Keyword arguments:
+        size           -- number of surfaces (at least 2)
+        """
+        self.size = max(2, size)
+        self.frames_rendered = 0
+        self.frames_dropped = 0
+        self.frame_format = None
+        self.width = 0
+        self.height = 0
+        self._lock = threading.Lock()
+        self._slots = []
+        self._pending = None
+        self._displayed = None
+        self._next = 0
+        
+    def configure(self, frame_format, width, height):
+        """
+        Allocate the surfaces for frames of a format and size. Nothing is
+        done if they are the same as the current ones.
+        
+        Keyword arguments:
+        frame_format   -- cairo format
+        width          -- width of frames
+        height         -- height of frames
+        """
+        self._lock.acquire()
+        try:
+            if ( frame_format, width, height ) == ( self.frame_format, self.width, self.height ):
+                return
+            stride = cairo.ImageSurface.format_stride_for_width(frame_format, width)
+            slots = []
+            for i in range(0, self.size):
+                data = array.array("B", "\0" * ( stride * height ))
+                slots.append(( data, cairo.ImageSurface.create_for_data(data, frame_format, width, height, stride) ))
+            self._slots = slots
+            self._pending = None
+            self._displayed = None
+            self._next = 0
+            self.frame_format = frame_format
+            self.width = width
+            self.height = height
+            logger.debug("Allocated %d frames of %dx%d", self.size, width, height)
+        finally:
+            self._lock.release()
+        
+    def write(self, buf):
+        """
+        Copy a frame into the pool, returning True if it is now waiting to
+        be displayed, or False if it was dropped.
+        
+        Keyword arguments:
+        buf            -- frame data (gst.Buffer, or anything supporting
+                          the buffer interface)
+        """
+        self._lock.acquire()
+        try:
+            if self._pending is not None or len(self._slots) == 0:
+                self.frames_dropped += 1
+                return False
+            index = self._next
+            if index == self._displayed:
+                index = ( index + 1 ) % self.size
+            self._next = ( index + 1 ) % self.size
+            slots = self._slots
+        finally:
+            self._lock.release()
+            
+        """
+        The slot is neither displayed nor pending, so nothing else touches it
+        while the frame is copied
+        """
+        data, surface = slots[index]
+        if len(buf) != len(data):
+            logger.debug("Dropping frame of %d bytes, expected %d", len(buf), len(data))
+            self.frames_dropped += 1
+            return False
+        if numpy is not None:
+            source = numpy.frombuffer(buf, dtype = numpy.uint8).ctypes.data
+        else:
+            source = buf.data if isinstance(buf, gst.Buffer) else str(buf)
+        ctypes.memmove(data.buffer_info()[0], source, len(data))
+        surface.mark_dirty()
+        
+        self._lock.acquire()
+        try:
+            if slots is not self._slots:
+                # Reconfigured while copying
+                return False
+            self._pending = index
+            self.frames_rendered += 1
+            return True
+        finally:
+            self._lock.release()
+        
+    def get_frame(self):
+        """
+        Get the surface of the most recent frame, or None if there has not
+        been one yet. The surface may be painted until the next call.
+        """
+        self._lock.acquire()
+        try:
+            if self._pending is not None:
+                self._displayed = self._pending
+                self._pending = None
+            if self._displayed is None:
+                return None
+            return self._slots[self._displayed][1]
+        finally:
+            self._lock.release()
+
+class CairoSurfaceFrameSink(gst.BaseSink):
+    """
+    GStreamer sink element that copies each frame into a FramePool. The
+    "frame" signal is emitted (from the streaming thread) when a frame is
+    waiting to be displayed.
+    """
+
+    __gsignals__ = {
+        "frame": (gobject.SIGNAL_RUN_LAST,
+                  gobject.TYPE_NONE,
+                  ([gobject.TYPE_UINT64]))
+        }
+
+    __gsttemplates__ = (
+        gst.PadTemplate("sink",
+                        gst.PAD_SINK,
+                        gst.PAD_ALWAYS,
+                        gst.Caps("; ".join(get_frame_caps(f).to_string() for f in _FORMAT_CAPS))),
+        )
+
+    def __init__(self, pool = None):
+        gst.BaseSink.__init__(self)
+        self.pool = pool if pool is not None else FramePool()
+        self.set_sync(True)
+        self.set_property("qos", True)
+        self.set_property("max-lateness", MAX_LATENESS)
+
+    def do_set_caps(self, caps):
+        self.log("caps %s" % caps.to_string())
+        structure = caps[0]
+        if structure.get_name() == "video/x-raw-gray":
+            frame_format = cairo.FORMAT_A8
+        elif structure.get_name() == "video/x-raw-rgb" and structure["bpp"] == 16:
+            frame_format = cairo.FORMAT_RGB16_565
+        elif structure.get_name() == "video/x-raw-rgb":
+            frame_format = cairo.FORMAT_RGB24
+        else:
+            return False
+        self.pool.configure(frame_format, structure["width"], structure["height"])
+        return True
+
+    def do_render(self, buf):
+        if self.pool.write(buf):
+            self.emit("frame", buf.timestamp)
+        return gst.FLOW_OK
+ 
+    def do_preroll(self, buf):
+        return self.do_render(buf)
+
+gobject.type_register(CairoSurfaceFrameSink)
+
+class LCDVideoSink(gst.Bin):
+    """
+    Bin that scales video to a fixed size and converts it to a format
+    suitable for the LCD, then delivers it through a CairoSurfaceFrameSink.
+    Video is scaled before it is converted, so the conversion is only ever
+    done at the (small) LCD size, and painting never needs to scale.
+    """
+
+    __gsignals__ = {
+        "frame": (gobject.SIGNAL_RUN_LAST,
+                  gobject.TYPE_NONE,
+                  ([gobject.TYPE_UINT64]))
+        }
+    
+    def __init__(self, bpp, width, height):
+        """
+        Keyword arguments:
+        bpp            -- bits per pixel of the LCD
+        width          -- width to scale video to
+        height         -- height to scale video to
+        """
+        gst.Bin.__init__(self)
+        self.frame_format = get_frame_format(bpp)
+        self.pool = FramePool()
+        self._scale = gst.element_factory_make("videoscale")
+        self._color_space = gst.element_factory_make("ffmpegcolorspace")
+        self._filter = gst.element_factory_make("capsfilter")
+        self._sink = CairoSurfaceFrameSink(self.pool)
+        self.add(self._scale, self._color_space, self._filter, self._sink)
+        gst.element_link_many(self._scale, self._color_space, self._filter, self._sink)
+        self.add_pad(gst.GhostPad("sink", self._scale.get_pad("sink")))
+        self._sink.connect("frame", self._frame)
+        self.set_size(width, height)
+        
+    def set_size(self, width, height):
+        """
+        Change the size video is scaled to. The frames delivered may keep the
+        old size until the pipeline has renegotiated.
+        
+        Keyword arguments:
+        width          -- width to scale video to
+        height         -- height to scale video to
+        """
+        self._filter.set_property("caps", get_frame_caps(self.frame_format, width, height))
+        
+    def get_frame(self):
+        """
+        Get the surface of the most recent frame (see FramePool.get_frame())
+        """
+        return self.pool.get_frame()
+    
+    """
+    Private
+    """
+    def _frame(self, sink, timestamp):
+        self.emit("frame", timestamp)
+
+gobject.type_register(LCDVideoSink)
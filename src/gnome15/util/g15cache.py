@@ -0,0 +1,173 @@
+#  Gnome15 - Suite of tools for the Logitech G series keyboards and headsets
+#  Copyright (C) 2010 Brett Smith <tanktarta@blueyonder.co.uk>
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+In-memory caches
+'''
+
+from collections import OrderedDict
+from threading import RLock
+
+# Logging
+import logging
+logger = logging.getLogger(__name__)
+
+class LRUCache(object):
+    """
+    A thread safe, bounded cache. When full, the least recently used entry
+    is evicted to make room for new ones. Counts hits, misses and evictions
+    so the effectiveness of the cache may be monitored.
+    
+    As well as the number of entries, the cache may be limited to a number of
+    bytes, given a function to determine the size of each value. 
+    """
+
+    def __init__(self, max_size = 64, max_bytes = None, sizeof = None):
+        """
+        Keyword arguments:
+        max_size    -- maximum number of entries to hold
+        max_bytes   -- maximum total size of values (or None for no limit)
+        sizeof      -- function returning the size in bytes of a value
+        """
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = RLock()
+        
+    def set_max_bytes(self, max_bytes):
+        """
+        Change the maximum total size of the values held, evicting entries if 
+        the cache is now too big.
+        
+        Keyword arguments:
+        max_bytes   -- maximum total size of values (or None for no limit)
+        """
+        self._lock.acquire()
+        try:
+            self.max_bytes = max_bytes
+            self._evict()
+        finally:
+            self._lock.release()
+
+    def get(self, key, default = None):
+        """
+        Get a cached value, marking it as the most recently used.
+
+        Keyword arguments:
+        key        -- key of entry
+        default    -- value to return if there is no such entry
+        """
+        self._lock.acquire()
+        try:
+            try:
+                value = self._entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self._entries[key] = value
+            self.hits += 1
+            return value
+        finally:
+            self._lock.release()
+
+    def put(self, key, value):
+        """
+        Add or replace a value, evicting the least recently used entries if
+        the cache is full.
+
+        Keyword arguments:
+        key        -- key of entry
+        value      -- value to cache
+        """
+        self._lock.acquire()
+        try:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = value
+            if self.sizeof is not None:
+                self.bytes += self.sizeof(value)
+            self._evict()
+        finally:
+            self._lock.release()
+
+    def remove(self, key):
+        """
+        Remove an entry if it exists, returning its value.
+
+        Keyword arguments:
+        key        -- key of entry
+        """
+        self._lock.acquire()
+        try:
+            if key in self._entries:
+                return self._remove(key)
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        """
+        Remove all entries. The statistics are not reset.
+        """
+        self._lock.acquire()
+        try:
+            self._entries.clear()
+            self.bytes = 0
+        finally:
+            self._lock.release()
+
+    def get_stats(self):
+        """
+        Get a dictionary of the statistics for this cache
+        """
+        self._lock.acquire()
+        try:
+            return { "size" : len(self._entries),
+                     "max_size" : self.max_size,
+                     "bytes" : self.bytes,
+                     "max_bytes" : self.max_bytes,
+                     "hits" : self.hits,
+                     "misses" : self.misses,
+                     "evictions" : self.evictions }
+        finally:
+            self._lock.release()
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    """
+    Private
+    """
+    def _remove(self, key):
+        value = self._entries.pop(key)
+        if self.sizeof is not None:
+            self.bytes -= self.sizeof(value)
+        return value
+
+    def _evict(self):
+        while len(self._entries) > self.max_size or \
+                ( self.max_bytes is not None and self.bytes > self.max_bytes and len(self._entries) > 0 ):
+            key, value = self._entries.popitem(last = False)
+            if self.sizeof is not None:
+                self.bytes -= self.sizeof(value)
+            self.evictions += 1
@@ -30,6 +30,7 @@ import base64
 import xdg.Mime as mime
 import g15convert
 import g15os
+import g15cache
 import gnome15.g15globals
 
 # Logging
@@ -38,6 +39,43 @@ logger = logging.getLogger(__name__)
 
 from cStringIO import StringIO
 
+"""
+Decoded images (and the data URLs made from them) are kept in a process wide
+cache, limited both in the number of entries and the total size in bytes.
+Surfaces returned from the cache are shared, so must not be drawn on.
+"""
+IMAGE_CACHE_SIZE = 256
+IMAGE_CACHE_BYTES = 16 * 1024 * 1024
+
+def _get_cached_bytes(value):
+    if isinstance(value, cairo.ImageSurface):
+        return value.get_stride() * value.get_height()
+    return len(value)
+
+image_cache = g15cache.LRUCache(IMAGE_CACHE_SIZE, IMAGE_CACHE_BYTES, _get_cached_bytes)
+
+def get_image_cache_key(filename, size = None, kind = "surface"):
+    """
+    Get the key for an image in the image cache. Local files are keyed on 
+    their modification time as well as their name, so changed files are
+    loaded again.
+    
+    Keyword arguments:
+    filename        -- filename or URL
+    size            -- requested size
+    kind            -- what is being cached
+    """
+    path = filename[7:] if filename.startswith("file://") else filename
+    mtime = None
+    if not is_url(path):
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            pass
+    if isinstance(size, list):
+        size = tuple(size)
+    return ( kind, filename, size, mtime )
+
 def rotate(context, degrees):
     context.rotate(g15convert.degrees_to_radians(degrees));
     
@@ -72,11 +110,30 @@ def is_url(path):
     return "://" in path
     
 def load_surface_from_file(filename, size = None):
-    type = None
     if filename == None:
         logger.warning("Empty filename requested")
         return None
-        
+    if not isinstance(filename, basestring):
+        return _load_surface_from_file(filename, size)
+    key = get_image_cache_key(filename, size)
+    surface = image_cache.get(key)
+    if surface is None:
+        surface = _load_surface_from_file(filename, size)
+        if surface is not None:
+            image_cache.put(key, surface)
+    return surface
+            
+def load_svg_as_surface(filename, size):
+    key = get_image_cache_key(filename, size, "svg")
+    surface = image_cache.get(key)
+    if surface is None:
+        surface = _load_svg_as_surface(filename, size)
+        image_cache.put(key, surface)
+    return surface
+
+def _load_surface_from_file(filename, size = None):
+    type = None
+
     if filename.startswith("http:") or filename.startswith("https:"):
         full_cache_path = get_image_cache_file(filename, size)
         if full_cache_path:
@@ -84,7 +141,7 @@ def load_surface_from_file(filename, size = None):
             type = meta_fileobj.readline()
             meta_fileobj.close()
             if type == "image/svg+xml" or filename.lower().endswith(".svg"):
-                return load_svg_as_surface(filename, size)
+                return _load_svg_as_surface(filename, size)
             else:
                 return pixbuf_to_surface(gtk.gdk.pixbuf_new_from_file(full_cache_path), size)
                 
@@ -147,7 +204,7 @@ def load_surface_from_file(filename, size = None):
                 if filename.lower().endswith(".svg"):
                     if os.path.islink(filename):
                         filename = os.path.realpath(filename)
-                    return load_svg_as_surface(filename, size)
+                    return _load_svg_as_surface(filename, size)
                 else:
                     return pixbuf_to_surface(gtk.gdk.pixbuf_new_from_file(filename), size)
             
@@ -155,7 +212,7 @@ def load_surface_from_file(filename, size = None):
                 logger.warning("Failed to get image %s (%s).", filename, type, exc_info = e)
                 return None
             
-def load_svg_as_surface(filename, size):
+def _load_svg_as_surface(filename, size):
     svg = rsvg.Handle(filename)
     try:
         svg_size = svg.get_dimension_data()[2:4]
@@ -0,0 +1,160 @@
+#  Gnome15 - Suite of tools for the Logitech G series keyboards and headsets
+#  Copyright (C) 2010 Brett Smith <tanktarta@blueyonder.co.uk>
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Sample histories
+A fixed size history of numeric samples, as used by plugins that draw graphs.
+Adding a sample is O(1) however long the history is, and the minimum, maximum
+and average are kept up to date as samples are added rather than calculated
+when painting.
+'''
+
+import array
+from collections import deque
+
+# Logging
+import logging
+logger = logging.getLogger(__name__)
+
+try:
+    import numpy
+except Exception as e:
+    logger.debug("NumPy not available, history values will be copied", exc_info = e)
+    numpy = None
+
+class History(object):
+    """
+    A ring buffer holding the last capacity samples. The history starts full
+    of the fill value, so graphs are always drawn at their full width.
+
+    Each sample is stored twice, half a buffer apart, so the samples in order
+    are always one contiguous slice of the buffer. When NumPy is available,
+    get_values() returns a view of that slice without copying it.
+    """
+
+    def __init__(self, capacity, fill = 0.0):
+        """
+        Keyword arguments:
+        capacity    -- number of samples to hold
+        fill        -- initial value of every sample
+        """
+        if capacity < 1:
+            raise ValueError("History capacity must be at least 1")
+        self.capacity = capacity
+        self._data = array.array("d", [ float(fill) ] * ( capacity * 2 ))
+        self._view = numpy.frombuffer(self._data, dtype = numpy.float64) if numpy is not None else None
+        self._pos = 0
+        self._count = capacity
+        self._sum = float(fill) * capacity
+        self._since_sum = 0
+
+        # Candidates for the minimum and maximum, as ( sample number, value ) in sample order
+        self._min = deque([ ( capacity - 1, float(fill) ) ])
+        self._max = deque([ ( capacity - 1, float(fill) ) ])
+
+    def append(self, value):
+        """
+        Add a sample, discarding the oldest.
+
+        Keyword arguments:
+        value       -- sample value
+        """
+        value = float(value)
+        capacity = self.capacity
+        pos = self._pos
+        old = self._data[pos]
+        self._data[pos] = value
+        self._data[pos + capacity] = value
+        self._pos = ( pos + 1 ) % capacity
+
+        # Running sum, recalculated once per cycle so rounding errors don't build up
+        self._since_sum += 1
+        if self._since_sum >= capacity:
+            self._since_sum = 0
+            self._sum = sum(self._data[0:capacity])
+        else:
+            self._sum += value - old
+
+        # Sliding window minimum and maximum. Older candidates that can never
+        # again be the minimum (or maximum) are dropped, as are expired ones
+        sample = self._count
+        self._count += 1
+        oldest = sample - capacity
+        candidates = self._min
+        while candidates and candidates[-1][1] >= value:
+            candidates.pop()
+        candidates.append(( sample, value ))
+        if candidates[0][0] <= oldest:
+            candidates.popleft()
+        candidates = self._max
+        while candidates and candidates[-1][1] <= value:
+            candidates.pop()
+        candidates.append(( sample, value ))
+        if candidates[0][0] <= oldest:
+            candidates.popleft()
+
+    def get_values(self, count = None):
+        """
+        Get the most recent samples, oldest first. This is a NumPy array
+        sharing the history's memory if NumPy is available (so only valid
+        until the next sample is added), or a copy in an array.array if not.
+        Both support len(), indexing, iteration and tolist().
+
+        Keyword arguments:
+        count       -- number of samples, or None for the whole history
+        """
+        if count is None or count > self.capacity:
+            count = self.capacity
+        end = self._pos + self.capacity
+        if self._view is not None:
+            return self._view[end - count:end]
+        return self._data[end - count:end]
+
+    def to_list(self, count = None):
+        """
+        Get the most recent samples as a list, oldest first.
+
+        Keyword arguments:
+        count       -- number of samples, or None for the whole history
+        """
+        return self.get_values(count).tolist()
+
+    def get_last(self):
+        """
+        Get the most recent sample
+        """
+        return self._data[self._pos + self.capacity - 1]
+
+    def get_min(self):
+        """
+        Get the smallest sample in the history
+        """
+        return self._min[0][1]
+
+    def get_max(self):
+        """
+        Get the largest sample in the history
+        """
+        return self._max[0][1]
+
+    def get_avg(self):
+        """
+        Get the average of the samples in the history
+        """
+        return self._sum / self.capacity
+
+    def __len__(self):
+        return self.capacity
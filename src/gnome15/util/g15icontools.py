@@ -21,12 +21,14 @@ Icon utilities
 
 from gnome15 import g15globals
 import g15cairo
+import g15cache
 import gtk.gdk
 import os
 import cairo
 from PIL import Image
 import urllib
 import base64
+import hashlib
 
 # Logging
 import logging
@@ -40,11 +42,30 @@ Look for icons locally as well if running from source
 gtk_icon_theme = gtk.icon_theme_get_default()
 if g15globals.dev:
     gtk_icon_theme.prepend_search_path(g15globals.icons_dir)
+    
+'''
+Icon lookups are cached until the icon theme changes
+'''
+ICON_PATH_CACHE_SIZE = 256
+icon_path_cache = g15cache.LRUCache(ICON_PATH_CACHE_SIZE)
+gtk_icon_theme.connect("changed", lambda theme: icon_path_cache.clear())
+_NOT_CACHED = object()
 
 def local_icon_or_default(icon_name, size = 128):
     return get_icon_path(icon_name, size)
 
 def get_embedded_image_url(path):
+    if isinstance(path, cairo.ImageSurface):
+        key = ( "url", hashlib.md5(path.get_data()).hexdigest(), path.get_width(), path.get_height(), path.get_format() )
+    else:
+        key = g15cairo.get_image_cache_key(path, None, "url")
+    url = g15cairo.image_cache.get(key)
+    if url is None:
+        url = _get_embedded_image_url(path)
+        g15cairo.image_cache.put(key, url)
+    return url
+
+def _get_embedded_image_url(path):
 
     file_str = StringIO()
     try:
@@ -59,7 +80,7 @@ def get_embedded_image_url(path):
             else:
                 if not "://" in path:
                     # File
-                    surface = load_surface_from_file(path)
+                    surface = g15cairo.load_surface_from_file(path)
                     file_str.write("image/png")
                     surface.write_to_png(img_data)
                 else:
@@ -81,6 +102,14 @@ def get_embedded_image_url(path):
         file_str.close()
 
 def get_icon_path(icon = None, size = 128, warning = True, include_missing = True):
+    key = ( tuple(icon) if isinstance(icon, list) else icon, size, include_missing )
+    path = icon_path_cache.get(key, _NOT_CACHED)
+    if path is _NOT_CACHED:
+        path = _get_icon_path(icon, size, warning, include_missing)
+        icon_path_cache.put(key, path)
+    return path
+
+def _get_icon_path(icon = None, size = 128, warning = True, include_missing = True):
     o_icon = icon
     if isinstance(icon, list):
         for i in icon:
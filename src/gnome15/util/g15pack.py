@@ -0,0 +1,319 @@
+#  Gnome15 - Suite of tools for the Logitech G series keyboards and headsets
+#  Copyright (C) 2010 Brett Smith <tanktarta@blueyonder.co.uk>
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Frame packing
+Converts cairo surfaces into the raw buffers the LCD drivers write to the
+devices. The heavy lifting is done by compiled code (PIL's converters and raw
+packers, NumPy if available) instead of per-pixel Python loops, which are
+kept only as a fallback.
+'''
+
+import cairo
+import array
+import g15cairo
+import g15convert
+from PIL import Image
+from cStringIO import StringIO
+
+# Logging
+import logging
+logger = logging.getLogger(__name__)
+
+try:
+    import numpy
+except Exception as e:
+    logger.debug("NumPy not available, colour frames will be converted by cairo", exc_info = e)
+    numpy = None
+
+if numpy is not None:
+    '''
+    Lookup tables giving each 8 bit channel value its position in a 5-6-5
+    pixel. These produce exactly the same values as g15convert.rgb_to_uint16()
+    '''
+    _RED_565 = numpy.array([ min(31, v * 32 / 255) << 11 for v in range(0, 256) ], dtype = "<u2")
+    _GREEN_565 = numpy.array([ min(63, v * 64 / 255) << 5 for v in range(0, 256) ], dtype = "<u2")
+    _BLUE_565 = numpy.array([ min(31, v * 32 / 255) for v in range(0, 256) ], dtype = "<u2")
+
+def _image_to_bytes(img, *args):
+    """
+    Get the raw bytes of a PIL image. Copes with both the old (tostring) and
+    new (tobytes) PIL API.
+    """
+    to_bytes = getattr(img, "tobytes", None)
+    if to_bytes is None:
+        to_bytes = img.tostring
+    return to_bytes(*args)
+
+class AbstractPacker(object):
+    """
+    Base of the packers. Provides access to the pixels of a surface as 32 bit
+    ARGB data.
+    """
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self._argb_surface = None
+
+    def _get_argb_data(self, surface):
+        if isinstance(surface, cairo.ImageSurface) and surface.get_format() == cairo.FORMAT_ARGB32 and \
+                surface.get_width() == self.width and surface.get_height() == self.height:
+            # Already in the right format, so use the buffer as is
+            return surface.get_data(), surface.get_stride()
+
+        if self._argb_surface is None:
+            self._argb_surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, self.width, self.height)
+        argb_context = cairo.Context(self._argb_surface)
+        argb_context.set_operator(cairo.OPERATOR_SOURCE)
+        argb_context.set_source_surface(surface)
+        argb_context.paint()
+        return self._argb_surface.get_data(), self._argb_surface.get_stride()
+
+class MonoPacker(AbstractPacker):
+    """
+    Packs ARGB surfaces into 1 bit per pixel frames suitable for the monochrome
+    LCDs (G15, G510, G13 etc). Colours are dithered to black and white, the
+    optional invert applied and the rows laid out at the stride of the target
+    buffer. One packer should be created per device and reused for every frame,
+    as it keeps the intermediate surface and output buffers around.
+    """
+
+    def __init__(self, width, height, line_length = None, buffer_size = None, lsb_first = True):
+        """
+        Keyword arguments:
+        width        -- width of the LCD in pixels
+        height       -- height of the LCD in pixels
+        line_length  -- number of bytes per row in the target buffer (defaults to width / 8)
+        buffer_size  -- total size of the target buffer (defaults to line_length * height)
+        lsb_first    -- if True, the left most pixel of each byte is the least significant bit
+        """
+        AbstractPacker.__init__(self, width, height)
+        self.row_bytes = ( width + 7 ) / 8
+        self.line_length = line_length if line_length is not None else self.row_bytes
+        self.buffer_size = buffer_size if buffer_size is not None else self.line_length * height
+        self.lsb_first = lsb_first
+        self.empty_buf = chr(0) * self.buffer_size
+        self._use_python = False
+
+    def pack(self, surface, invert = False):
+        """
+        Pack a surface into a string of buffer_size bytes. A bit is set for
+        every light pixel, or every dark pixel if invert is True.
+
+        Keyword arguments:
+        surface    -- cairo surface to pack
+        invert     -- invert the image
+        """
+        data, stride = self._get_argb_data(surface)
+
+        '''
+        PIL wraps the cairo data without copying it. The conversion to mode 1
+        dithers in C, and the raw packer then builds the bytes (in the required
+        bit order, inverted if need be) also in C.
+        '''
+        pil_img = Image.frombuffer("RGBA", (self.width, self.height), data, "raw", "RGBA", stride, 1)
+        pil_img = pil_img.convert("1")
+        if not self._use_python:
+            try:
+                return self._layout(self._pack_pil(pil_img, invert))
+            except ValueError as e:
+                logger.warning("PIL does not support packing 1 bit images, falling back to the slow packer", exc_info = e)
+                self._use_python = True
+        return self._pack_python(pil_img, invert)
+
+    """
+    Private
+    """
+    def _pack_pil(self, pil_img, invert):
+        if self.lsb_first:
+            raw_mode = "1;IR" if invert else "1;R"
+        else:
+            raw_mode = "1;I" if invert else "1"
+        return _image_to_bytes(pil_img, "raw", raw_mode)
+
+    def _layout(self, packed):
+        if self.line_length == self.row_bytes:
+            if len(packed) < self.buffer_size:
+                packed += self.empty_buf[len(packed):]
+            return packed
+
+        buf = array.array('B', self.empty_buf)
+        for row in range(0, self.height):
+            src = row * self.row_bytes
+            dst = row * self.line_length
+            buf[dst:dst + self.row_bytes] = array.array('B', packed[src:src + self.row_bytes])
+        return buf.tostring()
+
+    def _pack_python(self, pil_img, invert):
+        arrbuf = array.array('B', self.empty_buf)
+        data = list(pil_img.getdata())
+        width = self.width
+        for row in range(0, self.height):
+            v = 0
+            b = 1 if self.lsb_first else 128
+            i = row * self.line_length
+            for col in range(0, width):
+                if ( data[( row * width ) + col] != 0 ) != invert:
+                    v += b
+                b = b << 1 if self.lsb_first else b >> 1
+                if b == 256 or b == 0:
+                    arrbuf[i] = v
+                    i += 1
+                    v = 0
+                    b = 1 if self.lsb_first else 128
+            if width % 8 != 0:
+                arrbuf[i] = v
+        return arrbuf.tostring()
+
+class RGB565Packer(AbstractPacker):
+    """
+    Packs ARGB surfaces into 16 bit (5-6-5) little endian frames, as used by
+    the G19. Optionally transposes the image, for devices that scan the LCD
+    vertically. When NumPy is available, the whole frame is converted in a
+    few vectorised operations into a preallocated buffer. Otherwise cairo
+    does the conversion if it supports the 5-6-5 format, and as a last resort
+    each pixel is converted in Python.
+    """
+
+    def __init__(self, width, height, transpose = False):
+        """
+        Keyword arguments:
+        width        -- width of the LCD in pixels
+        height       -- height of the LCD in pixels
+        transpose    -- if True, the frame is written column by column
+        """
+        AbstractPacker.__init__(self, width, height)
+        self.transpose = transpose
+        self._back_surface = None
+        self._back_context = None
+        if numpy is not None:
+            self._rgb = numpy.empty((height, width), dtype = "<u2")
+            if transpose:
+                self._out = numpy.empty((width, height), dtype = "<u2")
+            else:
+                self._out = self._rgb
+
+    def pack(self, surface):
+        """
+        Pack a surface into a string of width * height * 2 bytes.
+
+        Keyword arguments:
+        surface    -- cairo surface to pack
+        """
+        if numpy is not None:
+            return self._pack_numpy(surface)
+        return self._pack_cairo(surface)
+
+    """
+    Private
+    """
+    def _pack_numpy(self, surface):
+        data, stride = self._get_argb_data(surface)
+        pixels = numpy.frombuffer(data, dtype = numpy.uint8).reshape(self.height, stride)
+        pixels = pixels[:, :self.width * 4].reshape(self.height, self.width, 4)
+
+        # Cairo stores ARGB32 as native endian words, so on little endian machines the bytes are B, G, R, A
+        rgb = self._rgb
+        numpy.take(_RED_565, pixels[:, :, 2], out = rgb, mode = "clip")
+        rgb |= _GREEN_565.take(pixels[:, :, 1], mode = "clip")
+        rgb |= _BLUE_565.take(pixels[:, :, 0], mode = "clip")
+        if self.transpose:
+            self._out[...] = rgb.T
+        return self._out.tostring()
+
+    def _pack_cairo(self, surface):
+        if self._back_surface is None:
+            width, height = ( self.height, self.width ) if self.transpose else ( self.width, self.height )
+            try:
+                self._back_surface = cairo.ImageSurface(4, width, height)
+            except Exception as e:
+                logger.debug("Could not create ImageSurface. Trying earlier API.", exc_info = e)
+                # Earlier version of Cairo
+                self._back_surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, width, height)
+            self._back_context = cairo.Context(self._back_surface)
+            if self.transpose:
+                g15cairo.rotate_around_center(self._back_context, self.width, self.height, 270)
+                g15cairo.flip_horizontal(self._back_context, self.width, self.height)
+            self._back_context.set_operator(cairo.OPERATOR_SOURCE)
+
+        self._back_context.set_source_surface(surface, 0, 0)
+        self._back_context.paint()
+
+        if self._back_surface.get_format() == cairo.FORMAT_ARGB32:
+            return self._pack_python(self._back_surface.get_data())
+        return str(self._back_surface.get_data())
+
+    def _pack_python(self, data):
+        """
+        If the creation of the type 4 image failed (i.e. earlier version of Cairo)
+        and NumPy is not available we have to convert it ourselves. This is slow.
+        """
+        file_str = StringIO()
+        for i in range(0, len(data), 4):
+            r = ord(data[i + 2])
+            g = ord(data[i + 1])
+            b = ord(data[i + 0])
+            file_str.write(g15convert.rgb_to_uint16(r, g, b))
+        return file_str.getvalue()
+
+if __name__ == "__main__":
+    '''
+    Benchmark the packers against the pure Python implementations
+    '''
+    import time
+    import random
+
+    frames = 200
+    surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, 160, 43)
+    ctx = cairo.Context(surface)
+    for i in range(0, 100):
+        ctx.set_source_rgb(random.random(), random.random(), random.random())
+        ctx.rectangle(random.randint(0, 160), random.randint(0, 43), random.randint(1, 40), random.randint(1, 20))
+        ctx.fill()
+
+    packer = MonoPacker(160, 43, 32, 32 * 43)
+    python_packer = MonoPacker(160, 43, 32, 32 * 43)
+    python_packer._use_python = True
+
+    if packer.pack(surface, True) != python_packer.pack(surface, True):
+        print "WARNING: Packers produced different output"
+
+    for name, p in [ ( "Python", python_packer ), ( "Compiled", packer ) ]:
+        start = time.time()
+        for i in range(0, frames):
+            p.pack(surface, i % 2 == 0)
+        taken = time.time() - start
+        print "%-10s %d frames in %0.3fs (%0.1f fps)" % ( name, frames, taken, frames / taken )
+
+    surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, 320, 240)
+    ctx = cairo.Context(surface)
+    for i in range(0, 100):
+        ctx.set_source_rgb(random.random(), random.random(), random.random())
+        ctx.rectangle(random.randint(0, 320), random.randint(0, 240), random.randint(1, 80), random.randint(1, 60))
+        ctx.fill()
+
+    packer = RGB565Packer(320, 240, True)
+    strategies = [ ( "Cairo", packer._pack_cairo ),
+                   ( "Python", lambda s: packer._pack_python(s.get_data()) ) ]
+    if numpy is not None:
+        strategies.append(( "NumPy", packer._pack_numpy ))
+    for name, pack in strategies:
+        start = time.time()
+        for i in range(0, frames / 10 if name == "Python" else frames):
+            pack(surface)
+        taken = time.time() - start
+        print "565 %-6s %d frames in %0.3fs (%0.1f fps)" % ( name, i + 1, taken, ( i + 1 ) / taken )
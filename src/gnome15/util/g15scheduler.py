@@ -24,6 +24,14 @@ logger = logging.getLogger(__name__)
 
 import jobqueue
 
+'''
+Job priorities. Jobs that affect what the user sees or feels (input, redraws,
+animation) should beat background refreshes queued on the same queue
+'''
+PRIORITY_HIGH = jobqueue.PRIORITY_HIGH
+PRIORITY_NORMAL = jobqueue.PRIORITY_NORMAL
+PRIORITY_LOW = jobqueue.PRIORITY_LOW
+
 '''
 Default scheduler
 '''
@@ -35,14 +43,26 @@ after a specified interval. The timer is done by the gobject
 event loop, which then executes the job on a different thread
 '''
 
-def clear_jobs(queue_name = None):
-    scheduler.clear_jobs(queue_name)
+def clear_jobs(queue_name = None, matching = None):
+    scheduler.clear_jobs(queue_name, matching)
+
+def get_queue_depth(queue_name):
+    return scheduler.get_queue_depth(queue_name)
+
+def configure_queue(queue_name, number_of_workers = 1, priority = PRIORITY_NORMAL):
+    scheduler.configure_queue(queue_name, number_of_workers, priority)
+
+def get_stats():
+    return scheduler.get_stats()
+
+def get_timer_count():
+    return scheduler.get_timer_count()
 
-def execute(queue_name, job_name, function, *args):
-    return scheduler.execute(queue_name, job_name, function, *args)
+def execute(queue_name, job_name, function, *args, **kwargs):
+    return scheduler.execute(queue_name, job_name, function, *args, **kwargs)
 
-def schedule(job_name, interval, function, *args):
-    return scheduler.schedule(job_name, interval, function, *args)
+def schedule(job_name, interval, function, *args, **kwargs):
+    return scheduler.schedule(job_name, interval, function, *args, **kwargs)
 
 def run_on_gobject(function, *args):
     if g15pythonlang.is_gobject_thread():
@@ -54,8 +74,8 @@ def run_on_gobject(function, *args):
 def stop_queue(queue_name):
     scheduler.stop_queue(queue_name)
 
-def queue(queue_name, job_name, interval, function, *args):
-    return scheduler.queue(queue_name, job_name, interval, function, *args)
+def queue(queue_name, job_name, interval, function, *args, **kwargs):
+    return scheduler.queue(queue_name, job_name, interval, function, *args, **kwargs)
 
 def stop_all_schedulers():
     scheduler.stop_all()
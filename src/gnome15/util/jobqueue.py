@@ -17,7 +17,8 @@
 import Queue
 import threading
 import traceback
-import sys
+import itertools
+import heapq
 import gobject
 import time
 from threading import RLock
@@ -26,10 +27,28 @@ from threading import local
 # Can be adjusted to speed up time to aid debugging.
 TIME_FACTOR=1
 
+# Job priorities. Jobs with a lower value are run first
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 50
+PRIORITY_LOW = 100
+
+# Capture the stack of the caller when a job is queued, so errors in jobs can
+# be traced back to where they came from. None means only when debug logging
+# is enabled, as capturing the stack is relatively expensive
+CAPTURE_STACKS = None
+
 # Logging
 import logging
 logger = logging.getLogger(__name__)
 
+def get_stack():
+    """
+    Get the stack of the caller (less the job system frames), or None if
+    stack capture is not enabled.
+    """
+    if CAPTURE_STACKS or ( CAPTURE_STACKS is None and logger.isEnabledFor(logging.DEBUG) ):
+        return traceback.extract_stack()[:-3]
+
 # Thread local to allow threads to detect what queue they are on
 queue_names = local()
 
@@ -49,9 +68,123 @@ def is_on_queue(queue_name):
         return True
     return False
 
+class TimerDispatcher():
+    """
+    Dispatches all timers from a single main loop source. Timers are kept in
+    a heap ordered by when they are due, and the main loop source is always
+    set for the earliest one. Cancelled or rescheduled timers are simply
+    marked as such and discarded when they reach the top of the heap, so 
+    both are cheap. When the source fires, every timer due within TOLERANCE
+    seconds is dispatched at the same time, so timers that are due at almost
+    the same time only wake the main loop once.
+    """
+    
+    TOLERANCE = 0.01
+    
+    def __init__(self):
+        self.heap = []
+        self.timers = set()
+        self.sequence = itertools.count()
+        self.source = None
+        self.source_due = None
+        self.stale = 0
+        self.lock = RLock()
+        
+    def add(self, timer):
+        self.lock.acquire()
+        try:
+            timer.generation += 1
+            if timer in self.timers:
+                # The timer's existing entry is now out of date
+                self.stale += 1
+            else:
+                self.timers.add(timer)
+            heapq.heappush(self.heap, ( timer.due, next(self.sequence), timer.generation, timer ))
+            self._compact()
+            self._arm()
+        finally:
+            self.lock.release()
+            
+    def remove(self, timer):
+        self.lock.acquire()
+        try:
+            if timer in self.timers:
+                self.timers.remove(timer)
+                self.stale += 1
+                self._compact()
+                if len(self.timers) == 0:
+                    self._disarm()
+        finally:
+            self.lock.release()
+            
+    def get_active_count(self):
+        """
+        Get the number of timers waiting to fire
+        """
+        return len(self.timers)
+    
+    def get_active_timers(self):
+        self.lock.acquire()
+        try:
+            return sorted(self.timers, key = lambda t: t.due)
+        finally:
+            self.lock.release()
+    
+    """
+    Private
+    """
+    def _arm(self):
+        # Set the main loop source for the earliest timer, if it isn't already
+        due = self.heap[0][0] if len(self.heap) > 0 else None
+        if due == self.source_due:
+            return
+        self._disarm()
+        if due is not None:
+            self.source_due = due
+            delay = max(0, int(( due - time.time() ) * 1000.0))
+            self.source = gobject.timeout_add(delay, self._dispatch)
+        
+    def _disarm(self):
+        if self.source is not None:
+            gobject.source_remove(self.source)
+            self.source = None
+            self.source_due = None
+            
+    def _compact(self):
+        # Rebuild the heap if it has become mostly cancelled or rescheduled entries
+        if self.stale > 64 and self.stale > len(self.timers):
+            self.heap = [ e for e in self.heap if e[3] in self.timers and e[2] == e[3].generation ]
+            heapq.heapify(self.heap)
+            self.stale = 0
+            
+    def _dispatch(self):
+        due = []
+        self.lock.acquire()
+        try:
+            self.source = None
+            self.source_due = None
+            limit = time.time() + self.TOLERANCE
+            while len(self.heap) > 0 and self.heap[0][0] <= limit:
+                __, __, generation, timer = heapq.heappop(self.heap)
+                if timer in self.timers and generation == timer.generation:
+                    self.timers.remove(timer)
+                    due.append(timer)
+                else:
+                    self.stale = max(0, self.stale - 1)
+            self._arm()
+        finally:
+            self.lock.release()
+            
+        for timer in due:
+            timer.exec_item()
+            
+        # Destroy the timeout, a new one is added for the next timer
+        return False
+        
 class GTimer:    
-    def __init__(self, scheduler, task_queue, task_name, interval, function, stack, *args):
+    def __init__(self, scheduler, task_queue, task_name, interval, function, stack, *args, **kwargs):
         self.function = function
+        self.priority = kwargs.get("priority", None)
         if function == None:
             logger.warning("Attempt to run empty job %s on %s", task_name, task_queue.name)
             traceback.print_stack()
@@ -60,42 +193,38 @@ class GTimer:
         self.scheduler = scheduler
         self.task_queue = task_queue
         self.task_name = task_name
-        self.source = gobject.timeout_add(int(float(interval) * 1000.0 * TIME_FACTOR), self.exec_item, function, *args)
+        self.args = args
+        self.generation = 0
+        self.complete = False
+        self.reschedule(interval)
+        
+    def reschedule(self, interval):
+        """
+        Change the timer to fire after a new interval (from now). This may
+        also be used to run a timer that has completed (or been cancelled) 
+        again.
+        
+        Keyword arguments:
+        interval        -- interval in seconds
+        """
+        self.due = time.time() + ( float(interval) * TIME_FACTOR )
         self.complete = False
-        self.scheduler.all_jobs.append(self)
+        self.scheduler.dispatcher.add(self)
         
-    def exec_item(self, function, *args):
+    def exec_item(self):
         try:
             logger.debug("Executing GTimer %s", str(self.task_name))
-            ji = self.task_queue.run(self.stack, function, *args)
+            ji = self.task_queue.run(self.stack, self.function, *self.args, priority = self.priority)
             logger.debug("Executed GTimer %s", str(self.task_name))
         finally:
-            self.scheduler.all_jobs_lock.acquire()
-            try:
-                if self in self.scheduler.all_jobs:
-                    self.scheduler.all_jobs.remove(self)
-                self.complete = True
-            finally:
-                self.scheduler.all_jobs_lock.release()
-                # Destroy the timeout, don't execute this function again.
-                return False
+            self.complete = True
         
     def is_complete(self):
         return self.complete
         
     def cancel(self, *args):
-        self.scheduler.all_jobs_lock.acquire()
-        try:
-            if self in self.scheduler.all_jobs:
-                self.scheduler.all_jobs.remove(self)
-            # Check if callback function was executed, if yes this means that the timeout
-            # was automatically destroyed since the callback function returns False.
-            # Avoid thousands of warnings from source_remove().
-            if not self.is_complete():
-                gobject.source_remove(self.source)
-            logger.debug("Cancelled GTimer %s", str(self.task_name))
-        finally:
-            self.scheduler.all_jobs_lock.release()
+        self.scheduler.dispatcher.remove(self)
+        logger.debug("Cancelled GTimer %s", str(self.task_name))
         
 '''
 Task scheduler. Tasks may be added to the queue to execute
@@ -107,115 +236,239 @@ class JobScheduler():
     
     def __init__(self):
         self.queues = {}
-        self.all_jobs = []
-        self.all_jobs_lock = RLock()
+        self.queue_configuration = {}
+        self.dispatcher = TimerDispatcher()
+        self.queues_lock = RLock()
+        
+    def get_timer_count(self):
+        """
+        Get the number of timers waiting to fire
+        """
+        return self.dispatcher.get_active_count()
         
     def print_all_jobs(self):
-        print "Scheduled"
+        print "Scheduled (%d active timers)" % self.get_timer_count()
         print "------"
-        for j in self.all_jobs:
-            print "    %s - %s" % ( j.task_name, str(j.function))
+        for j in self.dispatcher.get_active_timers():
+            print "    %s - %s (in %0.3fs)" % ( j.task_name, str(j.function), j.due - time.time())
         print
         print "Running"
         print "-------"
         for q in self.queues:
             self.queues[q].print_all_jobs()
         
-    def schedule(self, name, interval, function, *args):
-        return self.queue("default", name, interval, function, *args)
+    def schedule(self, name, interval, function, *args, **kwargs):
+        return self.queue("default", name, interval, function, *args, **kwargs)
+    
+    def configure_queue(self, queue_name, number_of_workers = 1, priority = PRIORITY_NORMAL):
+        """
+        Configure the number of worker threads and the default job priority
+        for a queue. If the queue already exists, it is resized to the new 
+        number of workers.
+        
+        Keyword arguments:
+        queue_name        -- queue name
+        number_of_workers -- number of jobs from the queue that may run at once
+        priority          -- priority of jobs that do not specify one
+        """
+        self.queues_lock.acquire()
+        try:
+            self.queue_configuration[queue_name] = ( number_of_workers, priority )
+            if queue_name in self.queues:
+                self.queues[queue_name].priority = priority
+                self.queues[queue_name].set_number_of_workers(number_of_workers)
+        finally:
+            self.queues_lock.release()
+            
+    def get_stats(self):
+        """
+        Get the statistics for all queues, as a dictionary of dictionaries
+        keyed by queue name.
+        """
+        self.queues_lock.acquire()
+        try:
+            stats = {}
+            for queue_name in self.queues:
+                stats[queue_name] = self.queues[queue_name].get_stats()
+            return stats
+        finally:
+            self.queues_lock.release()
     
     def stop_all(self):
         logger.info("Stopping all queues")
         for queue_name in self.queues:
             self.queues[queue_name].stop()
     
-    def clear_jobs(self, queue_name):
+    def clear_jobs(self, queue_name, matching = None):
         if queue_name in self.queues:
-            self.queues[queue_name].clear()
+            self.queues[queue_name].clear(matching)
             
-    def stop_queue(self, queue_name):
+    def get_queue_depth(self, queue_name):
         if queue_name in self.queues:
-            self.queues[queue_name].stop()
-            del self.queues[queue_name]
+            return self.queues[queue_name].work_queue.qsize()
+        return 0
+            
+    def stop_queue(self, queue_name):
+        self.queues_lock.acquire()
+        try:
+            if queue_name in self.queues:
+                self.queues[queue_name].stop()
+                del self.queues[queue_name]
+        finally:
+            self.queues_lock.release()
     
-    def execute(self, queue_name, name, function, *args):
+    def execute(self, queue_name, name, function, *args, **kwargs):
         logger.debug("Executing on queue %s", queue_name)
-        if not queue_name in self.queues:
-            self.queues[queue_name] = JobQueue(name=queue_name)   
-        self.queues[queue_name].run(self._get_stack(), function, *args)        
-        
-    def _get_stack(self):
-        try: 1/0
-        except:
-            tb = sys.exc_info()[2]
-            return traceback.extract_stack()[:-5]
+        self._get_queue(queue_name).run(get_stack(), function, *args, **kwargs)
     
-    def queue(self, queue_name, name, interval, function, *args):
+    def queue(self, queue_name, name, interval, function, *args, **kwargs):
         if not hasattr(function, "__call__"):
             raise Exception("Not a function")
         logger.debug("Queueing %s on %s for execution in %f", name, queue_name, interval)
-        if not queue_name in self.queues:
-            self.queues[queue_name] = JobQueue(name=queue_name)
+        job_queue = self._get_queue(queue_name)
         
         if interval == 0:
             # Optimisation, if this is un-timed, avoid putting on main loop
-            self.queues[queue_name].run(self._get_stack(), function, *args)
+            job_queue.run(get_stack(), function, *args, **kwargs)
         else:
-            timer = GTimer(self, self.queues[queue_name], name, interval, function, self._get_stack(), *args)
+            timer = GTimer(self, job_queue, name, interval, function, get_stack(), *args, **kwargs)
             logger.debug("Queued %s", name)
             return timer
+        
+    def _get_queue(self, queue_name):
+        self.queues_lock.acquire()
+        try:
+            if not queue_name in self.queues:
+                number_of_workers, priority = self.queue_configuration.get(queue_name, ( 1, PRIORITY_NORMAL ))
+                self.queues[queue_name] = JobQueue(number_of_workers, queue_name, priority)
+            return self.queues[queue_name]
+        finally:
+            self.queues_lock.release()
 
 
 class JobQueue():
+    """
+    A queue of jobs, run in priority order (then in the order they were
+    queued) by a pool of worker threads. Statistics are kept on how long
+    jobs wait to be run, how long they take and how many have been run. 
+    """
     
     class JobItem():
-        def __init__(self, stack, item, args = None):
+        def __init__(self, stack, item, args = None, priority = PRIORITY_NORMAL):
             self.args = args
             self.item = item
+            self.priority = priority
             self.queued = time.time()
             self.started = None
             self.finished = None
             self.stack = stack
         
-    def __init__(self,number_of_workers=1, name="JobQueue"):
+    def __init__(self,number_of_workers=1, name="JobQueue", priority=PRIORITY_NORMAL):
         logger.debug("Creating job queue %s with %d workers", name, number_of_workers)
-        self.work_queue = Queue.Queue()
-        self.queued_jobs = []
+        self.work_queue = Queue.PriorityQueue()
+        self.queued_jobs = set()
         self.name = name
+        self.priority = priority
         self.stopping = False
         self.all_jobs_lock = threading.Lock()
-        self.number_of_workers = number_of_workers
+        self.number_of_workers = 0
         self.threads = []
-        for __ in range(number_of_workers):
-            t = threading.Thread(target = self.worker)
-            t.name = name
-            t.setDaemon(True)
-            t.start()
-            self.threads.append(t)
+        self.sequence = itertools.count()
+        self.created = time.time()
+        self.jobs_queued = 0
+        self.jobs_run = 0
+        self.jobs_failed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.total_run = 0.0
+        self.max_run = 0.0
+        self.set_number_of_workers(number_of_workers)
+        
+    def set_number_of_workers(self, number_of_workers):
+        """
+        Change the number of worker threads. Threads are started or stopped
+        as required.
+        
+        Keyword arguments:
+        number_of_workers        -- number of workers
+        """
+        self.all_jobs_lock.acquire()
+        try:
+            for __ in range(self.number_of_workers, number_of_workers):
+                t = threading.Thread(target = self.worker)
+                t.name = self.name
+                t.setDaemon(True)
+                t.start()
+                self.threads.append(t)
+            for __ in range(number_of_workers, self.number_of_workers):
+                # Each worker exits when it takes one of these
+                self._put(self.JobItem("Stopping", None, priority = PRIORITY_LOW + 1))
+            self.number_of_workers = number_of_workers
+        finally:
+            self.all_jobs_lock.release()
             
     def print_all_jobs(self):
         print "Queue %s" % self.name
-        for s in self.queued_jobs:
-            print "     %s - %s" % (str(s.item), str(s.queued))
+        for s in sorted(self.queued_jobs, key = lambda j: j.queued):
+            print "     %s - %s (priority %d)" % (str(s.item), str(s.queued), s.priority)
+            
+    def get_stats(self):
+        """
+        Get a dictionary of statistics for this queue. Times are in seconds.
+        """
+        self.all_jobs_lock.acquire()
+        try:
+            uptime = max(0.001, time.time() - self.created)
+            jobs_run = max(1, self.jobs_run)
+            return { "workers" : self.number_of_workers,
+                     "depth" : self.work_queue.qsize(),
+                     "queued" : self.jobs_queued,
+                     "run" : self.jobs_run,
+                     "failed" : self.jobs_failed,
+                     "throughput" : self.jobs_run / uptime,
+                     "average_wait" : self.total_wait / jobs_run,
+                     "max_wait" : self.max_wait,
+                     "average_run" : self.total_run / jobs_run,
+                     "max_run" : self.max_run }
+        finally:
+            self.all_jobs_lock.release()
             
     def stop(self):
         logger.info("Stopping queue %s", self.name)
         self.stopping = True
         self.clear()
         for i in range(0, self.number_of_workers):
-            self.work_queue.put(self.JobItem("Stopping", self._dummy))
+            self._put(self.JobItem("Stopping", self._dummy, priority = PRIORITY_HIGH))
         logger.info("Stopped queue %s", self.name)
         
     def _dummy(self):
         pass
+    
+    def _put(self, job_item):
+        self.work_queue.put(( job_item.priority, next(self.sequence), job_item ))
             
-    def clear(self):
+    def clear(self, matching = None):
+        """
+        Remove jobs that are waiting to be run.
+        
+        Keyword arguments:
+        matching     -- function that is passed the function of each job, and
+                        returns True if the job should be removed (all jobs
+                        are removed if None)
+        """
         jobs = self.work_queue.qsize()
         if jobs > 0:
             logger.info("Clearing queue %s as it has %d jobs", self.name, jobs)
+            retained = []
             try :
                 while True:
-                    item = self.work_queue.get_nowait()
+                    entry = self.work_queue.get_nowait()
+                    item = entry[2]
+                    self.work_queue.task_done()
+                    if item.item is None or ( matching is not None and not matching(item.item) ):
+                        # Keep requests for workers to exit, and other jobs
+                        retained.append(item)
+                        continue
                     logger.debug("Removed func = %s, args = %s, queued = %s, " \
                                  "started = %s, finished = %s",
                                  str(item.item),
@@ -223,26 +476,40 @@ class JobQueue():
                                  str(item.queued),
                                  str(item.started),
                                  str(item.finished))
-                    if item in self.queued_jobs:
-                        self.queued_jobs.remove(item)
+                    self.queued_jobs.discard(item)
             except Queue.Empty as e:
                 logger.debug("The queue is already empty", exc_info = e)
                 pass
+            for item in retained:
+                self._put(item)
             logger.info("Cleared queue %s", self.name)
             
-    def run(self, stack, item, *args):
+    def run(self, stack, item, *args, **kwargs):
+        """
+        Queue a job. 
+        
+        Keyword arguments:
+        stack        -- stack of caller (or None)
+        item         -- function to run
+        args         -- arguments to pass to function
+        priority     -- priority of job, lower values run first (defaults to the queue's priority)
+        """
         if self.stopping:
             return
         if item == None:
             logger.warning("Attempt to run empty job.")
             traceback.print_stack()
             return
+        priority = kwargs.get("priority", None)
+        if priority is None:
+            priority = self.priority
         self.all_jobs_lock.acquire()
         try :
             logger.debug("Queued task on %s", self.name)
-            ji = self.JobItem(stack, item, args)
-            self.queued_jobs.append(ji)
-            self.work_queue.put(ji)
+            ji = self.JobItem(stack, item, args, priority)
+            self.queued_jobs.add(ji)
+            self.jobs_queued += 1
+            self._put(ji)
             jobs = self.work_queue.qsize()
             if jobs > 1:
                 logger.debug("Queue %s filling, now at %d jobs.", self.name, jobs)
@@ -254,26 +521,34 @@ class JobQueue():
     def worker(self):
         queue_names.queue_name = self.name
         while not self.stopping:
-            item = self.work_queue.get()
+            item = self.work_queue.get()[2]
+            if item.item is None:
+                # Number of workers reduced
+                self.work_queue.task_done()
+                break
             try:
-                if item != None:
-                    try:
-                        logger.debug("Running task on %s", self.name)
-                        item.started = time.time()
-                        if item.args and len(item.args) > 0:
-                            item.item(*item.args)
-                        else:
-                            item.item()
-                        item.finished = time.time()
-                        logger.debug("Ran task on %s", self.name)
-                    finally:
-                        if item in self.queued_jobs: 
-                            self.queued_jobs.remove(item)
+                try:
+                    logger.debug("Running task on %s", self.name)
+                    item.started = time.time()
+                    if item.args and len(item.args) > 0:
+                        item.item(*item.args)
+                    else:
+                        item.item()
+                    item.finished = time.time()
+                    logger.debug("Ran task on %s", self.name)
+                finally:
+                    self._job_done(item)
             except Exception as a:
+                self.all_jobs_lock.acquire()
+                try:
+                    self.jobs_failed += 1
+                finally:
+                    self.all_jobs_lock.release()
                 try:
                     logger.debug("Error on worker", exc_info = a)
-                    logger.debug("Caused by job")
-                    logger.debug("%s\n", item.stack)
+                    if item.stack is not None:
+                        logger.debug("Caused by job")
+                        logger.debug("%s\n", "".join(traceback.format_list(item.stack)))
                 except Exception as e:
                     logger.debug("Could not log error on worker", exc_info = e)
                     pass
@@ -284,4 +559,17 @@ class JobQueue():
                 logger.info("Exited queue %s", self.name)
             except Exception as e:
                 pass
- 
+            
+    def _job_done(self, item):
+        self.all_jobs_lock.acquire()
+        try:
+            self.queued_jobs.discard(item)
+            self.jobs_run += 1
+            wait = item.started - item.queued
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+            run = ( item.finished if item.finished is not None else time.time() ) - item.started
+            self.total_run += run
+            self.max_run = max(self.max_run, run)
+        finally:
+            self.all_jobs_lock.release()
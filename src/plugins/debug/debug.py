@@ -22,9 +22,11 @@ import gnome15.g15driver as g15driver
 import gnome15.g15globals as g15globals
 import gnome15.g15plugin as g15plugin
 import gnome15.g15theme as g15theme
+import gnome15.g15top as g15top
 import gnome15.util.g15scheduler as g15scheduler
+import gnome15.util.g15cairo as g15cairo
+import gnome15.util.g15icontools as g15icontools
 import pango
-import os
 import sys
 import traceback
 import gc
@@ -47,11 +49,6 @@ has_preferences=False
 single_instance=True
 unsupported_models = [ g15driver.MODEL_G110, g15driver.MODEL_G11, g15driver.MODEL_G930, g15driver.MODEL_G35 ]
 
-_proc_status = '/proc/%d/status' % os.getpid()
-
-_scale = {'kB': 1024.0, 'mB': 1024.0*1024.0,
-          'KB': 1024.0, 'MB': 1024.0*1024.0}
-
 DEBUG_NAME="/org/gnome15/Debug"
 DEBUG_IF_NAME="org.gnome15.Debug"
 EXCLUDED = [ 
@@ -302,6 +299,26 @@ class G15DBUSDebugService(dbus.service.Object):
             for filename, lineno, name, line in traceback.extract_stack(stack):
                 print '    File: "%s", line %d, in %s' % (filename, lineno, name)
         
+    @dbus.service.method(DEBUG_IF_NAME)
+    def RedrawStats(self):
+        for scr in self._service.screens:
+            print "Screen %s" % scr.device.uid
+            stats = scr.get_redraw_stats()
+            for k in sorted(stats):
+                print "    %-20s %s" % (k, stats[k])
+        
+    @dbus.service.method(DEBUG_IF_NAME)
+    def CacheStats(self):
+        caches = [ ( "Images", g15cairo.image_cache.get_stats() ),
+                   ( "Icon paths", g15icontools.icon_path_cache.get_stats() ) ]
+        text_stats = g15text.get_cache_stats()
+        caches.append(( "Text layouts", text_stats["layouts"] ))
+        caches.append(( "Text masks", text_stats["masks"] ))
+        for name, stats in caches:
+            print name
+            for k in sorted(stats):
+                print "    %-20s %s" % (k, stats[k])
+        
     @dbus.service.method(DEBUG_IF_NAME)
     def ShowGraph(self):
         objgraph.show_refs(self._service)
@@ -347,42 +364,31 @@ class G15DBUSDebugService(dbus.service.Object):
     def ReferentsCount(self, typename):
         referents_count(typename)
 
-def _VmB(VmKey):
+def _process_memory():
     '''Private.
     '''
-    global _proc_status, _scale
-    # get pseudo file  /proc/<pid>/status
     try:
-        t = open(_proc_status)
-        v = t.read()
-        t.close()
-    except:
-        return 0.0  # non-Linux?
-    # get VmKey line e.g. 'VmRSS:  9999  kB\n ...'
-    i = v.index(VmKey)
-    v = v[i:].split(None, 3)  # whitespace
-    if len(v) < 3:
-        return 0.0  # invalid format?
-    # convert Vm value to bytes
-    return float(v[1]) * _scale[v[2]]
+        return g15top.get_snapshot().process
+    except (IOError, OSError):
+        return g15top.ProcessMemory(0, 0, 0)  # non-Linux?
 
 
 def memory(since=0.0):
     '''Return memory usage in bytes.
     '''
-    return _VmB('VmSize:') - since
+    return float(_process_memory().size) - since
 
 
 def resident(since=0.0):
     '''Return resident memory usage in bytes.
     '''
-    return _VmB('VmRSS:') - since
+    return float(_process_memory().resident) - since
 
 
 def stacksize(since=0.0):
     '''Return stack size in bytes.
     '''
-    return _VmB('VmStk:') - since
+    return float(_process_memory().stack) - since
 
 def create(gconf_key, gconf_client, screen):
     return G15Debug(gconf_key, gconf_client, screen)
@@ -407,9 +413,10 @@ class G15Debug(g15plugin.G15RefreshingPlugin):
         g15plugin.G15RefreshingPlugin.deactivate(self)
         
     def refresh(self):
-        self.memory = memory()
-        self.resident = resident()
-        self.stack = stacksize()
+        process_memory = _process_memory()
+        self.memory = float(process_memory.size)
+        self.resident = float(process_memory.resident)
+        self.stack = float(process_memory.stack)
     
     def get_theme_properties(self): 
         properties = g15plugin.G15RefreshingPlugin.get_theme_properties(self)
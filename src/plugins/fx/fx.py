@@ -20,12 +20,18 @@ _ = g15locale.get_translation("fx", modfile = __file__).ugettext
 import gnome15.g15screen as g15screen 
 import gnome15.g15driver as g15driver
 import gnome15.util.g15uigconf as g15uigconf
+import gnome15.util.g15gconf as g15gconf
+import gnome15.util.g15scheduler as g15scheduler
+import fxanimation
 import gtk
 import os
 import time
-import cairo
 import random
 
+# Logging
+import logging
+logger = logging.getLogger(__name__)
+
 
 # Plugin details - All of these must be provided
 id="fx"
@@ -53,7 +59,12 @@ def show_preferences(parent, driver, gconf_client, gconf_key):
     dialog.run()
     dialog.hide()
     
-effects = [ "vertical-scroll", "horizontal-scroll", "fade", "zoom" ]
+effects = fxanimation.EFFECTS
+
+"""
+Frame rate used if the screen does not limit it
+"""
+DEFAULT_FPS = 25.0
 
 class G15Fx():
     
@@ -61,13 +72,24 @@ class G15Fx():
         self.screen = screen
         self.gconf_client = gconf_client
         self.gconf_key = gconf_key
+        self._animation = None
+        self._last_frame = None
+        self._timer = None
+        self._chained_painter = None
     
     def activate(self):
+        self._load_config()
         self.chained_transition =self.screen.set_transition(self.transition)
         self.notify_handler = self.gconf_client.notify_add(self.gconf_key, self.config_changed)
+        
+        # Key presses must be seen before pages get a chance to handle them
+        self.screen.key_handler.key_handlers.insert(0, self)
     
     def deactivate(self):
         self.gconf_client.notify_remove(self.notify_handler)
+        if self in self.screen.key_handler.key_handlers:
+            self.screen.key_handler.key_handlers.remove(self)
+        self._finish()
         self.screen.set_transition(self.chained_transition)
         
     def destroy(self):
@@ -77,131 +99,115 @@ class G15Fx():
     '''
         
     def config_changed(self, client, connection_id, entry, args):
+        self._load_config()
         self.screen.redraw()
-    
+        
+    def handle_key(self, keys, state, post):
+        # Any input skips to the end of the current animation
+        if not post and self._animation is not None:
+            self._finish()
+        return False
     
     def transition(self, old_surface, new_surface, old_page, new_page, direction="up"):
-        # Determine effect to use
-        effect = self.gconf_client.get_string(self.gconf_key + "/transition_effect")
-        if effect == "":
-            effect = "random"
-        if effect == "random":
-            effect = effects[int(random.random() * len(effects))]
-            
-        # Animation speed
-        speed_entry =  self.gconf_client.get(self.gconf_key + "/anim_speed")
-        speed = 5.0 if speed_entry == None else speed_entry.get_float()
+        """
+        Called with the screen's draw lock held, when a frame is drawn. If the
+        page has changed, an animation is started (replacing any that is
+        running, starting from whatever it last showed). The animation paints
+        the LCD itself, so this returns as soon as it has taken a copy of the
+        old page.
+        """
         
         # Don't transition for high priority screens
         if new_page == None or old_page == None or new_page.priority == g15screen.PRI_HIGH:
             return
         
-        width = self.screen.width
-        height = self.screen.height  
+        # Determine effect to use
+        effect = self._effect
+        if effect == "random":
+            effect = effects[int(random.random() * len(effects))]
         
-        # Create a working surface
-        img_surface = cairo.ImageSurface (cairo.FORMAT_ARGB32, self.screen.width, self.screen.height)
-        img_context = cairo.Context(img_surface)
-        if effect == "vertical-scroll":
-            # Vertical scroll
-            step = max( int(speed), 1 )      
-            if direction == "down":                
-                for i in range(0, self.screen.height, step):
-                    img_context.save()
-                    img_context.translate(0, -i)                
-                    img_context.set_source_surface(old_surface)
-                    img_context.paint()
-                    img_context.translate(0, self.screen.height)
-                    img_context.set_source_surface(new_surface)
-                    img_context.paint()
-                    img_context.restore()
-                    self.screen.driver.paint(img_surface)
-                    self.anim_delay(speed)
-            else:                
-                for i in range(0, self.screen.height, step):
-                    img_context.save() 
-                    img_context.translate(0, -(self.screen.height - i))                
-                    img_context.set_source_surface(new_surface)
-                    img_context.paint()
-                    img_context.translate(0, self.screen.height)
-                    img_context.set_source_surface(old_surface)
-                    img_context.paint()
-                    img_context.restore()
-                    self.screen.driver.paint(img_surface)
-                    self.anim_delay(speed)
-                
-        elif effect == "horizontal-scroll":    
-            # Horizontal scroll
-            step = max( ( width / height ) * speed, 1 )
-            if direction == "down":                
-                for i in range(0, self.screen.width, int(step)):
-                    img_context.save()
-                    img_context.translate(-i, 0)                
-                    img_context.set_source_surface(old_surface)
-                    img_context.paint()
-                    img_context.translate(self.screen.width, 0)
-                    img_context.set_source_surface(new_surface)
-                    img_context.paint()
-                    img_context.restore()
-                    self.screen.driver.paint(img_surface)
-                    self.anim_delay(speed)
-            else:                
-                for i in range(0, self.screen.width, int(step)):
-                    img_context.save() 
-                    img_context.translate(-(self.screen.width - i), 0)                
-                    img_context.set_source_surface(new_surface)
-                    img_context.paint()
-                    img_context.translate(self.screen.width, 0)
-                    img_context.set_source_surface(old_surface)
-                    img_context.paint()
-                    img_context.restore()
-                    self.screen.driver.paint(img_surface)
-                    self.anim_delay(speed)
-        elif effect == "fade":
-            step = max( int(speed), 1 )
-            for i in range(0, 256, step):                
-                img_context.set_source_surface(new_surface)
-                img_context.paint_with_alpha(float(i) / 256.0)                
-                img_context.set_source_surface(old_surface)
-                img_context.paint_with_alpha(1.0 - ( float(i) / 256.0 ) )
-                self.screen.driver.paint(img_surface)
-                self.anim_delay(speed)
-        elif effect == "zoom":
-            step = max( int(speed), 1 )
-            if direction == "down":               
-                for i in range(1, self.screen.width, step):
-                    img_context.save()                
-                    img_context.set_source_surface(old_surface)
-                    img_context.paint() 
-                    scale = i / float(self.screen.width)
-                    scaled_width = self.screen.width * scale
-                    scaled_height = self.screen.height * scale
-                    img_context.translate( ( self.screen.width - scaled_width) / 2, ( self.screen.height - scaled_height) / 2)  
-                    img_context.scale(scale, scale)            
-                    img_context.set_source_surface(new_surface)
-                    img_context.paint()               
-                    img_context.restore()             
-                    self.screen.driver.paint(img_surface)
-                    self.anim_delay(speed)
-            else:                
-                for i in range(self.screen.width, 0, step * -1):
-                    img_context.save()             
-                    img_context.set_source_surface(new_surface)
-                    img_context.paint()               
-                    scale = i / float(self.screen.width)
-                    scaled_width = self.screen.width * scale
-                    scaled_height = self.screen.height * scale
-                    img_context.translate( ( self.screen.width - scaled_width) / 2, ( self.screen.height - scaled_height) / 2)  
-                    img_context.scale(scale, scale)            
-                    img_context.set_source_surface(old_surface)
-                    img_context.paint()               
-                    img_context.restore()  
-                    self.screen.driver.paint(img_surface)
-                    self.anim_delay(speed)
+        duration = fxanimation.get_duration(effect, self.screen.width, self.screen.height, self._speed)
+        animating = self._animation is not None
+        from_surface = self._last_frame if animating and self._last_frame is not None else old_surface
+        self._animation = fxanimation.Animation(effect, direction, from_surface, duration, time.time())
+        self._last_frame = None
+        
+        # While animating, frames drawn by the screen only update the new page
+        if not animating:
+            self._chained_painter = self.screen.set_painter(self._paint)
+        self._schedule_frame(0)
                 
         if self.chained_transition != None:
             self.chained_transition(old_surface, new_surface, old_page, new_page, direction)
-
-    def anim_delay(self, speed):
-        if speed < 1.0:
-            time.sleep( ( 1.0 - speed ) / 50.0 )
\ No newline at end of file
+            
+    ''' Private
+    '''
+    
+    def _load_config(self):
+        self._effect = g15gconf.get_string_or_default(self.gconf_client, self.gconf_key + "/transition_effect", "random")
+        if self._effect == "" or not self._effect in effects:
+            self._effect = "random"
+        self._speed = g15gconf.get_float_or_default(self.gconf_client, self.gconf_key + "/anim_speed", 5.0)
+            
+    def _paint(self, surface):
+        pass
+            
+    def _get_frame_time(self):
+        max_fps = self.screen.redraw_scheduler.max_fps
+        return 1.0 / ( max_fps if max_fps > 0 else DEFAULT_FPS )
+            
+    def _schedule_frame(self, delay):
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = g15scheduler.queue("fxQueue", "FxFrame", delay, self._frame, self._animation)
+        
+    def _frame(self, animation):
+        """
+        Render and paint the frame for the current time. Frames are only
+        rendered when needed, so if painting is slow frames are skipped and
+        the animation still takes the same time.
+        """
+        started = time.time()
+        self.screen.draw_lock.acquire()
+        try:
+            if animation is not self._animation:
+                # Finished, or replaced by another animation
+                return
+            try:
+                position = animation.get_position(started)
+                if position >= 1.0:
+                    logger.debug("%s transition finished after %d frames", animation.effect, animation.frames)
+                    self._stop_animation()
+                    return
+                if self.screen.old_surface is not None and self.screen.driver is not None and self.screen.driver.is_connected():
+                    self._last_frame = animation.render(position, self.screen.old_surface)
+                    self.screen.driver.paint(self._last_frame)
+                self._schedule_frame(max(0, self._get_frame_time() - ( time.time() - started )))
+            except Exception as e:
+                # Don't leave the LCD frozen, give up and show the new page
+                logger.error("%s transition failed", animation.effect, exc_info = e)
+                self._stop_animation()
+        finally:
+            self.screen.draw_lock.release()
+            
+    def _finish(self):
+        """
+        Stop any animation and show the new page as it is now 
+        """
+        self.screen.draw_lock.acquire()
+        try:
+            self._stop_animation()
+        finally:
+            self.screen.draw_lock.release()
+            
+    def _stop_animation(self):
+        # Must be called with the draw lock held
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._animation is not None:
+            self._animation = None
+            self._last_frame = None
+            self.screen.set_painter(self._chained_painter)
+            self._chained_painter = None
+            self.screen.redraw(transitions = False)
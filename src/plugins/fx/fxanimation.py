@@ -0,0 +1,316 @@
+#  Gnome15 - Suite of tools for the Logitech G series keyboards and headsets
+#  Copyright (C) 2010 Brett Smith <tanktarta@blueyonder.co.uk>
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Frame generation for the transition effects of the fx plugin.
+
+A transition is described by an Animation, which takes a copy of the old page
+when it is created and then renders any frame on demand, given how far through
+the transition it is and the current surface of the new page. Nothing is
+rendered ahead, so frames may be produced at whatever rate the LCD can take
+and an animation may be abandoned or skipped to its end at any time.
+
+Scroll effects only shift whole rows (or columns) of pixels, so their frames
+are built by copying bytes rather than compositing with cairo. This is what
+keeps them cheap on the slow CPUs monochrome keyboards tend to be used with.
+
+This module has no dependencies on the rest of Gnome15, and may be run
+directly to benchmark the effects.
+'''
+
+import math
+import cairo
+
+"""
+Effects that may be chosen
+"""
+EFFECTS = [ "vertical-scroll", "horizontal-scroll", "fade", "zoom" ]
+
+"""
+Time each step of an effect takes. Effects have the same number of steps
+(for a given speed) as they always had, they are now just timed rather than
+taking as long as it takes to paint each step
+"""
+STEP_TIME = 1.0 / 50.0
+
+_BYTES_PER_PIXEL = 4
+
+def get_steps(effect, width, height, speed):
+    """
+    Get the number of steps an effect takes at a given speed.
+
+    Keyword arguments:
+    effect      -- effect name
+    width       -- width of LCD
+    height      -- height of LCD
+    speed       -- animation speed (larger is faster)
+    """
+    step = max(int(speed), 1)
+    if effect == "vertical-scroll":
+        return int(math.ceil(float(height) / step))
+    elif effect == "horizontal-scroll":
+        step = max(int(( width / height ) * speed), 1)
+        return int(math.ceil(float(width) / step))
+    elif effect == "fade":
+        return int(math.ceil(256.0 / step))
+    elif effect == "zoom":
+        return int(math.ceil(float(width) / step))
+    raise ValueError("Unknown effect %s" % effect)
+
+def get_duration(effect, width, height, speed):
+    """
+    Get how long (in seconds) an effect takes at a given speed. Speeds below
+    1.0 slow each step down.
+
+    Keyword arguments:
+    effect      -- effect name
+    width       -- width of LCD
+    height      -- height of LCD
+    speed       -- animation speed (larger is faster)
+    """
+    step_time = STEP_TIME
+    if speed < 1.0:
+        step_time += ( 1.0 - speed ) / 50.0
+    return get_steps(effect, width, height, speed) * step_time
+
+class Animation(object):
+    """
+    A single transition between two pages.
+    """
+
+    def __init__(self, effect, direction, old_surface, duration, start_time):
+        """
+        Keyword arguments:
+        effect      -- effect name
+        direction   -- "up" or "down"
+        old_surface -- ARGB32 image surface of the old page (copied, so may
+                       be reused as soon as this returns)
+        duration    -- length of the animation in seconds
+        start_time  -- time the animation starts
+        """
+        if not effect in EFFECTS:
+            raise ValueError("Unknown effect %s" % effect)
+        self.effect = effect
+        self.direction = direction
+        self.duration = duration
+        self.start_time = start_time
+        self.width = old_surface.get_width()
+        self.height = old_surface.get_height()
+        self.stride = old_surface.get_stride()
+        self.frames = 0
+
+        old_surface.flush()
+        self._old_data = bytearray(old_surface.get_data())
+        self._frame_data = bytearray(len(self._old_data))
+        self._frame = cairo.ImageSurface.create_for_data(self._frame_data, cairo.FORMAT_ARGB32,
+                                                         self.width, self.height, self.stride)
+        if effect in [ "fade", "zoom" ]:
+            self._old = cairo.ImageSurface.create_for_data(self._old_data, cairo.FORMAT_ARGB32,
+                                                           self.width, self.height, self.stride)
+            self._context = cairo.Context(self._frame)
+
+    def get_position(self, now):
+        """
+        Get how far through the animation a time is, from 0.0 to 1.0.
+
+        Keyword arguments:
+        now         -- time
+        """
+        if self.duration <= 0:
+            return 1.0
+        return min(1.0, max(0.0, ( now - self.start_time ) / self.duration))
+
+    def render(self, position, new_surface):
+        """
+        Render a frame, returning the surface it is rendered on. The same
+        surface is used for every frame.
+
+        Keyword arguments:
+        position    -- how far through the animation (0.0 to 1.0)
+        new_surface -- ARGB32 image surface of the new page, of the same size
+        """
+        self.frames += 1
+        if self.effect == "vertical-scroll":
+            self._shift_rows(position, new_surface)
+        elif self.effect == "horizontal-scroll":
+            self._shift_columns(position, new_surface)
+        elif self.effect == "fade":
+            self._fade(position, new_surface)
+        else:
+            self._zoom(position, new_surface)
+        return self._frame
+
+    """
+    Private
+    """
+    def _new_data(self, new_surface):
+        new_surface.flush()
+        return new_surface.get_data()
+
+    def _shift_rows(self, position, new_surface):
+        new_data = self._new_data(new_surface)
+        frame = self._frame_data
+        stride = self.stride
+        rows = int(position * self.height)
+        split = ( self.height - rows ) * stride if self.direction == "down" else rows * stride
+        end = self.height * stride
+        if self.direction == "down":
+            # Old page moves up, the new page follows it in from the bottom
+            frame[0:split] = self._old_data[end - split:end]
+            frame[split:end] = new_data[0:end - split]
+        else:
+            # Old page moves down, the new page follows it in from the top
+            frame[0:split] = new_data[end - split:end]
+            frame[split:end] = self._old_data[0:end - split]
+        self._frame.mark_dirty()
+
+    def _shift_columns(self, position, new_surface):
+        new_data = str(self._new_data(new_surface))
+        old_data = self._old_data
+        frame = self._frame_data
+        row_len = self.width * _BYTES_PER_PIXEL
+        columns = int(position * self.width) * _BYTES_PER_PIXEL
+        if self.direction == "down":
+            # Old page moves left, the new page follows it in from the right
+            first, first_start, second, second_start = old_data, columns, new_data, 0
+            split = row_len - columns
+        else:
+            # Old page moves right, the new page follows it in from the left
+            first, first_start, second, second_start = new_data, row_len - columns, old_data, 0
+            split = columns
+        for row in range(0, self.height * self.stride, self.stride):
+            frame[row:row + split] = first[row + first_start:row + first_start + split]
+            frame[row + split:row + row_len] = second[row + second_start:row + second_start + row_len - split]
+        self._frame.mark_dirty()
+
+    def _fade(self, position, new_surface):
+        ctx = self._context
+        ctx.set_operator(cairo.OPERATOR_SOURCE)
+        ctx.set_source_surface(self._old)
+        ctx.paint()
+        ctx.set_operator(cairo.OPERATOR_OVER)
+        ctx.set_source_surface(new_surface)
+        ctx.paint_with_alpha(position)
+        self._frame.flush()
+
+    def _zoom(self, position, new_surface):
+        # The new page grows from the centre (or the old page shrinks into it)
+        if self.direction == "down":
+            background, foreground, scale = self._old, new_surface, position
+        else:
+            background, foreground, scale = new_surface, self._old, 1.0 - position
+        ctx = self._context
+        ctx.save()
+        ctx.set_operator(cairo.OPERATOR_SOURCE)
+        ctx.set_source_surface(background)
+        ctx.paint()
+        ctx.set_operator(cairo.OPERATOR_OVER)
+        scale = max(scale, 1.0 / self.width)
+        ctx.translate(( self.width - self.width * scale ) / 2.0, ( self.height - self.height * scale ) / 2.0)
+        ctx.scale(scale, scale)
+        ctx.set_source_surface(foreground)
+        ctx.paint()
+        ctx.restore()
+        self._frame.flush()
+
+if __name__ == "__main__":
+    '''
+    Benchmark. For each effect and LCD size, measures how long the redraw
+    thread is blocked starting a transition, how long each frame takes to
+    render, and how long the old approach (rendering every step in a loop on
+    the redraw thread) blocked for, not counting the time taken to send each
+    frame to the LCD.
+
+    python fxanimation.py [speed]
+    '''
+    import sys
+    import time
+
+    speed = float(sys.argv[1]) if len(sys.argv) > 1 else 5.0
+
+    def make_page(width, height, colour):
+        surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, width, height)
+        ctx = cairo.Context(surface)
+        ctx.set_source_rgb(*colour)
+        ctx.paint()
+        ctx.set_source_rgb(1.0 - colour[0], 1.0 - colour[1], 1.0 - colour[2])
+        for i in range(0, width, 8):
+            ctx.rectangle(i, ( i * 3 ) % height, 4, height / 4)
+        ctx.fill()
+        return surface
+
+    def old_transition(effect, old_surface, new_surface, width, height):
+        # The per step compositing the plugin used to do, for comparison
+        img_surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, width, height)
+        ctx = cairo.Context(img_surface)
+        for i in range(0, get_steps(effect, width, height, speed)):
+            position = float(i) / get_steps(effect, width, height, speed)
+            ctx.save()
+            if effect == "vertical-scroll":
+                ctx.translate(0, -int(position * height))
+                ctx.set_source_surface(old_surface)
+                ctx.paint()
+                ctx.translate(0, height)
+                ctx.set_source_surface(new_surface)
+                ctx.paint()
+            elif effect == "horizontal-scroll":
+                ctx.translate(-int(position * width), 0)
+                ctx.set_source_surface(old_surface)
+                ctx.paint()
+                ctx.translate(width, 0)
+                ctx.set_source_surface(new_surface)
+                ctx.paint()
+            elif effect == "fade":
+                ctx.set_source_surface(new_surface)
+                ctx.paint_with_alpha(position)
+                ctx.set_source_surface(old_surface)
+                ctx.paint_with_alpha(1.0 - position)
+            else:
+                ctx.set_source_surface(old_surface)
+                ctx.paint()
+                scale = max(position, 1.0 / width)
+                ctx.translate(( width - width * scale ) / 2, ( height - height * scale ) / 2)
+                ctx.scale(scale, scale)
+                ctx.set_source_surface(new_surface)
+                ctx.paint()
+            ctx.restore()
+            img_surface.flush()
+
+    print "%-8s %-18s %6s %9s %12s %10s %12s" % ( "LCD", "Effect", "Steps", "Duration", "Start block", "Per frame", "Old blocked" )
+    for name, width, height in [ ( "G15", 160, 43 ), ( "G19", 320, 240 ) ]:
+        old_page = make_page(width, height, ( 0.0, 0.0, 0.0 ))
+        new_page = make_page(width, height, ( 1.0, 1.0, 1.0 ))
+        for effect in EFFECTS:
+            duration = get_duration(effect, width, height, speed)
+            runs = 20
+
+            start = time.time()
+            for i in range(0, runs):
+                animation = Animation(effect, "down", old_page, duration, 0.0)
+            start_block = ( time.time() - start ) / runs
+
+            frame_count = 200
+            start = time.time()
+            for i in range(0, frame_count):
+                animation.render(float(i) / frame_count, new_page)
+            per_frame = ( time.time() - start ) / frame_count
+
+            start = time.time()
+            old_transition(effect, old_page, new_page, width, height)
+            old_blocked = time.time() - start
+
+            print "%-8s %-18s %6d %8.2fs %10.3fms %8.3fms %10.1fms" % ( name, effect, get_steps(effect, width, height, speed), duration,
+                                                                      start_block * 1000.0, per_frame * 1000.0, old_blocked * 1000.0 )
@@ -15,20 +15,16 @@
 #  along with this program.  If not, see <http://www.gnu.org/licenses/>.
  
 from threading import Thread
-from PIL import Image
-from PIL import ImageMath
-from PIL import ImageOps
-import array
 import asyncore
 import cairo
+import errno
+import g15daemonframes
 import gnome15.g15driver as g15driver
 import gnome15.g15locale as g15locale
 import gnome15.g15screen as g15screen
 import gnome15.g15theme as g15theme
-import gnome15.util.g15convert as g15convert
 import gnome15.util.g15uigconf as g15uigconf
 import gnome15.util.g15gconf as g15gconf
-import gnome15.util.g15cairo as g15cairo
 import gobject
 import gtk
 import logging
@@ -128,10 +124,10 @@ class G15DaemonClient(asyncore.dispatcher):
     def __init__(self, conn, plugin):
         asyncore.dispatcher.__init__(self, sock=conn)
         self.out_buffer  = ""
-        self.img_buffer = None
+        self.reader = None
         self.buffer_type = None
-        self.buffer_len = 0
         self.surface = None
+        self.surface_data = None
         self.last_img_buffer = None
         self.enable_keys = False
         self.plugin = plugin
@@ -148,7 +144,7 @@ class G15DaemonClient(asyncore.dispatcher):
         self.backlight_acquire = None
         self.keyboard_backlight_acquire = None
         
-        self.out_buffer += "G15 daemon HELLO"
+        self.out_buffer += g15daemonframes.HELLO
         self.oob_buffer = ""
         
     def handle_close(self):
@@ -219,90 +215,66 @@ class G15DaemonClient(asyncore.dispatcher):
     def handle_read(self):
         if not self.handshake:
             buf_type = self.recv(4)
+            if len(buf_type) == 0:
+                return
             
             self.buffer_type = buf_type[0]
             self.handshake = True
-            self.img_buffer = ""
             
-            if self.buffer_type == "G":
-                self.buffer_len = 6880
-            elif self.buffer_type == "R":
-                self.buffer_len = 1048
 # TODO
-#            elif self.buffer_type == "W":
-#                self.buffer_len = 865
+#            "W" buffers are 865 bytes
+            if self.buffer_type in g15daemonframes.BUFFER_LENGTHS:
+                self.reader = g15daemonframes.FrameReader(g15daemonframes.BUFFER_LENGTHS[self.buffer_type])
             else:
                 logger.warning("WARNING: Unsupported buffer type. Closing")
                 self.handle_close()
                 return
-        else:        
-            recv = self.recv(self.buffer_len - len(self.img_buffer))
-            self.img_buffer += recv
-            if len(self.img_buffer) == self.buffer_len:
+        else:
+            try:
+                frame = self.reader.read(self.socket)
+            except EOFError:
+                self.handle_close()
+                return
+            except socket.error as e:
+                if e.args[0] in ( errno.EAGAIN, errno.EWOULDBLOCK ):
+                    return
+                if e.args[0] in asyncore._DISCONNECTED:
+                    self.handle_close()
+                    return
+                raise
+            if frame is not None:
                 if self.buffer_type == "G":
-                    self.img_buffer = self.convert_gbuf(self.img_buffer)
-                self.draw_buffer(self.img_buffer)
-                self.last_img_buffer = self.img_buffer
-                self.img_buffer = ""
-
-            elif len(self.img_buffer) > self.buffer_len:
-                logger.warning("Received bad frame (%d bytes), should be %d",
-                               len(self.img_buffer),
-                               self.buffer_len)
+                    img_buffer = g15daemonframes.pack_pixels(frame)
+                else:
+                    img_buffer = str(frame[:g15daemonframes.PACKED_LEN])
+                self.draw_buffer(img_buffer)
+                self.last_img_buffer = img_buffer
                 
     def draw_buffer(self, img_buffer):
-                
-        pil_img = Image.fromstring("1", (160,43), img_buffer)
-        mask_img = pil_img.copy()                           
-        mask_img = mask_img.convert("L")
-        pil_img = pil_img.convert("P")
-        if self.plugin.palette is not None:
-            pil_img.putpalette(self.plugin.palette)                              
-            pil_img = pil_img.convert("RGBA")                        
-            pil_img.putalpha(mask_img)                    
-
-        # TODO find a quicker way of converting
-        pixbuf = g15cairo.image_to_pixbuf(pil_img, "png")
-        self.surface = g15cairo.pixbuf_to_surface(pixbuf)
+        """
+        Create a mask surface from a frame of packed bits. The foreground 
+        colour is applied when painting
+        """
+        data = g15daemonframes.to_a1(img_buffer)
+        surface = cairo.ImageSurface.create_for_data(data, cairo.FORMAT_A1, 
+                                                     g15daemonframes.WIDTH, 
+                                                     g15daemonframes.HEIGHT, 
+                                                     g15daemonframes.STRIDE)
+        self.surface_data = data
+        self.surface = surface
         self.plugin.screen.redraw(self.page)
                 
     def dump_buf(self, buf):
-        i = 0
-        for y in range(43):
-            l = ""
-            for x in range(160):
-                if buf[ ( y * 160 ) + x ] == chr(0):
-                    l += " "
-                else:
-                    l += "*"
-            logger.info(l)
+        pixels = g15daemonframes.unpack_pixels(buf)
+        for y in range(g15daemonframes.HEIGHT):
+            row = pixels[y * g15daemonframes.WIDTH:( y + 1 ) * g15daemonframes.WIDTH]
+            logger.info(row.replace(chr(0), " ").replace(chr(1), "*"))
             
     def convert_gbuf(self, g_buffer):
-        r_buffer = array.array('c', chr(0)*1048)
-        new_buf = ""
-        for x in range(160):
-            for y in range(43):
-                pixel_offset = y * 160 + x
-                byte_offset = pixel_offset / 8
-                bit_offset = 7 - (pixel_offset % 8)    
-                val = ord(g_buffer[x + ( y * 160)])
-                if val:
-                    r_buffer[byte_offset] = chr(ord(r_buffer[byte_offset]) | 1 << bit_offset)
-                else:
-                    r_buffer[byte_offset] = chr(ord(r_buffer[byte_offset])  &  ~(1 << bit_offset))
-        return r_buffer.tostring()
+        return g15daemonframes.pack_pixels(g_buffer)
          
     def convert_rbuf(self, buffer):
-        new_buf = ""
-        for x in range(160):
-            for y in range(43):
-                pixel_offset = y * 143 + x
-                byte_offset = pixel_offset / 8
-                bit_offset = 7 - (pixel_offset % 8)                
-                ch = ord(buffer[byte_offset])
-                new_buf += chr( ( ch >> bit_offset ) & 0xfe )
-                
-        return new_buf
+        return g15daemonframes.unpack_pixels(buffer)
              
     def writable(self):
         return len(self.out_buffer) > 0
@@ -358,8 +330,15 @@ class G15DaemonClient(asyncore.dispatcher):
             else:
                 canvas.scale(float(size[0]) / 160, float(size[1]) / 43)
             #canvas.scale(2.0, 3.0)
-            canvas.set_source_surface(self.surface)
-            canvas.paint()
+            foreground = self.plugin.foreground
+            if foreground is None:
+                # No foreground colour, so white on black
+                canvas.set_source_rgb(0.0, 0.0, 0.0)
+                canvas.rectangle(0, 0, g15daemonframes.WIDTH, g15daemonframes.HEIGHT)
+                canvas.fill()
+                foreground = ( 255, 255, 255 )
+            canvas.set_source_rgb(foreground[0] / 255.0, foreground[1] / 255.0, foreground[2] / 255.0)
+            canvas.mask_surface(self.surface, 0.0, 0.0)
         
 class G15Async(Thread):
     def __init__(self):
@@ -369,7 +348,8 @@ class G15Async(Thread):
         
     def run(self):  
         try :      
-            asyncore.loop(timeout=0.05)
+            # poll() has no limit on the number of clients, unlike select()
+            asyncore.loop(timeout=0.05, use_poll=True)
         except Exception as e:
             logger.warning("Failed to connect to G15Daemon client", exc_info = e)
 
@@ -424,9 +404,10 @@ class G15DaemonServer():
             self.async = G15Async()
             self.async.start()
         else:
+            # The foreground colour is applied when painting, so just redraw
             for c in self.clients:
                 if c.last_img_buffer is not None:
-                    c.draw_buffer(c.last_img_buffer)
+                    self.screen.redraw(c.page)
             
     def _stop_all_clients(self):
         for c in self.clients:
@@ -436,20 +417,13 @@ class G15DaemonServer():
         self.take_over_macro_keys = g15gconf.get_bool_or_default(self.gconf_client, "%s/take_over_macro_keys" % self.gconf_key, True)
         
         if g15gconf.get_bool_or_default(self.gconf_client, "%s/use_custom_foreground" % self.gconf_key, False):
-            col = g15gconf.get_rgb_or_default(self.gconf_client, "%s/custom_foreground" % self.gconf_key, (255,255,255))
-            self.palette = [0 for n in range(768)]
-            self.palette[765] = col[0]
-            self.palette[766] = col[1]
-            self.palette[767] = col[2]
+            self.foreground = g15gconf.get_rgb_or_default(self.gconf_client, "%s/custom_foreground" % self.gconf_key, (255,255,255))
         else: 
             foreground_control = self.screen.driver.get_control("foreground")
             if foreground_control is None:
-                self.palette = None
+                self.foreground = None
             else:        
-                self.palette = [0 for n in range(768)]
-                self.palette[765] = foreground_control.value[0]
-                self.palette[766] = foreground_control.value[1]
-                self.palette[767] = foreground_control.value[2]
+                self.foreground = foreground_control.value
         
         backlight_control = self.screen.driver.get_control_for_hint(g15driver.HINT_DIMMABLE)
         self.default_backlight = backlight_control.value if backlight_control is not None else None 
@@ -480,12 +454,16 @@ class G15Daemon(asyncore.dispatcher):
         logger.info('Binding to port %d', port)
         self.bind(("127.0.0.1", port))
         logger.info('Bound to port %d', port)
-        self.listen(5)
+        self.listen(socket.SOMAXCONN)
         self.plugin = plugin
         self.port = port
  
     def handle_accept(self):
-        sock, addr = self.accept()
+        accepted = self.accept()
+        if accepted is None:
+            # Another client's connection attempt was abandoned
+            return
+        sock, addr = accepted
         logger.debug('Got client')
         client = G15DaemonClient(sock, self.plugin)
         
@@ -0,0 +1,289 @@
+#  Gnome15 - Suite of tools for the Logitech G series keyboards and headsets
+#  Copyright (C) 2010 Brett Smith <tanktarta@blueyonder.co.uk>
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Frame handling for the g15daemon compatibility server.
+
+g15daemon clients send 160x43 monochrome frames, either as one byte per pixel
+("G" buffers) or as packed bits, most significant bit first ("R" buffers).
+Frames are received into a preallocated buffer, and converted to packed bits
+and then to the bit order of a cairo A1 surface by table lookups (or NumPy),
+rather than a Python loop over each pixel.
+
+This module has no dependencies on the rest of Gnome15, so it may be run
+directly as a load test, simulating any number of clients sending frames to a
+server.
+'''
+
+import sys
+import array
+import string
+import socket
+import binascii
+
+# Logging
+import logging
+logger = logging.getLogger(__name__)
+
+try:
+    import numpy
+except Exception as e:
+    logger.debug("NumPy not available, frames will be converted using string tables", exc_info = e)
+    numpy = None
+
+WIDTH = 160
+HEIGHT = 43
+
+"""
+Bytes per row of packed pixels. This is also the stride cairo uses for an A1
+surface of this width, as it is a multiple of 4
+"""
+STRIDE = WIDTH / 8
+PACKED_LEN = STRIDE * HEIGHT
+
+"""
+Length of each type of frame sent by clients
+"""
+G_BUFFER_LEN = WIDTH * HEIGHT
+R_BUFFER_LEN = 1048
+BUFFER_LENGTHS = { "G" : G_BUFFER_LEN, "R" : R_BUFFER_LEN }
+
+HELLO = "G15 daemon HELLO"
+
+_BIT_CHARS = string.maketrans("".join(chr(i) for i in range(256)), "0" + "1" * 255)
+_PIXEL_BYTES = string.maketrans("01", "\x00\x01")
+_REVERSED_BITS = string.maketrans("".join(chr(i) for i in range(256)),
+                                  "".join(chr(int("{0:08b}".format(i)[::-1], 2)) for i in range(256)))
+
+def pack_pixels(g_buffer):
+    """
+    Pack a frame of one byte per pixel into bits, most significant bit first,
+    as used by "R" frames. Any non-zero byte is a lit pixel.
+
+    Keyword arguments:
+    g_buffer    -- string or bytearray of at least G_BUFFER_LEN bytes
+    """
+    if numpy is not None:
+        pixels = numpy.frombuffer(g_buffer, dtype = numpy.uint8, count = G_BUFFER_LEN)
+        return numpy.packbits(pixels != 0).tostring()
+    bits = str(g_buffer[:G_BUFFER_LEN]).translate(_BIT_CHARS)
+    return binascii.unhexlify("%0*x" % ( PACKED_LEN * 2, int(bits, 2) ))
+
+def unpack_pixels(packed):
+    """
+    Unpack a frame of packed bits into one byte (0 or 1) per pixel.
+
+    Keyword arguments:
+    packed      -- string of at least PACKED_LEN bytes
+    """
+    if numpy is not None:
+        return numpy.unpackbits(numpy.frombuffer(packed, dtype = numpy.uint8, count = PACKED_LEN)).tostring()
+    bits = bin(int(binascii.hexlify(packed[:PACKED_LEN]), 16) | ( 1 << ( PACKED_LEN * 8 ) ))[3:]
+    return bits.translate(_PIXEL_BYTES)
+
+def to_a1(packed):
+    """
+    Get the data for a cairo A1 surface (of stride STRIDE) from a frame of
+    packed bits. Cairo stores the first pixel in the least significant bit on
+    little endian machines, so the bits of each byte are reversed there.
+    The result is a writable array, as cairo.ImageSurface.create_for_data()
+    requires.
+
+    Keyword arguments:
+    packed      -- string of at least PACKED_LEN bytes
+    """
+    data = str(packed[:PACKED_LEN])
+    if sys.byteorder == "little":
+        data = data.translate(_REVERSED_BITS)
+    return array.array("B", data)
+
+class FrameReader(object):
+    """
+    Receives fixed size frames from a socket into a buffer that is allocated
+    once, rather than building each frame up by string concatenation.
+    """
+
+    def __init__(self, frame_len):
+        """
+        Keyword arguments:
+        frame_len   -- number of bytes in each frame
+        """
+        self.frame_len = frame_len
+        self.frames = 0
+        self._buffer = bytearray(frame_len)
+        self._view = memoryview(self._buffer)
+        self._received = 0
+
+    def read(self, sock):
+        """
+        Read whatever is available from the socket, up to the end of the
+        current frame. When the frame is complete it is returned (as a
+        bytearray that is reused for the next frame, so it must be converted
+        before reading again), otherwise None is returned. EOFError is raised
+        if the connection has been closed, and socket errors are passed on.
+
+        Keyword arguments:
+        sock        -- socket to read from
+        """
+        received = sock.recv_into(self._view[self._received:], self.frame_len - self._received)
+        if received == 0:
+            raise EOFError("Connection closed")
+        self._received += received
+        if self._received < self.frame_len:
+            return None
+        self._received = 0
+        self.frames += 1
+        return self._buffer
+
+if __name__ == "__main__":
+    '''
+    Load test. Simulates a number of clients, each sending "G" frames at a
+    fixed rate. With no port given, a local stand-in server (receiving and
+    converting frames just as the plugin does, on a single event loop) is
+    started on a free port.
+
+    python g15daemonframes.py [clients] [fps] [seconds] [port]
+    '''
+    import time
+    import errno
+    import asyncore
+    import threading
+
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    fps = float(sys.argv[2]) if len(sys.argv) > 2 else 25.0
+    seconds = float(sys.argv[3]) if len(sys.argv) > 3 else 5.0
+    port = int(sys.argv[4]) if len(sys.argv) > 4 else None
+
+    try:
+        import cairo
+    except ImportError:
+        cairo = None
+
+    # Check the conversions against a simple per pixel version
+    frame = "".join(chr(( x * 7 + y * 3 ) % 5 == 0) for y in range(HEIGHT) for x in range(WIDTH))
+    expected = bytearray(PACKED_LEN)
+    for i, c in enumerate(frame):
+        if c != "\x00":
+            expected[i / 8] |= 1 << ( 7 - i % 8 )
+    packed = pack_pixels(frame)
+    print "Pack matches per pixel : %s" % ( packed == str(expected) )
+    print "Unpack round trip      : %s" % ( unpack_pixels(packed) == frame )
+    start = time.time()
+    for i in range(0, 1000):
+        to_a1(pack_pixels(frame))
+    print "Conversion             : %0.1fus per frame (%s)" % ( ( time.time() - start ) * 1000.0, "NumPy" if numpy is not None else "string tables" )
+
+    stats = { "frames" : 0, "convert_time" : 0.0 }
+
+    class StandInClient(asyncore.dispatcher):
+        def __init__(self, sock, socket_map):
+            asyncore.dispatcher.__init__(self, sock = sock, map = socket_map)
+            self.out_buffer = HELLO
+            self.reader = None
+
+        def writable(self):
+            return len(self.out_buffer) > 0
+
+        def handle_write(self):
+            self.out_buffer = self.out_buffer[self.send(self.out_buffer):]
+
+        def handle_read(self):
+            if self.reader is None:
+                self.reader = FrameReader(BUFFER_LENGTHS[self.recv(4)[0]])
+                return
+            try:
+                frame = self.reader.read(self.socket)
+            except EOFError:
+                self.close()
+                return
+            except socket.error as e:
+                if e.args[0] in ( errno.EAGAIN, errno.EWOULDBLOCK ):
+                    return
+                self.close()
+                return
+            if frame is not None:
+                convert_start = time.time()
+                data = to_a1(pack_pixels(frame))
+                if cairo is not None:
+                    cairo.ImageSurface.create_for_data(data, cairo.FORMAT_A1, WIDTH, HEIGHT, STRIDE)
+                stats["convert_time"] += time.time() - convert_start
+                stats["frames"] += 1
+
+    class StandInServer(asyncore.dispatcher):
+        def __init__(self, socket_map):
+            asyncore.dispatcher.__init__(self, map = socket_map)
+            self.socket_map = socket_map
+            self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.set_reuse_addr()
+            self.bind(("127.0.0.1", 0))
+            self.listen(socket.SOMAXCONN)
+
+        def handle_accept(self):
+            accepted = self.accept()
+            if accepted is not None:
+                StandInClient(accepted[0], self.socket_map)
+
+    server_map = {}
+    if port is None:
+        server = StandInServer(server_map)
+        port = server.getsockname()[1]
+        server_thread = threading.Thread(target = asyncore.loop, kwargs = { "timeout" : 0.05, "use_poll" : True, "map" : server_map })
+        server_thread.setDaemon(True)
+        server_thread.start()
+
+    sent = [ 0 ] * clients
+    lateness = [ 0.0 ] * clients
+
+    def run_client(index):
+        sock = socket.create_connection(( "127.0.0.1", port ))
+        try:
+            hello = ""
+            while len(hello) < len(HELLO):
+                hello += sock.recv(len(HELLO) - len(hello))
+            sock.sendall("GBUF")
+            interval = 1.0 / fps
+            due = time.time()
+            end = due + seconds
+            while due < end:
+                now = time.time()
+                if now < due:
+                    time.sleep(due - now)
+                else:
+                    lateness[index] = max(lateness[index], now - due)
+                sock.sendall(frame)
+                sent[index] += 1
+                due += interval
+        finally:
+            # Give the server a moment to read the last frames before closing
+            time.sleep(0.2)
+            sock.close()
+
+    threads = [ threading.Thread(target = run_client, args = ( i, )) for i in range(0, clients) ]
+    start = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    taken = time.time() - start
+
+    total = sum(sent)
+    print "Clients                : %d at %0.1f fps for %0.1fs" % ( clients, fps, seconds )
+    print "Frames sent            : %d (%0.1f fps in total, worst send lateness %0.1fms)" % ( total, total / taken, max(lateness) * 1000.0 )
+    if server_map:
+        print "Frames received        : %d" % stats["frames"]
+        print "Server conversion time : %0.3fs (%0.1f%% of one CPU)" % ( stats["convert_time"], stats["convert_time"] * 100.0 / taken )
+        asyncore.close_all(server_map)
+        server_thread.join()
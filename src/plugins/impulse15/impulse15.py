@@ -26,6 +26,7 @@ import gtk
 import os
 import sys
 import datetime
+import impulseanalysis
 
 # Logging
 import logging
@@ -114,17 +115,17 @@ class G15ImpulsePainter(g15screen.Painter):
         self.mode = "default"
         self.plugin = plugin
         self.last_sound = datetime.datetime.now()
+        self.analyser = impulseanalysis.Analyser()
         
-    def do_lights(self, audio_sample_array = None):     
-        if not audio_sample_array:
-            audio_sample_array = self._get_sample()
+    def do_lights(self, analysis = None):     
+        if analysis is None:
+            analysis = self._analyse()
         
         if self.backlight_acquisition is not None:
-            self.backlight_acquisition.set_value(self._col_avg(audio_sample_array))
-        tot_avg = self._tot_avg(audio_sample_array)
+            self.backlight_acquisition.set_value(analysis.colour)
         if self.mkey_acquisition is not None:
-            self._set_mkey_lights(tot_avg)
-        return tot_avg
+            self._set_mkey_lights(analysis.level)
+        return analysis.level
     
     def is_idle(self):
         return datetime.datetime.now() > ( self.last_sound + datetime.timedelta(0, 5.0) )
@@ -132,53 +133,24 @@ class G15ImpulsePainter(g15screen.Painter):
     def paint(self, canvas):
         if not self.theme_module: 
             return
-        audio_sample_array = self._get_sample()
-        tot_avg = self.do_lights(audio_sample_array)
+        analysis = self._analyse()
+        tot_avg = self.do_lights(analysis)
         if tot_avg > 0:
             self.last_sound = datetime.datetime.now()
         
         canvas.save()
-        self.theme_module.on_draw( audio_sample_array, canvas, self.plugin )
+        self.theme_module.on_draw( analysis, canvas, self.plugin )
         canvas.restore()
         
     """
     Private
     """
     
-    def _get_sample(self):
+    def _analyse(self):
         fft = False
         if hasattr( self.theme_module, "fft" ) and self.theme_module.fft:
             fft = True
-
-        audio_sample_array = impulse.getSnapshot( fft )
-        if self.plugin.gain != 1:
-            arr = []
-            for a in audio_sample_array:
-                arr.append(a * self.plugin.gain)
-            audio_sample_array = arr
-        
-        return audio_sample_array
-    
-    def _col_avg(self, list):
-        cols = []
-        each = len(list) / 3
-        z = 0
-        for j in range(0, 3):
-            t = 0
-            for x in range(0, each):
-                t += min(255, list[z] * 340)
-                z += 1
-            cols.append(int(t / each))
-        return ( cols[0], cols[1], cols[2] )
-    
-    def _tot_avg(self, list):
-        sz = len(list)
-        z = 0
-        t = 0
-        for x in range(0, sz):
-            t += min(255, list[z] * 340)
-            z += 1
-        return t / sz
+        return self.analyser.process(impulse.getSnapshot( fft ), self.plugin.gain)
                   
     def _set_mkey_lights(self, val):
         if val > 200:
@@ -264,26 +236,6 @@ class G15Impulse():
     def destroy(self):
         pass
     
-    def paint(self, canvas):
-        if not self.theme_module: 
-            return
-
-        fft = False
-        if hasattr( self.theme_module, "fft" ) and self.theme_module.fft:
-            fft = True
-
-        audio_sample_array = impulse.getSnapshot( fft )
-        
-        if self.backlight_acquisition is not None:
-            self.backlight_acquisition.set_value(self._col_avg(audio_sample_array))
-        
-        if self.mkey_acquisition is not None:
-            self._set_mkey_lights(self._tot_avg(audio_sample_array))
-        
-        canvas.save()
-        self.theme_module.on_draw( audio_sample_array, canvas, self )
-        canvas.restore()
-    
     def redraw(self):        
         if self.screen.driver.get_bpp() == 0:
             self.painter.do_lights()
@@ -362,7 +314,8 @@ class G15Impulse():
         self.col1 = g15gconf.get_cairo_rgba_or_default(self.gconf_client, self.gconf_key + "/col1", ( 255, 0, 0, 255 ))
         self.col2 = g15gconf.get_cairo_rgba_or_default(self.gconf_client, self.gconf_key + "/col2", ( 0, 0, 255, 255 ))
             
-        self.peak_heights = [ 0 for i in range( self.bars ) ]
+        # Peaks fall as they did when themes counted in rows
+        self.painter.analyser.configure(self.bars, peak_decay = 0.1 / max(1, self.rows - 2))
 
         paint = self.gconf_client.get_string(self.gconf_key + "/paint")
         if paint != self.last_paint and self.screen.driver.get_bpp() != 0: 
@@ -0,0 +1,353 @@
+#  Gnome15 - Suite of tools for the Logitech G series keyboards and headsets
+#  Copyright (C) 2010 Brett Smith <tanktarta@blueyonder.co.uk>
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Audio analysis for the Impulse15 visualisations.
+
+Each snapshot from impulse is turned into bar heights, peak markers and
+backlight / M-Key levels in a single pass (using NumPy when it is available),
+so themes only have to draw the bars. add_bars() adds all of the bars of a
+frame to one cairo path, so they may be filled at once.
+
+This module has no dependencies on the rest of Gnome15, so it may be run
+directly to benchmark it with synthetic samples.
+'''
+
+from collections import namedtuple
+
+# Logging
+import logging
+logger = logging.getLogger(__name__)
+
+try:
+    import numpy
+except Exception as e:
+    logger.debug("NumPy not available, audio will be analysed in Python", exc_info = e)
+    numpy = None
+
+"""
+How far bars may fall in each frame, as a fraction of their previous height.
+Bars always rise immediately
+"""
+DEFAULT_SMOOTHING = 0.5
+
+"""
+How much faster peak markers fall in each frame they are not pushed up, as a
+fraction of the full height
+"""
+DEFAULT_PEAK_DECAY = 0.01
+
+"""
+Scale applied to samples when calculating the colour and level (0-255) used
+for the backlight and M-Key lights
+"""
+LEVEL_SCALE = 340
+
+"""
+The result of analysing one snapshot :-
+
+samples     -- the samples with gain applied
+bars        -- the height of each bar (0.0 is silent, 1.0 is roughly full scale)
+peaks       -- the height of the peak marker for each bar
+colour      -- ( red, green, blue ) levels (0-255) of the low, middle and high
+               thirds of the samples
+level       -- overall level (0-255) of the samples
+"""
+Analysis = namedtuple("Analysis", "samples bars peaks colour level")
+
+class Analyser(object):
+    """
+    Turns snapshots into Analysis results. Smoothing and peak hold carry
+    over from one snapshot to the next, so use one Analyser per visualisation.
+    """
+
+    def __init__(self, bars = 16, smoothing = DEFAULT_SMOOTHING, peak_decay = DEFAULT_PEAK_DECAY):
+        """
+        Keyword arguments:
+        bars        -- number of bars requested
+        smoothing   -- fraction of the previous height bars may fall to
+        peak_decay  -- acceleration of falling peak markers
+        """
+        self.configure(bars, smoothing, peak_decay)
+
+    def configure(self, bars, smoothing = DEFAULT_SMOOTHING, peak_decay = DEFAULT_PEAK_DECAY):
+        """
+        Change the settings, resetting the bars and peaks.
+
+        Keyword arguments:
+        bars        -- number of bars requested
+        smoothing   -- fraction of the previous height bars may fall to
+        peak_decay  -- acceleration of falling peak markers
+        """
+        self.bars = max(1, bars)
+        self.smoothing = smoothing
+        self.peak_decay = peak_decay
+        self._sample_count = None
+
+    def process(self, snapshot, gain = 1.0):
+        """
+        Analyse a snapshot, returning an Analysis.
+
+        The samples are grouped into bands of len(snapshot) / bars samples,
+        as the themes always have, so there may be one more bar than requested
+        (for the samples left over). Each bar is the loudest sample in its band.
+
+        Keyword arguments:
+        snapshot    -- sequence of samples
+        gain        -- multiplier applied to every sample
+        """
+        if len(snapshot) != self._sample_count:
+            self._plan(len(snapshot))
+        if len(snapshot) == 0:
+            return Analysis(snapshot, [], [], ( 0, 0, 0 ), 0)
+        if numpy is not None:
+            return self._process_numpy(snapshot, gain)
+        return self._process_python(snapshot, gain)
+
+    """
+    Private
+    """
+    def _plan(self, sample_count):
+        self._sample_count = sample_count
+        self._band = max(1, sample_count / self.bars)
+        self._starts = range(0, sample_count, self._band)
+        self._third = sample_count / 3
+        bar_count = len(self._starts)
+        if numpy is not None:
+            self._starts = numpy.array(self._starts, dtype = numpy.intp)
+            self._last_bars = numpy.zeros(bar_count)
+            self._peaks = numpy.zeros(bar_count)
+            self._peak_speed = numpy.zeros(bar_count)
+        else:
+            self._last_bars = [ 0.0 ] * bar_count
+            self._peaks = [ 0.0 ] * bar_count
+            self._peak_speed = [ 0.0 ] * bar_count
+
+    def _process_numpy(self, snapshot, gain):
+        samples = numpy.array(snapshot, dtype = numpy.float64)
+        if gain != 1:
+            samples *= gain
+
+        # Bands, smoothing and peaks
+        bars = numpy.maximum.reduceat(samples, self._starts)
+        if self.smoothing:
+            numpy.maximum(bars, self._last_bars * self.smoothing, out = bars)
+        self._last_bars = bars
+        rising = bars > self._peaks
+        self._peak_speed += self.peak_decay
+        self._peak_speed[rising] = 0.0
+        peaks = self._peaks - self._peak_speed
+        peaks[rising] = bars[rising]
+        numpy.maximum(peaks, 0.0, out = peaks)
+        self._peaks = peaks
+
+        # Levels for the lights
+        scaled = numpy.minimum(samples * LEVEL_SCALE, 255)
+        third = self._third
+        if third > 0:
+            sums = scaled[:third * 3].reshape(3, third).sum(axis = 1)
+            colour = tuple(int(s / third) for s in sums)
+        else:
+            colour = ( 0, 0, 0 )
+        level = float(scaled.sum()) / len(scaled)
+
+        return Analysis(samples, bars, peaks, colour, level)
+
+    def _process_python(self, snapshot, gain):
+        samples = [ s * gain for s in snapshot ] if gain != 1 else list(snapshot)
+        band = self._band
+        bars = [ max(samples[i:i + band]) for i in self._starts ]
+        if self.smoothing:
+            smoothing = self.smoothing
+            bars = [ max(b, l * smoothing) for b, l in zip(bars, self._last_bars) ]
+        self._last_bars = bars
+
+        peaks = self._peaks
+        speed = self._peak_speed
+        decay = self.peak_decay
+        for i, b in enumerate(bars):
+            if b > peaks[i]:
+                peaks[i] = b
+                speed[i] = 0.0
+            else:
+                speed[i] += decay
+                peaks[i] = max(0.0, peaks[i] - speed[i])
+
+        scaled = [ min(255, s * LEVEL_SCALE) for s in samples ]
+        third = self._third
+        if third > 0:
+            colour = tuple(int(sum(scaled[j * third:( j + 1 ) * third]) / third) for j in range(0, 3))
+        else:
+            colour = ( 0, 0, 0 )
+        level = float(sum(scaled)) / len(scaled)
+
+        return Analysis(samples, bars, list(peaks), colour, level)
+
+def to_list(values):
+    """
+    Get an array of values as a list, which is much quicker to iterate
+    over than a NumPy array.
+
+    Keyword arguments:
+    values      -- NumPy array or sequence
+    """
+    return values.tolist() if hasattr(values, "tolist") else list(values)
+
+def add_bars(canvas, tops, heights, bar_width, bar_spacing):
+    """
+    Add a rectangle for each bar to the current path of a cairo context, so
+    every bar may then be filled (or stroked) at once. Bars with no height
+    are skipped.
+
+    Keyword arguments:
+    canvas      -- cairo context
+    tops        -- y position of the top of each bar
+    heights     -- height of each bar
+    bar_width   -- width of each bar
+    bar_spacing -- gap between bars
+    """
+    rectangle = canvas.rectangle
+    step = bar_width + bar_spacing
+    x = 0
+    for top, height in zip(to_list(tops), to_list(heights)):
+        if height > 0:
+            rectangle(x, top, bar_width, height)
+        x += step
+
+if __name__ == "__main__":
+    '''
+    Benchmark with synthetic samples. The analysis is compared with the
+    per sample processing the plugin and default theme used to do, and if
+    cairo is available, drawing with one path per frame is compared with
+    drawing each row of each bar.
+
+    python impulseanalysis.py [frames] [samples] [bars]
+    '''
+    import sys
+    import math
+    import time
+    import random
+
+    frames = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    sample_count = int(sys.argv[2]) if len(sys.argv) > 2 else 256
+    bar_count = int(sys.argv[3]) if len(sys.argv) > 3 else 16
+    gain = 1.5
+    rows = 16
+
+    random.seed(15)
+    snapshots = []
+    for f in range(0, 50):
+        snapshots.append(tuple(max(0.0, 0.6 * math.exp(-i / 60.0) * ( 0.6 + 0.4 * math.sin(f * 0.3 + i * 0.1) ) + random.uniform(-0.05, 0.05)) \
+                               for i in range(0, sample_count)))
+
+    def old_process(snapshot, peak_heights, peak_acceleration):
+        # The processing done before, less the drawing
+        arr = []
+        for a in snapshot:
+            arr.append(a * gain)
+        cols = []
+        each = len(arr) / 3
+        z = 0
+        for j in range(0, 3):
+            t = 0
+            for x in range(0, each):
+                t += min(255, arr[z] * 340)
+                z += 1
+            cols.append(int(t / each))
+        t = 0
+        for x in range(0, len(arr)):
+            t += min(255, arr[x] * 340)
+        freq = len(arr) / bar_count
+        heights = []
+        for i in range(0, len(arr), freq):
+            r = int(arr[i] * ( rows - 2 ))
+            if r > peak_heights[i]:
+                peak_heights[i] = r
+                peak_acceleration[i] = 0.0
+            else:
+                peak_acceleration[i] += .1
+                peak_heights[i] -= peak_acceleration[i]
+            if peak_heights[i] < 0:
+                peak_heights[i] = 0
+            heights.append(r)
+        return heights
+
+    peak_heights = [ 0 ] * sample_count
+    peak_acceleration = [ 0.0 ] * sample_count
+    start = time.time()
+    for f in range(0, frames):
+        old_process(snapshots[f % len(snapshots)], peak_heights, peak_acceleration)
+    old_time = ( time.time() - start ) / frames
+
+    analyser = Analyser(bar_count, peak_decay = 0.1 / ( rows - 2 ))
+    start = time.time()
+    for f in range(0, frames):
+        analysis = analyser.process(snapshots[f % len(snapshots)], gain)
+        to_list(analysis.bars)
+    new_time = ( time.time() - start ) / frames
+
+    # The NumPy and Python versions should agree
+    results = []
+    for use_numpy in ( True, False ):
+        if use_numpy and numpy is None:
+            continue
+        saved, numpy = numpy, numpy if use_numpy else None
+        checker = Analyser(bar_count)
+        for snapshot in snapshots:
+            result = checker.process(snapshot, gain)
+        results.append(result)
+        numpy = saved
+    if len(results) == 2:
+        a, b = results
+        agree = all(abs(x - y) < 1e-9 for x, y in zip(to_list(a.bars) + to_list(a.peaks), to_list(b.bars) + to_list(b.peaks))) \
+            and a.colour == b.colour and abs(a.level - b.level) < 1e-6
+        print "NumPy and Python agree  : %s" % agree
+
+    print "Samples / bars          : %d / %d" % ( sample_count, len(to_list(analysis.bars)) )
+    print "Old processing          : %0.1fus per frame" % ( old_time * 1000000.0 )
+    print "Analysis (%s)%s: %0.1fus per frame" % ( "NumPy" if numpy is not None else "Python", " " * ( 7 if numpy is not None else 6 ), new_time * 1000000.0 )
+
+    try:
+        import cairo
+    except ImportError:
+        cairo = None
+    if cairo is not None:
+        width, height, bar_width, row_height = 320, 240, 16, 14
+        surface = cairo.ImageSurface(cairo.FORMAT_RGB24, width, height)
+        canvas = cairo.Context(surface)
+
+        start = time.time()
+        for f in range(0, frames):
+            arr = snapshots[f % len(snapshots)]
+            freq = len(arr) / bar_count
+            for i in range(0, len(arr), freq):
+                canvas.set_source_rgba(1, 0, 0, 1)
+                for row in range(0, int(min(1.0, arr[i] * gain) * ( rows - 2 ))):
+                    canvas.rectangle(( i / freq ) * bar_width, height - row * row_height, bar_width, -row_height)
+                canvas.fill()
+        old_draw = ( time.time() - start ) / frames
+
+        start = time.time()
+        for f in range(0, frames):
+            analysis = analyser.process(snapshots[f % len(snapshots)], gain)
+            bar_heights = [ min(1.0, b) * ( rows - 2 ) * row_height for b in to_list(analysis.bars) ]
+            canvas.set_source_rgba(1, 0, 0, 1)
+            add_bars(canvas, [ height - h for h in bar_heights ], bar_heights, bar_width, 0)
+            canvas.fill()
+        new_draw = ( time.time() - start ) / frames
+
+        print "Old analysis + drawing  : %0.1fus per frame" % ( ( old_time + old_draw ) * 1000000.0 )
+        print "New analysis + drawing  : %0.1fus per frame (%0.2f%% of a core at 30 fps)" % ( new_draw * 1000000.0, new_draw * 30 * 100.0 )
@@ -1,4 +1,5 @@
 import math
+import impulseanalysis
 
 fft = True
 
@@ -18,9 +19,7 @@ def load_theme( screenlet ):
 def on_after_set_attribute ( self, name, value, screenlet ):
 	setattr( self, name, value )
 
-def on_draw( audio_sample_array, cr, screenlet ):
-
-	l = len( audio_sample_array )
+def on_draw( analysis, cr, screenlet ):
 
 	width, height = ( screenlet.width, screenlet.height )
 
@@ -29,25 +28,23 @@ def on_draw( audio_sample_array, cr, screenlet ):
 
 	cr.set_line_width( screenlet.bar_width )
 
-	for i in range( 0, l, l / n_bars ):
-		bar_amp_norm = audio_sample_array[ i ]
-
+	# The innermost ring of every bar is one path, the rest of the rings another
+	inner = []
+	outer = []
+	for i, bar_amp_norm in enumerate( impulseanalysis.to_list( analysis.bars ) ):
 
 		bar_height = ( bar_amp_norm * ( screenlet.width / 2 ) + screenlet.bar_width ) * ( screenlet.bar_height / 10.0 )
 
-		cc = screenlet.col2
-		cr.set_source_rgba( cc[ 0 ],  cc[ 1 ],  cc[ 2 ],  cc[ 3 ] )
 		for j in range( 0, int( bar_height / 5 ), max(max(1, screenlet.spacing) / 5, 1) ):
-			cr.arc(
-				width / 2,
-				height / 2,
+			( outer if j else inner ).append( (
 				20 + j * screenlet.bar_width,
-				( math.pi*2 / n_bars ) * ( i / ( l / n_bars ) ),
-				( math.pi*2 / n_bars ) * ( i / ( l / n_bars ) + 1 ) - .05
-			)
-
-			cr.stroke( )
-			
-			if j == 0:		
-				cc = screenlet.col1	
-				cr.set_source_rgba( cc[ 0 ],  cc[ 1 ],  cc[ 2 ],  cc[ 3 ] )
+				( math.pi*2 / n_bars ) * i,
+				( math.pi*2 / n_bars ) * ( i + 1 ) - .05
+			) )
+
+	for arcs, cc in ( ( inner, screenlet.col2 ), ( outer, screenlet.col1 ) ):
+		for radius, angle1, angle2 in arcs:
+			cr.new_sub_path( )
+			cr.arc( width / 2, height / 2, radius, angle1, angle2 )
+		cr.set_source_rgba( cc[ 0 ],  cc[ 1 ],  cc[ 2 ],  cc[ 3 ] )
+		cr.stroke( )
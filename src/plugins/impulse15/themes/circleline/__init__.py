@@ -1,4 +1,5 @@
 import math
+import impulseanalysis
 
 fft=True
 
@@ -16,9 +17,7 @@ def load_theme( screenlet ):
 def on_after_set_attribute ( self, name, value, screenlet ):
 	setattr( self, name, value )
 
-def on_draw( audio_sample_array, cr, screenlet ):
-
-	l = len( audio_sample_array )
+def on_draw( analysis, cr, screenlet ):
 
 	width, height = ( screenlet.width, screenlet.height )
 
@@ -31,36 +30,16 @@ def on_draw( audio_sample_array, cr, screenlet ):
 
 	h = screenlet.bar_height
 
-	fx = 0
-	fy = 0
-
-	for i in range( 0, l, l / n_bars ):
-
-		bar_amp_norm = audio_sample_array[ i ]
+	for i, bar_amp_norm in enumerate( impulseanalysis.to_list( analysis.bars ) ):
 
 		bar_height = bar_amp_norm * 100
 
+		a = ( math.pi*2 / n_bars ) * i
 
-		a = ( math.pi*2 / n_bars ) * ( i / ( l / n_bars ) )
-
-		x = ( math.sin( a ) * ( h + bar_height ) + width / 2 ) 
-		y = ( math.cos( a ) * ( h + bar_height ) + height / 2 )
-
-		if not i:
-			fx = x
-			fy = y
-			cr.move_to( x, y )
-
-		cr.curve_to(
-			x, y,
-			x, y,
-			x, y
+		cr.line_to(
+			math.sin( a ) * ( h + bar_height ) + width / 2,
+			math.cos( a ) * ( h + bar_height ) + height / 2
 		)
 
-	cr.curve_to(
-		fx, fy,
-		fx, fy,
-		fx, fy
-	)
-
+	cr.close_path( )
 	cr.stroke( )
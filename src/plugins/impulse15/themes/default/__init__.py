@@ -1,12 +1,24 @@
-peak_heights = [ 0 for i in range( 256 ) ]
-peak_acceleration = [ 0.0 for i in range( 256 ) ]
+import impulseanalysis
+
 fft = True
 
+# Clip paths that split bars into rows, by size
+row_clip_paths = {}
+
 def load_theme ( screenlet):
 	pass
 
-def on_draw ( audio_sample_array, cr, screenlet ):
-	n_cols = screenlet.bars
+def get_row_clip_path ( cr, height, width, row_height, row_step ):
+	key = ( height, width, row_height, row_step )
+	if not key in row_clip_paths:
+		cr.new_path( )
+		for row in range( 0, height / row_step + 2 ):
+			cr.rectangle( 0, height - row * row_step - row_height, width, row_height )
+		row_clip_paths[ key ] = cr.copy_path( )
+		cr.new_path( )
+	return row_clip_paths[ key ]
+
+def on_draw ( analysis, cr, screenlet ):
 	col_width = screenlet.bar_width
 	col_spacing = screenlet.spacing
 	bar_color = screenlet.col1
@@ -14,54 +26,28 @@ def on_draw ( audio_sample_array, cr, screenlet ):
 	n_rows = screenlet.rows
 	row_spacing = screenlet.spacing
 	peak_color = screenlet.col2
-	freq = len( audio_sample_array ) / n_cols
-	actual_cols = ( len( audio_sample_array ) / freq ) + 1 
+	row_step = row_height + row_spacing
+	bars = impulseanalysis.to_list( analysis.bars )
+	peaks = impulseanalysis.to_list( analysis.peaks )
 	
-	total_width = ( actual_cols * ( col_width + col_spacing ) ) - col_spacing
-	
-#	print "Total width = %d, Cols = %d, width = %d, spacing = %d, freq = %f, len = %d, actual_cols = %d" % ( total_width, n_cols, col_width, col_spacing, freq, len(audio_sample_array), actual_cols  )
+	total_width = ( len( bars ) * ( col_width + col_spacing ) ) - col_spacing
 	
 	cr.save()
 	cr.translate( ( screenlet.width - total_width ) / 2, 0)
 
-	for i in range( 0, len( audio_sample_array ), freq ):
-
-		col = i / freq
-		rows = int( audio_sample_array[ i ] * ( n_rows - 2 ) )
-
-		cr.set_source_rgba( bar_color[ 0 ], bar_color[ 1 ], bar_color[ 2 ], bar_color[ 3 ] )
-
-		if rows > peak_heights[ i ]:
-			peak_heights[ i ] = rows
-			peak_acceleration[ i ] = 0.0
-		else:
-			peak_acceleration[ i ] += .1
-			peak_heights[ i ] -= peak_acceleration[ i ]
-
-		if peak_heights[ i ] < 0:
-			peak_heights[ i ] = 0
-
-		for row in range( 0, rows ):
-
-			cr.rectangle(
-				col * ( col_width + col_spacing ),
-				screenlet.height - row * ( row_height + row_spacing ),
-				col_width, -row_height
-			)
-
-		cr.fill( )
-
-		cr.set_source_rgba( peak_color[ 0 ], peak_color[ 1 ], peak_color[ 2 ], peak_color[ 3 ] )
-
-		cr.rectangle(
-			col * ( col_width + col_spacing ),
-			screenlet.height - peak_heights[ i ] * ( row_height + row_spacing ),
-			col_width, -row_height
-		)
-
-		cr.fill( )
+	# Each bar is a single rectangle, split into rows by clipping
+	heights = [ ( rows - 1 ) * row_step + row_height if rows > 0 else 0 for rows in [ int( b * ( n_rows - 2 ) ) for b in bars ] ]
+	cr.save()
+	if row_spacing > 0:
+		cr.append_path( get_row_clip_path( cr, screenlet.height, total_width, row_height, row_step ) )
+		cr.clip( )
+	cr.set_source_rgba( bar_color[ 0 ], bar_color[ 1 ], bar_color[ 2 ], bar_color[ 3 ] )
+	impulseanalysis.add_bars( cr, [ screenlet.height - h for h in heights ], heights, col_width, col_spacing )
+	cr.fill( )
+	cr.restore()
 
+	cr.set_source_rgba( peak_color[ 0 ], peak_color[ 1 ], peak_color[ 2 ], peak_color[ 3 ] )
+	impulseanalysis.add_bars( cr, [ screenlet.height - p * ( n_rows - 2 ) * row_step - row_height for p in peaks ], [ row_height ] * len( peaks ), col_width, col_spacing )
 	cr.fill( )
-	cr.stroke( )
 	cr.restore()
 
@@ -0,0 +1,361 @@
+#  Gnome15 - Suite of tools for the Logitech G series keyboards and headsets
+#  Copyright (C) 2010 Brett Smith <tanktarta@blueyonder.co.uk>
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Video recording of the LCD for the lcdshot plugin.
+
+Frames (the raw ARGB32 data of the LCD surface) are handed over by the screen
+as they are drawn, and sampled at the recording frame rate by a writer thread.
+Only the band of rows that changed since the last recorded frame is written,
+zlib compressed, so a mostly static display costs almost nothing on disk.
+Unchanged frames are not written at all, the timestamp of each record keeps
+the timing.
+
+Recordings are converted to animated PNG (APNG) once finished, with no
+external tools required.
+
+This module has no dependencies on the rest of Gnome15, and may be run
+directly to convert a recording, or with no arguments to test itself.
+'''
+
+import sys
+import zlib
+import time
+import struct
+import threading
+
+# Logging
+import logging
+logger = logging.getLogger(__name__)
+
+MAGIC = "G15LCDV1"
+
+"""
+Header of magic, width, height, stride and frame rate, then one record per
+changed frame of the timestamp (milliseconds since the start), first changed
+row, number of changed rows and length of the compressed rows that follow.
+A record with no rows marks the end of the recording
+"""
+_HEADER = struct.Struct("<8sHHHH")
+_RECORD = struct.Struct("<IHHI")
+
+"""
+zlib compression level used while recording. Fast, as it is done on the fly
+"""
+RECORD_COMPRESSION = 1
+
+_PNG_SIGNATURE = "\x89PNG\r\n\x1a\n"
+
+class Recorder(object):
+    """
+    Records frames to a file. offer() may be called from any thread (and is
+    intended to be called while the screen is locked for drawing), and only
+    stores a reference to the frame in a single slot. Memory use is bounded
+    to that slot plus the last frame written, however fast frames are drawn
+    or however slow the disk is.
+    """
+
+    def __init__(self, path, width, height, stride, fps):
+        """
+        Keyword arguments:
+        path        -- file to record to
+        width       -- width of frames in pixels
+        height      -- height of frames in pixels
+        stride      -- bytes per row of frame data
+        fps         -- frames per second to sample
+        """
+        self.path = path
+        self.width = width
+        self.height = height
+        self.stride = stride
+        self.fps = fps
+        self.frames_offered = 0
+        self.frames_written = 0
+        self.frames_unchanged = 0
+        self.bytes_written = 0
+        self._slot = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._file = None
+        self._start_time = None
+
+    def start(self):
+        """
+        Open the file and start the writer thread.
+        """
+        self._file = open(self.path, "wb")
+        self._write(_HEADER.pack(MAGIC, self.width, self.height, self.stride, self.fps))
+        self._start_time = time.time()
+        self._thread = threading.Thread(target = self._run, name = "LCDRecorder")
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def offer(self, data):
+        """
+        Offer a frame. The data must not be modified afterwards, so pass a
+        copy of the surface data (e.g. str(surface.get_data())). Frames of
+        the wrong size are ignored.
+
+        Keyword arguments:
+        data        -- frame data
+        """
+        if len(data) == self.stride * self.height:
+            self.frames_offered += 1
+            # A single assignment, so no lock is needed
+            self._slot = data
+
+    def stop(self):
+        """
+        Record the last frame offered, then stop the writer thread and close
+        the file.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    """
+    Private
+    """
+    def _write(self, data):
+        self._file.write(data)
+        self.bytes_written += len(data)
+
+    def _run(self):
+        interval = 1.0 / self.fps
+        due = self._start_time
+        last = None
+        try:
+            while True:
+                stopping = self._stop.wait(max(0, due - time.time())) if not self._stop.is_set() else True
+                # Stopping wakes the thread early, so never stamp a frame later than now
+                timestamp = int(( min(due, time.time()) - self._start_time ) * 1000)
+                data = self._slot
+                if data is not None and data is not last:
+                    self._record(timestamp, data, last)
+                    last = data
+                if stopping or self._stop.is_set():
+                    break
+
+                # If behind (e.g. a slow disk) skip frames rather than queue them
+                due += interval
+                now = time.time()
+                if due < now:
+                    due = now
+            self._write(_RECORD.pack(int(( time.time() - self._start_time ) * 1000), 0, 0, 0))
+        except Exception as e:
+            logger.error("Failed to record LCD to %s", self.path, exc_info = e)
+        finally:
+            self._file.close()
+
+    def _record(self, timestamp, data, last):
+        stride = self.stride
+        first = 0
+        end = self.height
+        if last is not None:
+            # Find the band of rows that has changed
+            while first < end and data[first * stride:( first + 1 ) * stride] == last[first * stride:( first + 1 ) * stride]:
+                first += 1
+            if first == end:
+                self.frames_unchanged += 1
+                return
+            while data[( end - 1 ) * stride:end * stride] == last[( end - 1 ) * stride:end * stride]:
+                end -= 1
+        rows = zlib.compress(data[first * stride:end * stride], RECORD_COMPRESSION)
+        self._write(_RECORD.pack(timestamp, first, end - first, len(rows)))
+        self._write(rows)
+        self.frames_written += 1
+
+def read_recording(path):
+    """
+    Read a recording. Returns a tuple of the width, height, stride, frame
+    rate, and a generator of the frames. Each frame is a tuple of the
+    timestamp in milliseconds, the first changed row, the number of changed
+    rows and the complete frame data. The last frame has no changed rows, and
+    only marks the time the recording ended.
+
+    Keyword arguments:
+    path        -- recording file
+    """
+    f = open(path, "rb")
+    header = f.read(_HEADER.size)
+    if len(header) < _HEADER.size or header[:len(MAGIC)] != MAGIC:
+        f.close()
+        raise IOError("%s is not an LCD recording" % path)
+    magic, width, height, stride, fps = _HEADER.unpack(header)
+
+    def frames():
+        try:
+            frame = bytearray(stride * height)
+            while True:
+                record = f.read(_RECORD.size)
+                if len(record) < _RECORD.size:
+                    # Recording was not finished cleanly
+                    return
+                timestamp, first, rows, length = _RECORD.unpack(record)
+                if rows > 0:
+                    frame[first * stride:( first + rows ) * stride] = zlib.decompress(f.read(length))
+                yield timestamp, first, rows, frame
+                if rows == 0:
+                    return
+        finally:
+            f.close()
+
+    return width, height, stride, fps, frames()
+
+def write_apng(recording_path, png_path):
+    """
+    Convert a recording to an animated PNG. Each frame after the first only
+    contains the rows that changed.
+
+    Keyword arguments:
+    recording_path    -- recording file
+    png_path          -- PNG file to write
+    """
+    # Count the frames first, so only one frame is ever held in memory
+    width, height, stride, fps, frames = read_recording(recording_path)
+    count = sum(1 for frame in frames if frame[2] > 0)
+    if count == 0:
+        raise IOError("%s contains no frames" % recording_path)
+
+    width, height, stride, fps, frames = read_recording(recording_path)
+    out = open(png_path, "wb")
+    try:
+        out.write(_PNG_SIGNATURE)
+        _write_chunk(out, "IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+        _write_chunk(out, "acTL", struct.pack(">II", count, 0))
+        sequence = 0
+        previous = None
+        for frame in frames:
+            if previous is not None:
+                sequence = _write_apng_frame(out, sequence, previous, frame[0], width, stride)
+            previous = ( frame[0], frame[1], frame[2], _to_rgb_rows(frame[3], width, stride, frame[1], frame[2]) ) if frame[2] > 0 else None
+        if previous is not None:
+            # Not finished cleanly, show the last frame for one frame interval
+            _write_apng_frame(out, sequence, previous, previous[0] + 1000 / fps, width, stride)
+        _write_chunk(out, "IEND", "")
+    finally:
+        out.close()
+
+"""
+Private
+"""
+def _write_apng_frame(out, sequence, frame, end_time, width, stride):
+    timestamp, first, rows, data = frame
+    delay = max(1, end_time - timestamp)
+    delay_den = 1000
+    while delay > 65535:
+        delay /= 10
+        delay_den /= 10
+    _write_chunk(out, "fcTL", struct.pack(">IIIIIHHBB", sequence, width, rows, 0, first, delay, delay_den, 0, 0))
+    sequence += 1
+    compressed = zlib.compress(data, 6)
+    if sequence == 1:
+        # The first frame is also the default image
+        _write_chunk(out, "IDAT", compressed)
+    else:
+        _write_chunk(out, "fdAT", struct.pack(">I", sequence) + compressed)
+        sequence += 1
+    return sequence
+
+def _write_chunk(out, chunk_type, data):
+    out.write(struct.pack(">I", len(data)))
+    out.write(chunk_type)
+    out.write(data)
+    out.write(struct.pack(">I", zlib.crc32(chunk_type + data) & 0xffffffff))
+
+def _to_rgb_rows(data, width, stride, first, rows):
+    # Cairo ARGB32 is native endian, so B, G, R, A on little endian machines. Alpha is dropped
+    block = data[first * stride:( first + rows ) * stride]
+    if stride != width * 4:
+        block = bytearray().join(block[y * stride:y * stride + width * 4] for y in range(0, rows))
+    rgb = bytearray(width * rows * 3)
+    r, g, b = ( 2, 1, 0 ) if sys.byteorder == "little" else ( 1, 2, 3 )
+    rgb[0::3] = block[r::4]
+    rgb[1::3] = block[g::4]
+    rgb[2::3] = block[b::4]
+
+    # Each row starts with the filter type (none)
+    row_len = width * 3
+    return "".join("\x00" + str(rgb[y * row_len:( y + 1 ) * row_len]) for y in range(0, rows))
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3:
+        write_apng(sys.argv[1], sys.argv[2])
+        sys.exit(0)
+
+    '''
+    Record some synthetic frames, mostly unchanged or with a small moving
+    block, and check they convert and read back correctly
+    '''
+    import os
+    import shutil
+    import tempfile
+
+    width, height = 320, 240
+    stride = width * 4
+    background = "\x20\x40\x60\xff" * ( width * height )
+
+    def make_frame(i):
+        frame = bytearray(background)
+        y = ( i * 3 ) % ( height - 10 )
+        for row in range(y, y + 10):
+            frame[row * stride + 40:row * stride + 80] = "\xff\xff\xff\xff" * 10
+        return str(frame)
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        recording = os.path.join(temp_dir, "test.g15rec")
+        recorder = Recorder(recording, width, height, stride, 50)
+        recorder.start()
+        offered = []
+        start = time.time()
+        for i in range(0, 100):
+            # Draw at roughly 100fps, the block only moves every fifth frame
+            frame = make_frame(i / 5)
+            offered.append(frame)
+            recorder.offer(frame)
+            time.sleep(0.01)
+        recorder.stop()
+        taken = time.time() - start
+
+        w, h, s, fps, frames = read_recording(recording)
+        frames = [ ( f[0], f[2], str(f[3]) ) for f in frames ]
+        raw_size = len(background) * len(frames)
+        print "Offered %d frames in %0.2fs, wrote %d, %d unchanged" % ( recorder.frames_offered, taken, recorder.frames_written, recorder.frames_unchanged )
+        print "Recording size         : %d bytes (%d uncompressed)" % ( os.path.getsize(recording), raw_size )
+        print "Frames read back match : %s" % all(f[2] in offered for f in frames)
+        print "Last frame recorded    : %s" % ( frames[-1][2] == offered[-1] )
+        print "Timestamps increase    : %s" % all(frames[i][0] <= frames[i + 1][0] for i in range(len(frames) - 1))
+
+        png = os.path.join(temp_dir, "test.png")
+        start = time.time()
+        write_apng(recording, png)
+        print "APNG written           : %d bytes in %0.3fs" % ( os.path.getsize(png), time.time() - start )
+        data = open(png, "rb").read()
+        offset = len(_PNG_SIGNATURE)
+        chunks = {}
+        valid = data.startswith(_PNG_SIGNATURE)
+        while offset < len(data):
+            length, = struct.unpack(">I", data[offset:offset + 4])
+            chunk_type = data[offset + 4:offset + 8]
+            crc, = struct.unpack(">I", data[offset + 8 + length:offset + 12 + length])
+            valid = valid and crc == zlib.crc32(data[offset + 4:offset + 8 + length]) & 0xffffffff
+            chunks[chunk_type] = chunks.get(chunk_type, 0) + 1
+            offset += 12 + length
+        print "APNG chunks valid      : %s %s" % ( valid, sorted(chunks.items()) )
+    finally:
+        shutil.rmtree(temp_dir)
@@ -25,15 +25,12 @@ import gnome15.g15globals as g15globals
 import gnome15.g15actions as g15actions
 import os.path
 import gtk
-import gobject
 import gnome15.util.g15convert as g15convert
 import gnome15.g15notify as g15notify
 import gnome15.util.g15uigconf as g15uigconf
 import gnome15.util.g15gconf as g15gconf
-import gnome15.util.g15os as g15os
-import gnome15.util.g15cairo as g15cairo
-import subprocess
-import shutil
+import cairo
+import lcdrecorder
 from threading import Thread
  
 # Logging
@@ -94,20 +91,13 @@ class LCDShotPreferences():
         bg_img = g15gconf.get_string_or_default(self.gconf_client, "%s/folder" % self.gconf_key, os.path.expanduser("~/Desktop"))
         chooser_button.set_current_folder(bg_img)
 
-        # Reset the value of the mode setting to 'still' if mencoder is not installed
-        mencoder_is_installed = g15os.is_program_in_path('mencoder')
-        if not mencoder_is_installed:
-            gconf_client.set_string("%s/mode" % self.gconf_key, "still")
-
-        # Initialize the mode combobox content
+        # Initialize the mode combobox content. Videos are encoded by the plugin
+        # itself, so both modes are always available
         modes = widget_tree.get_object("ModeModel")
         modes.clear()
         modes.append(('still','Still', True))
-        modes.append(('video','Video', mencoder_is_installed))
-
-        # Display a warning message to the user if mencoder is not installed
-        warning = widget_tree.get_object("NoVideoMessage")
-        warning.set_visible(not mencoder_is_installed)
+        modes.append(('video','Video', True))
+        widget_tree.get_object("NoVideoMessage").set_visible(False)
 
         g15uigconf.configure_combo_from_gconf(self.gconf_client, "%s/mode" % self.gconf_key, "Mode", "still", widget_tree)
         mode = widget_tree.get_object("Mode")
@@ -137,12 +127,15 @@ class G15LCDShot():
         self._gconf_client = gconf_client
         self._gconf_key = gconf_key
         self._recording = False
+        self._recorder = None
 
     def activate(self):
         self._screen.key_handler.action_listeners.append(self) 
     
     def deactivate(self):
         self._screen.key_handler.action_listeners.remove(self)
+        if self._recording:
+            self._stop_recording()
         
     def destroy(self):
         pass
@@ -159,57 +152,69 @@ class G15LCDShot():
                 else:
                     self._start_recording()
                     
-    def _encode(self):
-        cmd = ["mencoder", "-really-quiet", "mf://%s.tmp/*.jpeg" % self._record_to, "-mf", \
-                         "w=%d:h=%d:fps=%d:type=jpg" % (self._screen.device.lcd_size[0],self._screen.device.lcd_size[1],self._record_fps), "-ovc", "lavc", \
-                         "-lavcopts", "vcodec=mpeg4", "-oac", "copy", "-o", self._record_to]
+    def _encode(self, recording_path, video_path):
         try:
-            ret = subprocess.call(cmd)
-            if ret == 0:
-                g15notify.notify(_("LCD Screenshot"), _("Video encoding complete. Result at %s" % self._record_to), "dialog-info", timeout = 0)
-                shutil.rmtree("%s.tmp" % self._record_to, True)
-            else:
-                logger.error("Video encoding failed with status %d", ret)
-                g15notify.notify(_("LCD Screenshot"), _("Video encoding failed."), "dialog-error", timeout = 0)
+            lcdrecorder.write_apng(recording_path, video_path)
+            os.remove(recording_path)
+            g15notify.notify(_("LCD Screenshot"), _("Video encoding complete. Result at %s") % video_path, "dialog-info", timeout = 0)
         except Exception as e:
-                logger.error("Video encoding failed.", exc_info = e)
-                g15notify.notify(_("LCD Screenshot"), _("Video encoding failed. Do you have mencoder installed?"), "dialog-error", timeout = 0)
+            logger.error("Video encoding failed.", exc_info = e)
+            g15notify.notify(_("LCD Screenshot"), _("Video encoding failed. The recording is at %s") % recording_path, "dialog-error", timeout = 0)
                     
     def _stop_recording(self):
         self._recording = False
+        self._screen.draw_lock.acquire()
+        try:
+            if self._frame_drawn in self._screen.frame_listeners:
+                self._screen.frame_listeners.remove(self._frame_drawn)
+        finally:
+            self._screen.draw_lock.release()
+        recorder = self._recorder
+        self._recorder = None
+        recorder.stop()
+        logger.info("Recorded %d of %d frames (%d unchanged) to %s, %d bytes", recorder.frames_written, 
+                    recorder.frames_offered, recorder.frames_unchanged, recorder.path, recorder.bytes_written)
         g15notify.notify(_("LCD Screenshot"), _("Video recording stopped. Now encoding"), "dialog-info", timeout = 0)
-        t = Thread(target = self._encode);
+        t = Thread(target = self._encode, args = ( recorder.path, self._record_to ));
         t.setName("LCDScreenshotEncode")
         t.start()
                     
     def _start_recording(self):
-        self._record_fps = g15gconf.get_int_or_default(self._gconf_client, "%s/fps" % self._gconf_key, 10)
-        path = self._find_next_free_filename("avi", _("Gnome15_Video"))
+        fps = g15gconf.get_int_or_default(self._gconf_client, "%s/fps" % self._gconf_key, 10)
+        path = self._find_next_free_filename("png", _("Gnome15_Video"))
+        width = self._screen.width
+        height = self._screen.height
+        recorder = lcdrecorder.Recorder("%s.g15rec" % path, width, height, 
+                                        cairo.ImageSurface.format_stride_for_width(cairo.FORMAT_ARGB32, width), fps)
+        try:
+            recorder.start()
+        except Exception as e:
+            logger.error("Failed to start recording.", exc_info = e)
+            self._screen.error_on_keyboard_display(_("Failed to record video to %s. %s") % (path, str(e)))
+            return
         g15notify.notify(_("LCD Screenshot"), _("Started recording video"), "dialog-info")
-        g15os.mkdir_p("%s.tmp" % path)
-        self._frame_no = 1
+        self._recorder = recorder
         self._recording = True
         self._record_to = path
-        self._frame()
         
-    def _frame(self):
-        if self._recording:
-            try:
-                self._screen.draw_lock.acquire()
-                try:
-                    path = os.path.join("%s.tmp" % self._record_to, "%012d.jpeg" % self._frame_no)
-                    pixbuf = g15cairo.surface_to_pixbuf(self._screen.old_surface)
-                finally:
-                    self._screen.draw_lock.release()
-                    
-                pixbuf.save(path, "jpeg", {"quality":"100"})
-                self._frame_no += 1
-            except Exception as e:
-                logger.error("Failed to save screenshot.", exc_info = e)
-                self._screen.error_on_keyboard_display(_("Failed to save screenshot to %s. %s") % (dir, str(e)))
-                self._recording = False
-            
-            self._recording_timer = gobject.timeout_add(1000 / self._record_fps, self._frame)
+        """
+        Frames are passed on as they are drawn. Start with whatever is
+        currently on the LCD, as nothing may be drawn for a while
+        """
+        self._screen.draw_lock.acquire()
+        try:
+            if self._screen.old_surface is not None:
+                self._frame_drawn(self._screen.old_surface)
+            self._screen.frame_listeners.append(self._frame_drawn)
+        finally:
+            self._screen.draw_lock.release()
+        
+    def _frame_drawn(self, surface):
+        # Called with the draw lock held, so just take a copy of the data
+        recorder = self._recorder
+        if recorder is not None:
+            surface.flush()
+            recorder.offer(str(surface.get_data()))
             
     def _find_next_free_filename(self, ext, title):
         dir_path = g15gconf.get_string_or_default(self._gconf_client, "%s/folder" % \
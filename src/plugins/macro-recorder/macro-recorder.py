@@ -234,7 +234,7 @@ class G15MacroRecorder():
             record_keys = self._record_keys    
             self._halt_recorder()   
               
-            active_profile = g15profile.get_active_profile(self._screen.device)
+            active_profile = g15profile.edit_profile(g15profile.get_active_profile(self._screen.device))
             key_name = ", ".join(g15driver.get_key_names(record_keys))
             if len(self._script_model) == 0:  
                 self.icon = "edit-delete"
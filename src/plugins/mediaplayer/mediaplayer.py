@@ -35,7 +35,6 @@ import gtk
 import os
 import gst
 import cairo
-import array
 import gobject
 import gio
 import mimetypes
@@ -273,11 +272,13 @@ class G15MediaPlayerPage(g15theme.G15Page):
         logger.info("Creating audio/visual source")
         self._video_src = self._source.create_source()
 
-        # Create our custom sink that is connected to the LCD
+        # Create our custom sink that is connected to the LCD. It scales the
+        # video to the LCD size, in the format the LCD uses
         logger.info("Creating videosink that is connected to the LCD")
-        self._video_sink = lcdsink.CairoSurfaceThumbnailSink()
+        width, height = self._get_video_size()
+        self._video_sink = lcdsink.LCDVideoSink(self._screen.driver.get_bpp(), width, height)
         logger.info("Connecting to video sink")
-        self._video_sink.connect('thumbnail', self._redraw_cb)
+        self._video_sink.connect('frame', self._redraw_cb)
         
         # Now create the actual pipeline
         self._pipeline = gst.Pipeline("mypipeline")
@@ -389,23 +390,13 @@ class G15MediaPlayerPage(g15theme.G15Page):
             self._show_sidebar()
                 
     def _redraw_cb(self, unused_thsink, timestamp):
+        """
+        The frame is already in the sink's frame pool, it is picked up when
+        painting. No more frames are delivered until it has been, so the
+        redraws queued here never get ahead of the LCD
+        """
         if not self._plugin.active:
             return
-        buf = self._video_sink.data
-        width = self._video_sink.width
-        height = self._video_sink.height
-        b = array.array("b")
-        b.fromstring(buf)
-        self._surface = cairo.ImageSurface.create_for_data(b,
-            # We don't use FORMAT_ARGB32 because Cairo uses premultiplied
-            # alpha, and gstreamer does not.  Discarding the alpha channel
-            # is not ideal, but the alternative would be to compute the
-            # conversion in python (slow!).
-            cairo.FORMAT_RGB24,
-            width,
-            height,
-            width * 4)
-        
         if self.is_visible():
             self.redraw()
         else:
@@ -447,17 +438,34 @@ class G15MediaPlayerPage(g15theme.G15Page):
         secs = int(secs)
         return hours,mins,secs
         
-    def _paint_video_image(self, canvas):
+    def _get_video_size(self):
         size = self._screen.driver.get_size()
+        return ( int(size[0]), int(round(float(size[0]) * float(self._aspect[1]) / float(self._aspect[0]))) )
+        
+    def _paint_video_image(self, canvas):
+        frame = self._video_sink.get_frame()
+        if frame is not None:
+            self._surface = frame
         if self._surface != None:
-            target_size = ( float(size[0]), float(size[0]) * (float(self._aspect[1]) ) / float(self._aspect[0]) )
-            sx = float(target_size[0]) / float(self._surface.get_width())
-            sy = float(target_size[1]) / float(self._surface.get_height())
+            size = self._screen.driver.get_size()
+            target_size = self._get_video_size()
             canvas.save()
             canvas.translate((size[0] - target_size[0]) / 2.0,(size[1] - target_size[1]) / 2.0)
-            canvas.scale(sx, sy)
-            canvas.set_source_surface(self._surface)
-            canvas.paint()
+            
+            # Frames are normally already the right size, but may not be just after the aspect changes
+            if ( self._surface.get_width(), self._surface.get_height() ) != target_size:
+                canvas.scale(float(target_size[0]) / float(self._surface.get_width()), 
+                             float(target_size[1]) / float(self._surface.get_height()))
+            if self._surface.get_format() == cairo.FORMAT_A8:
+                # Grayscale for monochrome LCDs, painted as the brightness over black
+                canvas.rectangle(0, 0, self._surface.get_width(), self._surface.get_height())
+                canvas.set_source_rgb(0, 0, 0)
+                canvas.fill()
+                canvas.set_source_rgb(1, 1, 1)
+                canvas.mask_surface(self._surface)
+            else:
+                canvas.set_source_surface(self._surface)
+                canvas.paint()
             canvas.restore()
     
     def _hide_sidebar(self, after = 0.0):
@@ -485,6 +493,7 @@ class G15MediaPlayerPage(g15theme.G15Page):
             self._aspect = self._full_screen
         else:
             self._aspect = (16, 9)
+        self._video_sink.set_size(*self._get_video_size())
         if self._sidebar_offset != 0:
             self._show_sidebar()
             self._hide_sidebar(3.0)
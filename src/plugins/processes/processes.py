@@ -30,12 +30,7 @@ import gobject
 import logging
 logger = logging.getLogger(__name__)
 
-try:
-    import gtop
-except Exception as e:
-    logger.debug("Could not import gtop module. Will use g15top instead", exc_info = e)
-    # API compatible work around for Ubuntu 12.10
-    import gnome15.g15top as gtop
+import gnome15.g15top as g15top
 
 from Xlib import X
 import Xlib.protocol.event
@@ -117,6 +112,8 @@ class G15Processes(g15plugin.G15MenuPlugin):
         self._mode = "applications"
         self._timer = None
         self._matches = []
+        self._process_table = g15top.ProcessTable()
+        self._process_mode = None
         g15plugin.G15MenuPlugin.activate(self)
         self.screen.key_handler.action_listeners.append(self)
         if self.bamf_matcher is not None:        
@@ -211,9 +208,9 @@ class G15Processes(g15plugin.G15MenuPlugin):
     def _do_kill(self, process_id):
         os.system("kill %d" % process_id)
         time.sleep(0.5)
-        if process_id in gtop.proclist():
+        if process_id in g15top.proclist():
             time.sleep(5.0)
-            if process_id in gtop.proclist():
+            if process_id in g15top.proclist():
                 os.system("kill -9 %d" % process_id)
             
     def _kill_process(self, process_id):
@@ -303,6 +300,7 @@ class G15Processes(g15plugin.G15MenuPlugin):
         
         this_items = {}        
         if self._mode == "applications":
+            self._process_mode = None
             if self.bamf_matcher != None:            
                 for window in self.bamf_matcher.RunningApplications():
                     try:
@@ -325,26 +323,29 @@ class G15Processes(g15plugin.G15MenuPlugin):
                             item.icon = g15cairo.pixbuf_to_surface(pixbuf)
                                 
         else:
-            for process_id in gtop.proclist():
-                process_id = "%d" %  process_id
-                try :
-                    pid = int(process_id)
-                    proc_state = gtop.proc_state(pid)
-                    proc_args = gtop.proc_args(pid)
-                    if self._mode == "all" or ( self._mode != "all" and proc_state.uid == os.getuid()):                      
-                        item = self._get_menu_item(pid)
+            added, removed = self._process_table.refresh()
+            if self._process_mode == self._mode and len(added) == 0 and len(removed) == 0:
+                # Nothing has changed
+                return
+            self._process_mode = self._mode
+            uid = os.getuid()
+            for pid, process in self._process_table.processes.iteritems():
+                if self._mode == "all" or process.uid == uid:
+                    item_id = "process-%d" % pid
+                    item = self.menu.get_child_by_id(item_id)
+                    if item is None or pid in added:
+                        if item is None:
+                            item = ProcessMenuItem(item_id, self, pid, None)
                         item.icon = None
-                        item.process_name = self._get_process_name(proc_args, proc_state.cmd)
-                        this_items[item.id] = item
-                except Exception as e:
-                    logger.debug("Process may have disappeared", exc_info = e)
-                    # In case the process disappears
-                    pass
+                        item.process_name = self._get_process_name(process.args, process.name)
+                    this_items[item_id] = item
  
-        # Remove any missing items
-        for item in self.menu.get_children():
-            if not item.id in this_items:
-                self.menu.remove_child(item)
+        # Remove any missing items and add any new ones, in a single update of the menu
+        children = [ item for item in self.menu.get_children() if item.id in this_items ]
+        if len(children) != self.menu.get_child_count() or len(children) != len(this_items):
+            new_ids = set(this_items) - set(item.id for item in children)
+            children += sorted([ this_items[item_id] for item_id in new_ids ], key = lambda item: item.process_id)
+            self.menu.set_children(children)
         
         # Make sure selected still exists
         if self.menu.selected != None and self.menu.get_child_by_id(self.menu.selected.id) is None:
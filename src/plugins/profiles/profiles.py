@@ -157,7 +157,7 @@ class G15Profiles(g15plugin.G15MenuPlugin):
                         g15profile.set_locked(self.screen.device, True)
                     return True
                 elif binding.action == g15driver.CLEAR:
-                    profile = self.menu.selected.profile
+                    profile = g15profile.edit_profile(self.menu.selected.profile)
                     if self.screen.service.active_application_name is not None:
                         self._configure_profile_with_window_name(profile, self.screen.service.active_application_name)
                         profile.save()
@@ -27,10 +27,13 @@ import gnome15.util.g15icontools as g15icontools
 import gnome15.g15theme as g15theme
 import gnome15.g15driver as g15driver
 import gnome15.g15desktop as g15desktop
+import gnome15.g15globals as g15globals
 import subprocess
 import time
 import os
+import threading
 import feedparser
+import rssfetch
 import gtk
 import gconf
 import logging
@@ -57,6 +60,9 @@ actions={
          g15driver.PREVIOUS_PAGE : _("Previous page"),
          g15driver.SELECT : _("Open item in browser")
          }
+
+# Number of feeds that may be downloaded at once
+FETCH_WORKERS = 4
  
 def create(gconf_key, gconf_client, screen):
     return G15RSS(gconf_client, gconf_key, screen)
@@ -213,8 +219,15 @@ class G15FeedPage(g15theme.G15Page):
         self._icon_surface = None
         self._icon_embedded = None
         self._selected_icon_embedded = None
+        self._plugin = plugin
+        self._icon = None
+        self._items = {}
+        self._item_serial = 0
+        self._subtitle = ""
+        self.feed = None
         self.url = url
         self.index = -1
+        self.fetching = False
         self._menu = g15theme.Menu("menu")
         self._menu.on_selected = self._on_selected
         g15theme.G15Page.__init__(self, "Feed " + str(plugin._page_serial), self._screen,
@@ -225,7 +238,8 @@ class G15FeedPage(g15theme.G15Page):
         self.add_child(self._menu)
         self.add_child(g15theme.MenuScrollbar("viewScrollbar", self._menu))
         plugin._page_serial += 1
-        self._reload() 
+        self.set_title(url)
+        self._load_cached()
         self._screen.add_page(self)
         self._screen.redraw(self)
             
@@ -241,25 +255,83 @@ class G15FeedPage(g15theme.G15Page):
             except Exception as e:
                 logger.warning("Failed to get icon %s", str(self._menu.selected.icon), exc_info = e)
         
-    def _reload(self):
-        self.feed = feedparser.parse(self.url)
+    def _load_cached(self):
+        """
+        Show the copy of the feed saved when it was last fetched (if any), 
+        until it can be fetched again
+        """
+        response = self._plugin._fetcher.cache.get(self.url)
+        if response is not None:
+            try:
+                self._update(feedparser.parse(response.body, response_headers = response.headers))
+            except Exception as e:
+                logger.warning("Failed to load cached feed %s", self.url, exc_info = e)
+                
+    def _fetch(self):
+        """
+        Fetch the feed, and update the page if it has changed. This is run
+        on the plugin's fetch queue.
+        """
+        try:
+            self._do_fetch()
+        finally:
+            self.fetching = False
+            
+    def _do_fetch(self):
+        try:
+            response = self._plugin._fetcher.fetch(self.url)
+        except rssfetch.FetchError as e:
+            logger.warning("Failed to fetch feed %s. %s", self.url, e)
+            return
+        if self._plugin._pages.get(self.url) is not self:
+            # Page removed while fetching
+            return
+        if response.not_modified and self.feed is not None:
+            logger.debug("Feed %s has not changed", self.url)
+            return
+        self._update(feedparser.parse(response.body, response_headers = response.headers))
+        self.redraw()
+        
+    def _update(self, feed):
         icon = None
-        if "icon" in self.feed["feed"]:
-            icon = self.feed["feed"]["icon"]
-        elif "image" in self.feed["feed"]:
-            img = self.feed["feed"]["image"]
+        if "icon" in feed["feed"]:
+            icon = feed["feed"]["icon"]
+        elif "image" in feed["feed"]:
+            img = feed["feed"]["image"]
             if "url" in img:
                 icon = img["url"]
             elif "link" in img:
                 icon = img["link"]
                 
-        title = self.feed["feed"]["title"] if "title" in self.feed["feed"] else self.url
+        title = feed["feed"]["title"] if "title" in feed["feed"] else self.url
         if icon is None and title.endswith("- Twitter Search"):
             title = title[:-16]
             icon = g15icontools.get_icon_path("gnome15")
         if icon is None:
             icon = g15icontools.get_icon_path(["application-rss+xml","gnome-mime-application-rss+xml"], self._screen.height)
             
+        if icon != self._icon or self._icon_surface is None:
+            self._icon = icon
+            self._load_icon(icon)
+        self.set_title(title)
+        self._subtitle = feed["feed"]["subtitle"] if "subtitle" in feed["feed"] else ""
+        
+        # Only create menu items for entries that are new (or have been updated)
+        items = {}
+        children = []
+        for entry in feed.entries:
+            key = self._get_entry_key(entry)
+            item = self._items.pop(key, None)
+            if item is None:
+                item = G15FeedsMenuItem("feeditem-%d" % self._item_serial, entry, self._gconf_client, self._gconf_key)
+                self._item_serial += 1
+            items[key] = item
+            children.append(item)
+        self._items = items
+        self._menu.set_children(children)
+        self.feed = feed
+        
+    def _load_icon(self, icon):
         if icon == None:
             self._icon_surface = None
             self._icon_embedded = None
@@ -272,13 +344,10 @@ class G15FeedPage(g15theme.G15Page):
                 logger.warning("Failed to get icon %s", str(icon), exc_info = e)
                 self._icon_surface = None
                 self._icon_embedded = None
-        self.set_title(title)
-        self._subtitle = self.feed["feed"]["subtitle"] if "subtitle" in self.feed["feed"] else ""
-        self._menu.remove_all_children()
-        i = 0
-        for entry in self.feed.entries:
-            self._menu.add_child(G15FeedsMenuItem("feeditem-%d" % i, entry, self._gconf_client, self._gconf_key))
-            i += 1
+                
+    def _get_entry_key(self, entry):
+        entry_id = entry.get("id") or entry.get("link") or entry.get("title")
+        return ( entry_id, entry.get("updated") )
             
     def _get_theme_properties(self):
         properties = {}
@@ -313,9 +382,14 @@ class G15RSS():
         self._gconf_client = gconf_client
         self._page_serial = 1
         self._refresh_timer = None
+        self._fetcher = None
+        self._fetch_queue = "RSSFetch-%s" % screen.device.uid
+        self._fetch_lock = threading.Lock()
 
     def activate(self):
         self._pages = {}       
+        self._fetcher = rssfetch.FeedFetcher(rssfetch.FeedCache(os.path.join(g15globals.user_cache_dir, "rss")))
+        g15scheduler.configure_queue(self._fetch_queue, FETCH_WORKERS)
         self._schedule_refresh() 
         self._update_time_changed_handle = self._gconf_client.notify_add(self._gconf_key + "/update_time", self._update_time_changed)
         self._urls_changed_handle = self._gconf_client.notify_add(self._gconf_key + "/urls", self._urls_changed)
@@ -328,6 +402,8 @@ class G15RSS():
         for page in self._pages:
             self._screen.del_page(self._pages[page])
         self._pages = {}
+        g15scheduler.stop_queue(self._fetch_queue)
+        self._fetcher.close()
     
     '''
     Private
@@ -340,11 +416,21 @@ class G15RSS():
     def _refresh(self):
         logger.info("Refreshing RSS feeds")
         for page_id in list(self._pages):
-            page = self._pages[page_id]        
-            page._reload()
-            page.redraw()
+            self._queue_fetch(self._pages[page_id])
         self._schedule_refresh()
         
+    def _queue_fetch(self, page):
+        # A slow feed may still be fetching when the next refresh is due
+        self._fetch_lock.acquire()
+        try:
+            if page.fetching:
+                logger.debug("Feed %s is still being fetched", page.url)
+                return
+            page.fetching = True
+        finally:
+            self._fetch_lock.release()
+        g15scheduler.execute(self._fetch_queue, "FetchFeed", page._fetch)
+        
     def destroy(self):
         pass 
     
@@ -365,7 +451,9 @@ class G15RSS():
         # Add new pages
         for url in feed_list:
             if not url in self._pages:
-                self._pages[url] = G15FeedPage(self, url)
+                page = G15FeedPage(self, url)
+                self._pages[url] = page
+                self._queue_fetch(page)
                 
         # Remove pages that no longer exist
         to_remove = []
@@ -376,4 +464,5 @@ class G15RSS():
                 to_remove.append(page_url)
         for page in to_remove:
             del self._pages[page]
+            self._fetcher.cache.remove(page)
             
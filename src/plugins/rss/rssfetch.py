@@ -0,0 +1,312 @@
+#  Gnome15 - Suite of tools for the Logitech G series keyboards and headsets
+#  Copyright (C) 2010 Brett Smith <tanktarta@blueyonder.co.uk>
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Downloading of feeds for the RSS plugin.
+
+Feeds are requested with the ETag and Last-Modified values of the previous
+download, so servers may reply with "304 Not Modified" instead of sending the
+feed again. The last copy of each feed is kept on disk, so this also works
+across restarts. Connections are kept open and reused for further requests to
+the same host (one set of connections per thread, as they cannot be shared).
+
+This module has no dependencies on the rest of Gnome15.
+'''
+
+import os
+import gzip
+import json
+import socket
+import hashlib
+import httplib
+import urllib2
+import urlparse
+import threading
+from cStringIO import StringIO
+
+# Logging
+import logging
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT = 30
+MAX_REDIRECTS = 5
+USER_AGENT = "Gnome15 RSS"
+REDIRECT_STATUSES = [ 301, 302, 303, 307, 308 ]
+
+class FetchError(Exception):
+    pass
+
+"""
+Response headers kept with a feed, as feedparser needs them to decode it
+(the character set in particular)
+"""
+KEPT_HEADERS = [ "content-type", "content-location", "content-language" ]
+
+class FeedResponse(object):
+    """
+    The result of fetching a feed. If not_modified is True, the feed has not
+    changed since it was last fetched, and body is the cached copy. headers
+    contains any of KEPT_HEADERS the feed was sent with (with lower case
+    names), and may be passed to feedparser.parse() as response_headers.
+    """
+
+    def __init__(self, url, body, etag = None, last_modified = None, not_modified = False, headers = None):
+        self.url = url
+        self.body = body
+        self.etag = etag
+        self.last_modified = last_modified
+        self.not_modified = not_modified
+        self.headers = headers if headers is not None else {}
+
+def _get_kept_headers(response_headers):
+    return dict(( k, v ) for k, v in response_headers.items() if k in KEPT_HEADERS)
+
+class FeedCache(object):
+    """
+    Keeps the last downloaded copy of each feed on disk, along with the
+    ETag and Last-Modified headers it was sent with.
+    """
+
+    def __init__(self, cache_dir):
+        """
+        Keyword arguments:
+        cache_dir    -- directory to store feeds in (created if required)
+        """
+        self.cache_dir = cache_dir
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+    def get(self, url):
+        """
+        Get the cached copy of a feed as a FeedResponse, or None if the feed
+        is not cached.
+
+        Keyword arguments:
+        url          -- URL of feed
+        """
+        meta_path, body_path = self._get_paths(url)
+        try:
+            with open(meta_path, "rb") as meta_file:
+                meta = json.load(meta_file)
+            with open(body_path, "rb") as body_file:
+                body = body_file.read()
+        except ( IOError, ValueError ):
+            return None
+        return FeedResponse(url, body, meta.get("etag"), meta.get("last_modified"), True, meta.get("headers"))
+
+    def put(self, response):
+        """
+        Store a feed.
+
+        Keyword arguments:
+        response     -- FeedResponse to store
+        """
+        meta_path, body_path = self._get_paths(response.url)
+        self._write(body_path, response.body)
+        self._write(meta_path, json.dumps({ "url" : response.url,
+                                            "etag" : response.etag,
+                                            "last_modified" : response.last_modified,
+                                            "headers" : response.headers }))
+
+    def remove(self, url):
+        """
+        Remove the cached copy of a feed.
+
+        Keyword arguments:
+        url          -- URL of feed
+        """
+        for path in self._get_paths(url):
+            if os.path.exists(path):
+                os.remove(path)
+
+    """
+    Private
+    """
+    def _get_paths(self, url):
+        name = hashlib.md5(url.encode("utf-8") if isinstance(url, unicode) else url).hexdigest()
+        return ( os.path.join(self.cache_dir, "%s.json" % name),
+                 os.path.join(self.cache_dir, "%s.feed" % name) )
+
+    def _write(self, path, data):
+        tmp_path = "%s.tmp" % path
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.rename(tmp_path, path)
+
+class FeedFetcher(object):
+    """
+    Downloads feeds using conditional requests. Safe to use from any number
+    of threads at once.
+    """
+
+    def __init__(self, cache = None, timeout = DEFAULT_TIMEOUT):
+        """
+        Keyword arguments:
+        cache        -- FeedCache, or None to always download feeds in full
+        timeout      -- socket timeout in seconds
+        """
+        self.cache = cache
+        self.timeout = timeout
+        self.requests = 0
+        self.connections_opened = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._all_connections = []
+
+    def fetch(self, url):
+        """
+        Fetch a feed, returning a FeedResponse. If the server reports the
+        feed has not changed, the cached copy is returned. FetchError is raised
+        if the feed could not be downloaded.
+
+        Keyword arguments:
+        url          -- URL of feed
+        """
+        cached = self.cache.get(url) if self.cache is not None else None
+        scheme = urlparse.urlsplit(url).scheme.lower()
+        if not scheme in [ "http", "https" ]:
+            return self._fetch_other(url, cached)
+
+        headers = { "User-Agent" : USER_AGENT,
+                    "Accept-Encoding" : "gzip" }
+        if cached is not None:
+            if cached.etag:
+                headers["If-None-Match"] = cached.etag
+            if cached.last_modified:
+                headers["If-Modified-Since"] = cached.last_modified
+
+        location = url
+        for i in range(0, MAX_REDIRECTS + 1):
+            status, response_headers, body = self._request(location, headers)
+            if not status in REDIRECT_STATUSES or not "location" in response_headers:
+                break
+            location = urlparse.urljoin(location, response_headers["location"])
+        else:
+            raise FetchError("Too many redirects fetching %s" % url)
+
+        if status == 304 and cached is not None:
+            logger.debug("Feed %s not modified", url)
+            return cached
+        if status != 200:
+            raise FetchError("Unexpected response %d fetching %s" % ( status, url ))
+
+        if response_headers.get("content-encoding", "").lower() == "gzip":
+            body = gzip.GzipFile(fileobj = StringIO(body)).read()
+        response = FeedResponse(url, body, response_headers.get("etag"), response_headers.get("last-modified"),
+                                headers = _get_kept_headers(response_headers))
+        self._store(response)
+        return response
+
+    def close(self):
+        """
+        Close all open connections
+        """
+        self._lock.acquire()
+        try:
+            for conn in self._all_connections:
+                conn.close()
+            self._all_connections = []
+        finally:
+            self._lock.release()
+
+    """
+    Private
+    """
+    def _fetch_other(self, url, cached):
+        # Local files and other schemes, no conditional requests are possible
+        try:
+            f = urllib2.urlopen(url, timeout = self.timeout)
+            try:
+                body = f.read()
+                response_headers = dict(( k.lower(), v ) for k, v in f.info().items())
+            finally:
+                f.close()
+        except ( IOError, ValueError ) as e:
+            raise FetchError("Failed to fetch %s. %s" % ( url, e ))
+        if cached is not None and cached.body == body:
+            return cached
+        response = FeedResponse(url, body, headers = _get_kept_headers(response_headers))
+        self._store(response)
+        return response
+
+    def _store(self, response):
+        # Failing to cache a feed does not stop it being shown
+        if self.cache is not None:
+            try:
+                self.cache.put(response)
+            except IOError as e:
+                logger.warning("Failed to cache feed %s", response.url, exc_info = e)
+
+    def _request(self, url, headers):
+        parts = urlparse.urlsplit(url)
+        path = parts.path or "/"
+        if parts.query:
+            path = "%s?%s" % ( path, parts.query )
+        key = ( parts.scheme.lower(), parts.netloc )
+
+        connections = getattr(self._local, "connections", None)
+        if connections is None:
+            connections = {}
+            self._local.connections = connections
+
+        """
+        A reused connection may have been closed by the server since the last
+        request, so if a request on one fails try again on a new connection
+        """
+        for attempt in range(0, 2):
+            conn = connections.get(key)
+            reused = conn is not None
+            if conn is None:
+                conn = self._open(key)
+                connections[key] = conn
+            try:
+                conn.request("GET", path, headers = headers)
+                response = conn.getresponse()
+                body = response.read()
+            except ( httplib.HTTPException, socket.error ) as e:
+                self._discard(connections, key)
+                if reused and attempt == 0:
+                    logger.debug("Connection to %s failed, reconnecting", parts.netloc, exc_info = e)
+                    continue
+                raise FetchError("Failed to fetch %s. %s" % ( url, e ))
+            self.requests += 1
+            if response.will_close:
+                self._discard(connections, key)
+            return response.status, dict(response.getheaders()), body
+
+    def _open(self, key):
+        scheme, netloc = key
+        if scheme == "https":
+            conn = httplib.HTTPSConnection(netloc, timeout = self.timeout)
+        else:
+            conn = httplib.HTTPConnection(netloc, timeout = self.timeout)
+        self._lock.acquire()
+        try:
+            self._all_connections.append(conn)
+            self.connections_opened += 1
+        finally:
+            self._lock.release()
+        return conn
+
+    def _discard(self, connections, key):
+        conn = connections.pop(key)
+        conn.close()
+        self._lock.acquire()
+        try:
+            if conn in self._all_connections:
+                self._all_connections.remove(conn)
+        finally:
+            self._lock.release()
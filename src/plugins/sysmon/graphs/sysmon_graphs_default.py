@@ -84,7 +84,7 @@ class G15CPUGraph(G15Graph):
         
     def create_plot(self, graph_surface):
         series_colors, fill_colors = self.get_colors()
-        return cairoplot.AreaPlot(graph_surface, self.plugin.selected_cpu.history, 
+        return cairoplot.AreaPlot(graph_surface, self.plugin.selected_cpu.history.to_list(), 
                                  self.view_bounds[2], 
                                  self.view_bounds[3], 
                                  background = None,
@@ -113,7 +113,7 @@ class G15NetGraph(G15Graph):
         else:
             alt_series_color = g15convert.get_alt_color(series_color)
             alt_fill_color = g15convert.get_alt_color(fill_color)
-        return cairoplot.AreaPlot( graph_surface, [ self.plugin.selected_net.send_history, self.plugin.selected_net.recv_history ], 
+        return cairoplot.AreaPlot( graph_surface, [ self.plugin.selected_net.send_history.to_list(), self.plugin.selected_net.recv_history.to_list() ], 
                                       self.view_bounds[2], 
                                       self.view_bounds[3], 
                                       background = None,
@@ -144,7 +144,7 @@ class G15MemGraph(G15Graph):
         else:
             alt_series_color = g15convert.get_alt_color(series_color)
             alt_fill_color = g15convert.get_alt_color(fill_color)
-        return cairoplot.AreaPlot( graph_surface, [ self.plugin.used_history, self.plugin.cached_history ], 
+        return cairoplot.AreaPlot( graph_surface, [ self.plugin.used_history.to_list(), self.plugin.cached_history.to_list() ], 
                                       self.view_bounds[2], 
                                       self.view_bounds[3], 
                                       background = None,
@@ -22,17 +22,15 @@ import gnome15.util.g15uigconf as g15uigconf
 import gnome15.util.g15gconf as g15gconf
 import gnome15.util.g15cairo as g15cairo
 import gnome15.util.g15icontools as g15icontools
+import gnome15.util.g15history as g15history
 import gnome15.g15driver as g15driver
 import gnome15.g15plugin as g15plugin
 import time
 import logging
 logger=logging.getLogger(__name__)
-try:
-    import gtop
-except Exception as e:
-    logger.debug("Could not import gtop. Falling back to g15top", exc_info = e)
-    # API compatible work around for Ubuntu 12.10
-    import gnome15.g15top as gtop
+
+# Statistics are sampled once and shared with the other plugins that use them
+import gnome15.g15top as g15top
 import gtk
 import os
 import sys
@@ -82,8 +80,8 @@ class Net():
         self.last_net_list = None
         self.max_send = 0.0001  
         self.max_recv = 0.0001
-        self.send_history = [0] * GRAPH_SIZE
-        self.recv_history =  [0] * GRAPH_SIZE
+        self.send_history = g15history.History(GRAPH_SIZE)
+        self.recv_history = g15history.History(GRAPH_SIZE)
         self.last_net_list = None
         self.last_time = 0
         
@@ -118,11 +116,7 @@ class Net():
                         
         # History
         self.send_history.append(self.recv_bps)
-        while len(self.send_history) > GRAPH_SIZE:
-            del self.send_history[0]
         self.recv_history.append(self.send_bps)
-        while len(self.recv_history) > GRAPH_SIZE:
-            del self.recv_history[0]
             
         self.last_net_list = this_net_list 
         self.last_time = now
@@ -144,7 +138,7 @@ class CPU():
     def __init__(self, number):
         self.number = number 
         self.name = "cpu%d" % number if number >= 0 else "cpu"
-        self.history = [0] * GRAPH_SIZE
+        self.history = g15history.History(GRAPH_SIZE)
         self.value = 0
         self.times = None
         self.last_times = None
@@ -167,10 +161,8 @@ class CPU():
         
         self.last_times = time_list
         
-        # Update the history and trim it to the graph data size
+        # Update the history, the oldest value is discarded
         self.history.append(self.pc)
-        while len(self.history) > GRAPH_SIZE:
-            del self.history[0]       
         
     def get_pc(self, times):
         sum_l = sum(times)
@@ -210,7 +202,7 @@ class G15SysMon(g15plugin.G15RefreshingPlugin):
         self.cpu_no = 0  
         self.cpu_data = []  
         selected_cpu_name = self.gconf_client.get_string(self.gconf_key + "/cpu")
-        cpus = gtop.cpu().cpus
+        cpus = g15top.get_snapshot().cpus
         for i in range(-1, len(cpus)):
             cpu = CPU(i)
             self.cpu_data.append(cpu)
@@ -221,7 +213,7 @@ class G15SysMon(g15plugin.G15RefreshingPlugin):
 
         # Net
         self.selected_net = None
-        _, self.net_list = self._get_net_stats()
+        _, self.net_list = self._get_net_stats(g15top.get_snapshot())
         net_name = self.gconf_client.get_string(self.gconf_key + "/net")
         self.net_data = []
         for idx, n in enumerate(self.net_list):
@@ -240,8 +232,8 @@ class G15SysMon(g15plugin.G15RefreshingPlugin):
         self.cached = 0
         self.free = 0
         self.used = 0
-        self.cached_history = [0] * GRAPH_SIZE
-        self.used_history =  [0] * GRAPH_SIZE 
+        self.cached_history = g15history.History(GRAPH_SIZE)
+        self.used_history = g15history.History(GRAPH_SIZE)
         
         g15plugin.G15RefreshingPlugin.activate(self)
         self._set_panel()
@@ -283,22 +275,25 @@ class G15SysMon(g15plugin.G15RefreshingPlugin):
         
     def refresh(self):
             
+        # All statistics come from the same sample
+        snapshot = g15top.get_snapshot()
+        
         # Memory
-        mem = self._get_mem_info()
+        mem = snapshot.mem
         now = time.time()
 
         '''
         CPU
         '''
         for c in self.cpu_data:            
-            c.new_times(self._get_time_list(c))
+            c.new_times(self._get_time_list(snapshot, c))
         
         '''
         Net
         '''
         
         # Current net status   
-        this_net_list, self.net_list = self._get_net_stats()
+        this_net_list, self.net_list = self._get_net_stats(snapshot)
         for n in self.net_data:
             n.new_data(this_net_list)
         
@@ -313,12 +308,7 @@ class G15SysMon(g15plugin.G15RefreshingPlugin):
         self.cached = float(mem.cached)
         self.noncached = self.total - self.free - self.cached
         self.used_history.append(self.used + self.cached)
-        
-        while len(self.used_history) > GRAPH_SIZE:
-            del self.used_history[0]
         self.cached_history.append(self.cached)
-        while len(self.cached_history) > GRAPH_SIZE:
-            del self.cached_history[0]
         
         self.last_time = now
     
@@ -440,17 +430,15 @@ class G15SysMon(g15plugin.G15RefreshingPlugin):
             
             return 4 + total_width  
     
-    def _get_net_stats(self):
+    def _get_net_stats(self, snapshot):
         ifs = { }
-        nets = gtop.netlist()
-        for net in nets:
-            netload = gtop.netload(net)
+        for net in snapshot.nets:
+            netload = snapshot.netloads[net]
             ifs[net] = [ netload.bytes_in, netload.bytes_out ]
-        nets.insert(0, "Net")
-        return ifs, nets
+        return ifs, [ "Net" ] + list(snapshot.nets)
 
     
-    def _get_time_list(self, cpu):
+    def _get_time_list(self, snapshot, cpu):
         '''
         Returns a 4 element list containing the amount of time the CPU has 
         spent performing the different types of work
@@ -463,10 +451,7 @@ class G15SysMon(g15plugin.G15RefreshingPlugin):
         Values are in USER_HZ or Jiffies
         ''' 
         if cpu.number == -1:
-            cpu_times = gtop.cpu()
+            cpu_times = snapshot.cpu
         else:
-            cpu_times = gtop.cpu().cpus[cpu.number]
+            cpu_times = snapshot.cpus[cpu.number]
         return [cpu_times.user, cpu_times.nice, cpu_times.sys, cpu_times.idle]
-    
-    def _get_mem_info(self):
-        return gtop.mem()
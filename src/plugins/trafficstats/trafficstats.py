@@ -32,12 +32,9 @@ import time
 import datetime
 import logging
 logger=logging.getLogger(__name__)
-try:
-    import gtop
-except Exception as e:
-    logger.debug("Could not import gtop. Falling back to g15top", exc_info = e)
-    # API compatible work around for Ubuntu 12.10
-    import gnome15.g15top as gtop
+
+# Statistics are sampled once and shared with the other plugins that use them
+import gnome15.g15top as g15top
 import os
 import gtk
 import locale
@@ -89,7 +86,7 @@ def show_preferences(parent, driver, gconf_client, gconf_key):
 
     g15uigconf.configure_checkbox_from_gconf(gconf_client, gconf_key + "/use_vnstat", "UseVnstat", vnstat_installed, widget_tree)
     ndevice = widget_tree.get_object("NetDevice")
-    for netdev in gtop.netlist():
+    for netdev in g15top.netlist():
         ndevice.append([netdev])
     g15uigconf.configure_combo_from_gconf(gconf_client, gconf_key + "/networkdevice", "NetworkDevice", "lo", widget_tree)
     g15uigconf.configure_adjustment_from_gconf(gconf_client, gconf_key + "/refresh_interval", "RefreshingScale", 10.0, widget_tree)
@@ -158,7 +155,7 @@ class G15TrafficStats(g15plugin.G15RefreshingPlugin):
             elif binding.action == g15driver.NEXT_SELECTION:
                 if self.networkdevice is not None:
                     # get all network devices
-                    self.net_data = gtop.netlist()
+                    self.net_data = g15top.netlist()
                     # set network device id +1, to get next device
                     idx = self.net_data.index(self.networkdevice) + 1
                     # if next device id is not present, take first device
@@ -260,8 +257,11 @@ class G15TrafficStats(g15plugin.G15RefreshingPlugin):
         '''
 
         if self.use_vnstat is False:
-            bootup = datetime.datetime.fromtimestamp(int(gtop.uptime().boot_time)).strftime('%d.%m.%y %H:%M')
-            sd = gtop.netload(self.networkdevice)
+            snapshot = g15top.get_snapshot()
+            bootup = datetime.datetime.fromtimestamp(int(snapshot.time - snapshot.uptime[0])).strftime('%d.%m.%y %H:%M')
+            sd = snapshot.netloads.get(self.networkdevice)
+            if sd is None:
+                sd = g15top.NetworkLoad(self.networkdevice, 0, 0)
             properties["sdn"] = "DL: " +convert_bytes(sd.bytes_in)
             properties["sup"] = "UL: " +convert_bytes(sd.bytes_out)
             properties["des1"] = "Traffic since: " +bootup
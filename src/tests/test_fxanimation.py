@@ -0,0 +1,131 @@
+#  Gnome15 - Suite of tools for the Logitech G series keyboards and headsets
+#  Copyright (C) 2010 Brett Smith <tanktarta@blueyonder.co.uk>
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import struct
+import unittest
+
+import testpaths
+testpaths.add_plugin("fx")
+
+try:
+    import cairo
+    import fxanimation
+except ImportError:
+    cairo = None
+
+WIDTH = 20
+HEIGHT = 7
+
+def make_page(base):
+    # Every pixel of a page is different, as are the pages
+    surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, WIDTH, HEIGHT)
+    data = surface.get_data()
+    stride = surface.get_stride()
+    for y in range(0, HEIGHT):
+        for x in range(0, WIDTH):
+            data[y * stride + x * 4:y * stride + x * 4 + 4] = struct.pack("=I", 0xff000000 | base | ( y << 8 ) | x)
+    surface.mark_dirty()
+    return surface
+
+def get_pixels(surface):
+    surface.flush()
+    data = str(surface.get_data())
+    stride = surface.get_stride()
+    return [ [ data[y * stride + x * 4:y * stride + x * 4 + 4] for x in range(0, WIDTH) ] for y in range(0, HEIGHT) ]
+
+@unittest.skipIf(cairo is None, "Requires cairo")
+class StepsTest(unittest.TestCase):
+
+    def test_steps(self):
+        self.assertEqual(9, fxanimation.get_steps("vertical-scroll", 160, 43, 5))
+        self.assertEqual(11, fxanimation.get_steps("horizontal-scroll", 160, 43, 5))
+        self.assertEqual(52, fxanimation.get_steps("fade", 160, 43, 5))
+        self.assertEqual(32, fxanimation.get_steps("zoom", 160, 43, 5))
+
+    def test_slow_steps(self):
+        self.assertEqual(43, fxanimation.get_steps("vertical-scroll", 160, 43, 0.5))
+        self.assertEqual(256, fxanimation.get_steps("fade", 160, 43, 0.5))
+
+    def test_duration(self):
+        self.assertAlmostEqual(9 * fxanimation.STEP_TIME, fxanimation.get_duration("vertical-scroll", 160, 43, 5))
+        self.assertAlmostEqual(43 * ( fxanimation.STEP_TIME + 0.5 / 50.0 ), fxanimation.get_duration("vertical-scroll", 160, 43, 0.5))
+
+    def test_unknown_effect(self):
+        self.assertRaises(ValueError, fxanimation.get_steps, "spin", 160, 43, 5)
+        self.assertRaises(ValueError, fxanimation.Animation, "spin", "down", make_page(0), 1.0, 0.0)
+
+@unittest.skipIf(cairo is None, "Requires cairo")
+class AnimationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.old_page = make_page(0)
+        self.new_page = make_page(0x800000)
+        self.old = get_pixels(self.old_page)
+        self.new = get_pixels(self.new_page)
+
+    def render(self, effect, direction, position):
+        animation = fxanimation.Animation(effect, direction, self.old_page, 1.0, 0.0)
+        return get_pixels(animation.render(position, self.new_page))
+
+    def test_position(self):
+        animation = fxanimation.Animation("fade", "down", self.old_page, 2.0, 10.0)
+        self.assertEqual(0.0, animation.get_position(9.0))
+        self.assertEqual(0.25, animation.get_position(10.5))
+        self.assertEqual(1.0, animation.get_position(13.0))
+        self.assertEqual(1.0, fxanimation.Animation("fade", "down", self.old_page, 0, 10.0).get_position(0.0))
+
+    def test_vertical_scroll(self):
+        for position in [ 0.0, 0.3, 0.5, 0.99, 1.0 ]:
+            rows = int(position * HEIGHT)
+            # Old page moves up, or down
+            down = [ self.old[y + rows] if y < HEIGHT - rows else self.new[y - ( HEIGHT - rows )] for y in range(0, HEIGHT) ]
+            up = [ self.new[y + HEIGHT - rows] if y < rows else self.old[y - rows] for y in range(0, HEIGHT) ]
+            self.assertEqual(down, self.render("vertical-scroll", "down", position))
+            self.assertEqual(up, self.render("vertical-scroll", "up", position))
+
+    def test_horizontal_scroll(self):
+        for position in [ 0.0, 0.3, 0.5, 0.99, 1.0 ]:
+            columns = int(position * WIDTH)
+            # Old page moves left, or right
+            down = [ [ self.old[y][x + columns] if x < WIDTH - columns else self.new[y][x - ( WIDTH - columns )] for x in range(0, WIDTH) ]
+                     for y in range(0, HEIGHT) ]
+            up = [ [ self.new[y][x + WIDTH - columns] if x < columns else self.old[y][x - columns] for x in range(0, WIDTH) ]
+                   for y in range(0, HEIGHT) ]
+            self.assertEqual(down, self.render("horizontal-scroll", "down", position))
+            self.assertEqual(up, self.render("horizontal-scroll", "up", position))
+
+    def test_fade_ends(self):
+        self.assertEqual(self.old, self.render("fade", "down", 0.0))
+        self.assertEqual(self.new, self.render("fade", "down", 1.0))
+
+    def test_zoom_end(self):
+        self.assertEqual(self.new, self.render("zoom", "down", 1.0))
+
+    def test_old_page_copied(self):
+        animation = fxanimation.Animation("vertical-scroll", "down", self.old_page, 1.0, 0.0)
+        ctx = cairo.Context(self.old_page)
+        ctx.set_source_rgb(1.0, 1.0, 1.0)
+        ctx.paint()
+        self.assertEqual(self.old, get_pixels(animation.render(0.0, self.new_page)))
+
+    def test_frame_surface_reused(self):
+        animation = fxanimation.Animation("vertical-scroll", "down", self.old_page, 1.0, 0.0)
+        frame = animation.render(0.2, self.new_page)
+        self.assertTrue(frame is animation.render(0.4, self.new_page))
+        self.assertEqual(2, animation.frames)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,125 @@
+#  Gnome15 - Suite of tools for the Logitech G series keyboards and headsets
+#  Copyright (C) 2010 Brett Smith <tanktarta@blueyonder.co.uk>
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import sys
+import random
+import socket
+import unittest
+
+import testpaths
+testpaths.add_plugin("g15daemon-server")
+import g15daemonframes
+
+def make_g_buffer(seed):
+    rnd = random.Random(seed)
+    return "".join(chr(rnd.choice([ 0, 0, 1, 255, 7 ])) for i in range(0, g15daemonframes.G_BUFFER_LEN))
+
+def pack_reference(g_buffer):
+    # One pixel at a time, as the plugin used to
+    packed = []
+    for i in range(0, g15daemonframes.PACKED_LEN):
+        byte = 0
+        for bit in range(0, 8):
+            if ord(g_buffer[i * 8 + bit]) != 0:
+                byte |= 0x80 >> bit
+        packed.append(chr(byte))
+    return "".join(packed)
+
+class ConversionTest(testpaths.NumPyTestCase):
+
+    module = g15daemonframes
+
+    def test_pack_pixels(self):
+        for seed in range(0, 5):
+            g_buffer = make_g_buffer(seed)
+            self.assertEqual(pack_reference(g_buffer), g15daemonframes.pack_pixels(g_buffer))
+
+    def test_pack_pixels_bytearray(self):
+        g_buffer = make_g_buffer(10)
+        self.assertEqual(pack_reference(g_buffer), g15daemonframes.pack_pixels(bytearray(g_buffer)))
+
+    def test_pack_blank_and_full(self):
+        length = g15daemonframes.G_BUFFER_LEN
+        self.assertEqual("\x00" * g15daemonframes.PACKED_LEN, g15daemonframes.pack_pixels("\x00" * length))
+        self.assertEqual("\xff" * g15daemonframes.PACKED_LEN, g15daemonframes.pack_pixels("\x01" * length))
+
+    def test_unpack_pixels(self):
+        g_buffer = make_g_buffer(20)
+        expected = "".join("\x01" if c != "\x00" else "\x00" for c in g_buffer)
+        self.assertEqual(expected, g15daemonframes.unpack_pixels(pack_reference(g_buffer)))
+
+    def test_unpack_leading_blank_pixels(self):
+        # Blank pixels at the start must not be lost
+        packed = "\x00" * ( g15daemonframes.PACKED_LEN - 1 ) + "\x01"
+        pixels = g15daemonframes.unpack_pixels(packed)
+        self.assertEqual(g15daemonframes.G_BUFFER_LEN, len(pixels))
+        self.assertEqual("\x00" * ( g15daemonframes.G_BUFFER_LEN - 1 ) + "\x01", pixels)
+
+    def test_to_a1(self):
+        packed = pack_reference(make_g_buffer(30))
+        a1 = g15daemonframes.to_a1(packed)
+        self.assertEqual(g15daemonframes.PACKED_LEN, len(a1))
+        for i in range(0, g15daemonframes.PACKED_LEN):
+            byte = ord(packed[i])
+            if sys.byteorder == "little":
+                byte = int("{0:08b}".format(byte)[::-1], 2)
+            self.assertEqual(byte, a1[i])
+
+    def test_to_a1_ignores_r_buffer_padding(self):
+        packed = pack_reference(make_g_buffer(40))
+        padded = packed + "\xff" * ( g15daemonframes.R_BUFFER_LEN - g15daemonframes.PACKED_LEN )
+        self.assertEqual(g15daemonframes.to_a1(packed), g15daemonframes.to_a1(padded))
+
+class ConversionWithoutNumPyTest(ConversionTest):
+
+    use_numpy = False
+
+class FrameReaderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.client, self.server = socket.socketpair()
+
+    def tearDown(self):
+        self.client.close()
+        self.server.close()
+
+    def test_frames_in_pieces(self):
+        reader = g15daemonframes.FrameReader(10)
+        self.client.sendall("01234")
+        self.assertEqual(None, reader.read(self.server))
+        self.client.sendall("56789abc")
+        self.assertEqual("0123456789", str(reader.read(self.server)))
+        self.assertEqual(1, reader.frames)
+        self.assertEqual(None, reader.read(self.server))
+        self.client.sendall("defghij")
+        self.assertEqual("abcdefghij", str(reader.read(self.server)))
+        self.assertEqual(2, reader.frames)
+
+    def test_buffer_reused(self):
+        reader = g15daemonframes.FrameReader(4)
+        self.client.sendall("abcdefgh")
+        first = reader.read(self.server)
+        second = reader.read(self.server)
+        self.assertTrue(first is second)
+        self.assertEqual("efgh", str(second))
+
+    def test_closed(self):
+        reader = g15daemonframes.FrameReader(4)
+        self.client.close()
+        self.assertRaises(EOFError, reader.read, self.server)
+
+if __name__ == "__main__":
+    unittest.main()
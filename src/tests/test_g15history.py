@@ -0,0 +1,94 @@
+#  Gnome15 - Suite of tools for the Logitech G series keyboards and headsets
+#  Copyright (C) 2010 Brett Smith <tanktarta@blueyonder.co.uk>
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import random
+import unittest
+
+import testpaths
+from gnome15.util import g15history
+
+class HistoryTest(testpaths.NumPyTestCase):
+
+    module = g15history
+
+    def test_starts_full_of_fill_value(self):
+        history = g15history.History(5, 2.0)
+        self.assertEqual(5, len(history))
+        self.assertEqual([ 2.0 ] * 5, history.to_list())
+        self.assertEqual(2.0, history.get_min())
+        self.assertEqual(2.0, history.get_max())
+        self.assertEqual(2.0, history.get_avg())
+        self.assertEqual(2.0, history.get_last())
+
+    def test_invalid_capacity(self):
+        self.assertRaises(ValueError, g15history.History, 0)
+
+    def test_append_wraps_around(self):
+        history = g15history.History(3)
+        for value in range(1, 8):
+            history.append(value)
+        self.assertEqual([ 5.0, 6.0, 7.0 ], history.to_list())
+        self.assertEqual(7.0, history.get_last())
+
+    def test_get_values_count(self):
+        history = g15history.History(4)
+        for value in range(1, 6):
+            history.append(value)
+        self.assertEqual([ 4.0, 5.0 ], list(history.get_values(2)))
+        self.assertEqual([ 2.0, 3.0, 4.0, 5.0 ], list(history.get_values(10)))
+        self.assertEqual([ 3.0, 4.0, 5.0 ], history.to_list(3))
+
+    def test_statistics_match_values(self):
+        random.seed(15)
+        for capacity in [ 1, 2, 7, 50 ]:
+            history = g15history.History(capacity)
+            values = [ 0.0 ] * capacity
+            for i in range(0, capacity * 5):
+                # Repeated values and runs test the min / max candidate lists
+                value = float(random.choice([ random.randint(-50, 50), 3, 3 ]))
+                history.append(value)
+                values = values[1:] + [ value ]
+                self.assertEqual(values, history.to_list())
+                self.assertEqual(min(values), history.get_min())
+                self.assertEqual(max(values), history.get_max())
+                self.assertAlmostEqual(sum(values) / capacity, history.get_avg())
+
+    def test_average_does_not_drift(self):
+        history = g15history.History(10)
+        for i in range(0, 10000):
+            history.append(0.1 if i % 2 == 0 else 1e6)
+        for i in range(0, 10):
+            history.append(0.1)
+        self.assertAlmostEqual(0.1, history.get_avg(), places = 9)
+
+@unittest.skipIf(g15history.numpy is None, "Requires NumPy")
+class HistoryNumPyViewTest(unittest.TestCase):
+
+    def test_values_are_a_view(self):
+        history = g15history.History(4)
+        for value in range(1, 4):
+            history.append(value)
+        values = history.get_values()
+        self.assertTrue(isinstance(values, g15history.numpy.ndarray))
+        self.assertEqual([ 0.0, 1.0, 2.0, 3.0 ], values.tolist())
+        self.assertTrue(values.base is not None)
+
+class HistoryWithoutNumPyTest(HistoryTest):
+
+    use_numpy = False
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+#  Gnome15 - Suite of tools for the Logitech G series keyboards and headsets
+#  Copyright (C) 2010 Brett Smith <tanktarta@blueyonder.co.uk>
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+import unittest
+
+import testpaths
+
+try:
+    from gnome15 import g15screen
+    from gnome15.util import g15scheduler
+except ImportError:
+    g15screen = None
+
+if g15screen is not None:
+
+    class RedrawingScreen(g15screen.G15Screen):
+        """
+        Just enough of a screen to redraw and cycle pages, recording what it
+        was asked to do rather than drawing
+        """
+
+        def __init__(self):
+            self.redraw_scheduler = g15screen.RedrawScheduler(self)
+            self.redraw_scheduler.set_max_fps(0)
+            self.drawn = []
+            self.cycled = []
+
+        def _do_redraw_requests(self, requests):
+            self.drawn.append([ r.page for r in requests ])
+
+        def _do_cycle_to(self, page, transitions=True):
+            self.cycled.append(page)
+
+@unittest.skipIf(g15screen is None, "Requires GTK, cairo and GConf")
+class CycleTest(unittest.TestCase):
+
+    def setUp(self):
+        self.screen = RedrawingScreen()
+        self.other_screen = RedrawingScreen()
+        self.release = threading.Event()
+
+    def tearDown(self):
+        self.release.set()
+
+    def hold_redraw_queue(self):
+        # Keeps jobs waiting on the redraw queue until released
+        g15scheduler.execute(g15screen.REDRAW_QUEUE, "hold", self.release.wait)
+
+    def wait_for_redraw_queue(self):
+        done = threading.Event()
+        g15scheduler.execute(g15screen.REDRAW_QUEUE, "done", done.set)
+        done.wait(10.0)
+        self.assertTrue(done.is_set())
+
+    def test_cycle_keeps_other_screens_redraws(self):
+        self.hold_redraw_queue()
+        self.other_screen.redraw_scheduler.request("page", "up", True, True)
+        self.screen.redraw_scheduler.request("page", "up", True, True)
+        self.screen.cycle_to("next page")
+        self.release.set()
+        self.wait_for_redraw_queue()
+
+        self.assertEqual([ [ "page" ] ], self.other_screen.drawn)
+        self.assertEqual([], self.screen.drawn)
+        self.assertEqual([ "next page" ], self.screen.cycled)
+
+        # Both screens may still redraw
+        self.other_screen.redraw_scheduler.request("page", "up", True, True)
+        self.screen.redraw_scheduler.request("page", "up", True, True)
+        self.wait_for_redraw_queue()
+        self.assertEqual([ [ "page" ], [ "page" ] ], self.other_screen.drawn)
+        self.assertEqual([ [ "page" ] ], self.screen.drawn)
+
+if __name__ == "__main__":
+    unittest.main()
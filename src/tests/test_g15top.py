@@ -0,0 +1,129 @@
+#  Gnome15 - Suite of tools for the Logitech G series keyboards and headsets
+#  Copyright (C) 2010 Brett Smith <tanktarta@blueyonder.co.uk>
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import unittest
+
+import testpaths
+from gnome15 import g15top
+
+STAT = """cpu  100 2 30 400 5 0 6 0 0 0
+cpu0 60 1 20 200 3 0 4 0 0 0
+cpu1 40 1 10 200 2 0 2 0 0 0
+intr 12345 0 0
+ctxt 999
+"""
+
+MEMINFO = """MemTotal:        8000000 kB
+MemFree:         1000000 kB
+MemAvailable:    4000000 kB
+Buffers:          200000 kB
+Cached:          2000000 kB
+SwapCached:            0 kB
+"""
+
+NET_DEV = """Inter-|   Receive                                                |  Transmit
+ face |bytes    packets errs drop fifo frame compressed multicast|bytes    packets errs drop fifo colls carrier compressed
+    lo:  1000      10    0    0    0     0          0         0     1000      10    0    0    0     0       0          0
+  eth0:123456789  1000    0    0    0     0          0         0 987654     900    0    0    0     0       0          0
+"""
+
+STATUS = """Name:\tpython
+VmPeak:\t  300000 kB
+VmSize:\t  200000 kB
+VmRSS:\t   50000 kB
+VmStk:\t     132 kB
+"""
+
+class SamplerParseTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sampler = g15top.Sampler()
+
+    def tearDown(self):
+        self.sampler.close()
+
+    def test_stat(self):
+        cpu, cpus = self.sampler._parse_stat(STAT)
+        self.assertEqual(g15top.CPU("cpu", 100, 2, 30, 400), cpu)
+        self.assertEqual([ "cpu0", "cpu1" ], [ c.name for c in cpus ])
+        self.assertEqual(g15top.CPU("cpu1", 40, 1, 10, 200), cpus[1])
+
+    def test_meminfo(self):
+        mem = self.sampler._parse_meminfo(MEMINFO)
+        self.assertEqual(g15top.Mem(8000000 * 1024, 1000000 * 1024, 2000000 * 1024), mem)
+
+    def test_meminfo_missing_values(self):
+        self.assertEqual(g15top.Mem(0, 0, 0), self.sampler._parse_meminfo(""))
+
+    def test_net_dev(self):
+        nets, netloads = self.sampler._parse_net_dev(NET_DEV)
+        self.assertEqual(( "lo", "eth0" ), nets)
+        self.assertEqual(g15top.NetworkLoad("eth0", 123456789, 987654), netloads["eth0"])
+
+    def test_status(self):
+        process = self.sampler._parse_status(STATUS)
+        self.assertEqual(g15top.ProcessMemory(200000 * 1024, 50000 * 1024, 132 * 1024), process)
+
+@unittest.skipUnless(os.path.exists("/proc/stat"), "Requires /proc")
+class SamplerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sampler = g15top.Sampler()
+
+    def tearDown(self):
+        self.sampler.close()
+
+    def test_sample(self):
+        snapshot = self.sampler.get_snapshot()
+        self.assertEqual("cpu", snapshot.cpu.name)
+        self.assertTrue(len(snapshot.cpus) > 0)
+        self.assertTrue(snapshot.mem.total > 0)
+        self.assertTrue(snapshot.process.resident > 0)
+        self.assertEqual(sorted(snapshot.nets), sorted(snapshot.netloads.keys()))
+        self.assertTrue(snapshot.uptime[0] > 0)
+
+    def test_snapshot_shared_until_max_age(self):
+        first = self.sampler.get_snapshot(max_age = 60)
+        self.assertTrue(first is self.sampler.get_snapshot(max_age = 60))
+        self.assertEqual(1, self.sampler.samples)
+        second = self.sampler.get_snapshot(max_age = -1)
+        self.assertFalse(first is second)
+        self.assertEqual(2, self.sampler.samples)
+
+    def test_listeners_get_new_snapshots(self):
+        received = []
+        self.sampler.listeners.append(received.append)
+        snapshot = self.sampler.get_snapshot(max_age = 60)
+        self.sampler.get_snapshot(max_age = 60)
+        self.assertEqual([ snapshot ], received)
+
+    def test_files_reused(self):
+        self.sampler.get_snapshot()
+        files = dict(self.sampler._files)
+        self.sampler.get_snapshot(max_age = -1)
+        self.assertEqual(files, self.sampler._files)
+
+    def test_compatible_functions(self):
+        cpus = g15top.cpu()
+        self.assertEqual("CPUS", cpus.name)
+        self.assertEqual(len(g15top.get_snapshot().cpus), len(cpus.cpus))
+        self.assertTrue(g15top.mem().total > 0)
+        for net in g15top.netlist():
+            self.assertEqual(net, g15top.netload(net).net)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,150 @@
+#  Gnome15 - Suite of tools for the Logitech G series keyboards and headsets
+#  Copyright (C) 2010 Brett Smith <tanktarta@blueyonder.co.uk>
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import math
+import random
+import unittest
+
+import testpaths
+testpaths.add_plugin("impulse15")
+import impulseanalysis
+
+class RecordingCanvas(object):
+
+    def __init__(self):
+        self.rectangles = []
+
+    def rectangle(self, x, y, width, height):
+        self.rectangles.append(( x, y, width, height ))
+
+class AnalyserTest(testpaths.NumPyTestCase):
+
+    module = impulseanalysis
+
+    def process(self, analyser, snapshot, gain = 1.0):
+        analysis = analyser.process(snapshot, gain)
+        return analysis, impulseanalysis.to_list(analysis.bars), impulseanalysis.to_list(analysis.peaks)
+
+    def test_bars_are_loudest_in_band(self):
+        analyser = impulseanalysis.Analyser(4, smoothing = 0)
+        analysis, bars, peaks = self.process(analyser, [ 0.1, 0.5, 0.2, 0.3, 0.0, 0.0, 0.9, 0.4 ])
+        self.assertEqual([ 0.5, 0.3, 0.0, 0.9 ], bars)
+        self.assertEqual(bars, peaks)
+
+    def test_extra_bar_for_leftover_samples(self):
+        analyser = impulseanalysis.Analyser(3, smoothing = 0)
+        analysis, bars, peaks = self.process(analyser, [ 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7 ])
+        self.assertEqual([ 0.2, 0.4, 0.6, 0.7 ], bars)
+
+    def test_gain(self):
+        analyser = impulseanalysis.Analyser(2, smoothing = 0)
+        analysis, bars, peaks = self.process(analyser, [ 0.1, 0.2, 0.3, 0.4 ], 2.0)
+        self.assertEqual([ 0.2, 0.4, 0.6, 0.8 ], impulseanalysis.to_list(analysis.samples))
+        self.assertEqual([ 0.4, 0.8 ], bars)
+
+    def test_smoothing(self):
+        analyser = impulseanalysis.Analyser(2, smoothing = 0.5, peak_decay = 0)
+        self.process(analyser, [ 0.8, 0.8, 0.4, 0.4 ])
+        analysis, bars, peaks = self.process(analyser, [ 0.0, 0.0, 0.6, 0.6 ])
+        # Bars fall to no less than half their height, but rise at once
+        self.assertEqual([ 0.4, 0.6 ], bars)
+        analysis, bars, peaks = self.process(analyser, [ 0.0, 0.0, 0.0, 0.0 ])
+        self.assertEqual([ 0.2, 0.3 ], bars)
+
+    def test_peaks_fall_faster(self):
+        analyser = impulseanalysis.Analyser(1, smoothing = 0, peak_decay = 0.1)
+        self.process(analyser, [ 1.0 ])
+        heights = [ self.process(analyser, [ 0.0 ])[2][0] for i in range(0, 5) ]
+        for expected, height in zip([ 0.9, 0.7, 0.4, 0.0, 0.0 ], heights):
+            self.assertAlmostEqual(expected, height)
+
+    def test_peaks_pushed_up(self):
+        analyser = impulseanalysis.Analyser(1, smoothing = 0, peak_decay = 0.1)
+        self.process(analyser, [ 1.0 ])
+        self.process(analyser, [ 0.0 ])
+        self.process(analyser, [ 0.0 ])
+        # A new peak resets the speed of its fall
+        self.assertEqual([ 0.8 ], self.process(analyser, [ 0.8 ])[2])
+        self.assertAlmostEqual(0.7, self.process(analyser, [ 0.0 ])[2][0])
+
+    def test_colour_and_level(self):
+        analyser = impulseanalysis.Analyser(3)
+        analysis = analyser.process([ 0.0, 0.0, 0.5, 0.5, 1.0, 1.0 ])
+        self.assertEqual(( 0, 170, 255 ), analysis.colour)
+        self.assertAlmostEqual(( 0 + 0 + 170 + 170 + 255 + 255 ) / 6.0, analysis.level)
+
+    def test_too_few_samples_for_colour(self):
+        analysis = impulseanalysis.Analyser(3).process([ 0.5, 0.5 ])
+        self.assertEqual(( 0, 0, 0 ), analysis.colour)
+
+    def test_empty_snapshot(self):
+        analysis = impulseanalysis.Analyser(3).process([])
+        self.assertEqual(( [], [], ( 0, 0, 0 ), 0 ), tuple(analysis[1:]))
+
+    def test_sample_count_change(self):
+        analyser = impulseanalysis.Analyser(2, smoothing = 0)
+        self.process(analyser, [ 0.5 ] * 4)
+        analysis, bars, peaks = self.process(analyser, [ 0.1, 0.2, 0.3, 0.4, 0.5, 0.6 ])
+        self.assertEqual([ 0.3, 0.6 ], bars)
+        self.assertEqual(bars, peaks)
+
+    def test_configure_resets(self):
+        analyser = impulseanalysis.Analyser(2)
+        self.process(analyser, [ 1.0 ] * 4)
+        analyser.configure(2)
+        analysis, bars, peaks = self.process(analyser, [ 0.0 ] * 4)
+        self.assertEqual([ 0.0, 0.0 ], bars)
+        self.assertEqual([ 0.0, 0.0 ], peaks)
+
+class AnalyserWithoutNumPyTest(AnalyserTest):
+
+    use_numpy = False
+
+@unittest.skipIf(impulseanalysis.numpy is None, "Requires NumPy")
+class AnalyserAgreeTest(unittest.TestCase):
+
+    def analyse(self, snapshots):
+        analyser = impulseanalysis.Analyser(16)
+        return [ analyser.process(snapshot, 1.5) for snapshot in snapshots ]
+
+    def test_numpy_and_python_agree(self):
+        rnd = random.Random(15)
+        snapshots = [ [ max(0.0, 0.6 * math.exp(-i / 60.0) * ( 0.6 + 0.4 * math.sin(f * 0.3 + i * 0.1) ) + rnd.uniform(-0.05, 0.05))
+                        for i in range(0, 256) ] for f in range(0, 50) ]
+        with_numpy = self.analyse(snapshots)
+        with testpaths.without_numpy(impulseanalysis):
+            without_numpy = self.analyse(snapshots)
+        for a, b in zip(with_numpy, without_numpy):
+            for x, y in zip(impulseanalysis.to_list(a.bars) + impulseanalysis.to_list(a.peaks), b.bars + b.peaks):
+                self.assertAlmostEqual(x, y)
+            self.assertEqual(a.colour, b.colour)
+            self.assertAlmostEqual(a.level, b.level)
+
+class DrawingTest(unittest.TestCase):
+
+    def test_to_list(self):
+        self.assertEqual([ 1, 2 ], impulseanalysis.to_list(( 1, 2 )))
+        if impulseanalysis.numpy is not None:
+            self.assertEqual([ 1.0, 2.0 ], impulseanalysis.to_list(impulseanalysis.numpy.array([ 1.0, 2.0 ])))
+
+    def test_add_bars(self):
+        canvas = RecordingCanvas()
+        impulseanalysis.add_bars(canvas, [ 10, 20, 30 ], [ 5, 0, 7 ], 4, 2)
+        # Bars with no height are skipped, but keep their place
+        self.assertEqual([ ( 0, 10, 4, 5 ), ( 12, 30, 4, 7 ) ], canvas.rectangles)
+
+if __name__ == "__main__":
+    unittest.main()
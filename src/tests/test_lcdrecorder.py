@@ -0,0 +1,183 @@
+#  Gnome15 - Suite of tools for the Logitech G series keyboards and headsets
+#  Copyright (C) 2010 Brett Smith <tanktarta@blueyonder.co.uk>
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import time
+import zlib
+import struct
+import shutil
+import tempfile
+import unittest
+
+import testpaths
+testpaths.add_plugin("lcdshot")
+import lcdrecorder
+
+WIDTH = 32
+HEIGHT = 24
+
+"""
+Opaque pixel of red 0x60, green 0x40 and blue 0x20, in cairo's native endian
+ARGB32
+"""
+PIXEL = struct.pack("=I", 0xff604020)
+
+def make_frame(stride, block_row = None):
+    frame = bytearray(( PIXEL * WIDTH ).ljust(stride, "\x00") * HEIGHT)
+    if block_row is not None:
+        for row in range(block_row, block_row + 3):
+            frame[row * stride + 8:row * stride + 24] = "\xff" * 16
+    return str(frame)
+
+def read_chunks(path):
+    data = open(path, "rb").read()
+    if not data.startswith(lcdrecorder._PNG_SIGNATURE):
+        raise AssertionError("No PNG signature")
+    offset = len(lcdrecorder._PNG_SIGNATURE)
+    chunks = []
+    while offset < len(data):
+        length, = struct.unpack(">I", data[offset:offset + 4])
+        chunk_type = data[offset + 4:offset + 8]
+        chunk_data = data[offset + 8:offset + 8 + length]
+        crc, = struct.unpack(">I", data[offset + 8 + length:offset + 12 + length])
+        if crc != zlib.crc32(chunk_type + chunk_data) & 0xffffffff:
+            raise AssertionError("Bad CRC in %s chunk" % chunk_type)
+        chunks.append(( chunk_type, chunk_data ))
+        offset += 12 + length
+    return chunks
+
+class RecorderTest(unittest.TestCase):
+
+    stride = WIDTH * 4
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.recording = os.path.join(self.temp_dir, "test.g15rec")
+        self.png = os.path.join(self.temp_dir, "test.png")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def record(self, frames, fps = 50):
+        # Each frame is written before the next is offered
+        recorder = lcdrecorder.Recorder(self.recording, WIDTH, HEIGHT, self.stride, fps)
+        for i, frame in enumerate(frames):
+            recorder.offer(frame)
+            if i == 0:
+                recorder.start()
+            if i < len(frames) - 1:
+                self.wait_for(recorder, i + 1)
+        if recorder._thread is None:
+            recorder.start()
+        recorder.stop()
+        return recorder
+
+    def wait_for(self, recorder, count):
+        timeout = time.time() + 10.0
+        while recorder.frames_written + recorder.frames_unchanged < count:
+            if time.time() > timeout:
+                self.fail("Frame was not recorded")
+            time.sleep(0.005)
+
+    def read_frames(self):
+        width, height, stride, fps, frames = lcdrecorder.read_recording(self.recording)
+        self.assertEqual(( WIDTH, HEIGHT, self.stride ), ( width, height, stride ))
+        return [ ( f[0], f[1], f[2], str(f[3]) ) for f in frames ]
+
+    def test_frames_read_back(self):
+        offered = [ make_frame(self.stride, 2), make_frame(self.stride, 10), make_frame(self.stride, 20) ]
+        recorder = self.record(offered)
+        self.assertEqual(3, recorder.frames_offered)
+        self.assertEqual(3, recorder.frames_written)
+        self.assertEqual(os.path.getsize(self.recording), recorder.bytes_written)
+        frames = self.read_frames()
+        self.assertEqual(offered, [ f[3] for f in frames[:-1] ])
+        self.assertEqual(0, frames[-1][2])
+        timestamps = [ f[0] for f in frames ]
+        self.assertEqual(sorted(timestamps), timestamps)
+
+    def test_only_changed_rows_written(self):
+        self.record([ make_frame(self.stride), make_frame(self.stride, 5) ])
+        frames = self.read_frames()
+        self.assertEqual(( 0, HEIGHT ), frames[0][1:3])
+        self.assertEqual(( 5, 3 ), frames[1][1:3])
+
+    def test_unchanged_frames_skipped(self):
+        recorder = self.record([ make_frame(self.stride, 5), make_frame(self.stride, 5) ])
+        self.assertEqual(1, recorder.frames_written)
+        self.assertEqual(1, recorder.frames_unchanged)
+        self.assertEqual(2, len(self.read_frames()))
+
+    def test_wrong_size_ignored(self):
+        recorder = lcdrecorder.Recorder(self.recording, WIDTH, HEIGHT, self.stride, 50)
+        recorder.offer("\x00" * 10)
+        self.assertEqual(0, recorder.frames_offered)
+        recorder.start()
+        recorder.stop()
+        self.assertEqual(0, recorder.frames_written)
+
+    def test_unfinished_recording(self):
+        self.record([ make_frame(self.stride, 2), make_frame(self.stride, 10) ])
+        size = os.path.getsize(self.recording)
+        f = open(self.recording, "r+b")
+        f.truncate(size - lcdrecorder._RECORD.size)
+        f.close()
+        frames = self.read_frames()
+        self.assertEqual([ make_frame(self.stride, 2), make_frame(self.stride, 10) ], [ f[3] for f in frames ])
+
+    def test_not_a_recording(self):
+        f = open(self.recording, "wb")
+        f.write("Not a recording")
+        f.close()
+        self.assertRaises(IOError, lcdrecorder.read_recording, self.recording)
+
+    def test_write_apng(self):
+        self.record([ make_frame(self.stride), make_frame(self.stride, 5), make_frame(self.stride, 12) ])
+        lcdrecorder.write_apng(self.recording, self.png)
+        chunks = read_chunks(self.png)
+        types = [ c[0] for c in chunks ]
+        self.assertEqual("IHDR", types[0])
+        self.assertEqual("IEND", types[-1])
+        self.assertEqual(( WIDTH, HEIGHT, 8, 2 ), struct.unpack(">IIBB", chunks[0][1][:10]))
+        self.assertEqual(( 3, 0 ), struct.unpack(">II", dict(chunks)["acTL"]))
+        self.assertEqual(3, types.count("fcTL"))
+        self.assertEqual(1, types.count("IDAT"))
+        self.assertEqual(2, types.count("fdAT"))
+
+        # Sequence numbers are shared by fcTL and fdAT chunks, in order
+        sequence = [ struct.unpack(">I", c[1][:4])[0] for c in chunks if c[0] in [ "fcTL", "fdAT" ] ]
+        self.assertEqual(range(0, 5), sequence)
+
+        # Later frames only cover the changed rows
+        controls = [ struct.unpack(">IIIII", c[1][:20]) for c in chunks if c[0] == "fcTL" ]
+        self.assertEqual([ ( WIDTH, HEIGHT, 0, 0 ), ( WIDTH, 3, 0, 5 ) ], [ c[1:] for c in controls[:2] ])
+
+    def test_apng_pixels(self):
+        self.record([ make_frame(self.stride) ])
+        lcdrecorder.write_apng(self.recording, self.png)
+        pixels = zlib.decompress(dict(read_chunks(self.png))["IDAT"])
+        self.assertEqual(( "\x00" + "\x60\x40\x20" * WIDTH ) * HEIGHT, pixels)
+
+    def test_apng_no_frames(self):
+        self.record([])
+        self.assertRaises(IOError, lcdrecorder.write_apng, self.recording, self.png)
+
+class PaddedRecorderTest(RecorderTest):
+
+    stride = WIDTH * 4 + 16
+
+if __name__ == "__main__":
+    unittest.main()
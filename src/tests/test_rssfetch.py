@@ -0,0 +1,217 @@
+#  Gnome15 - Suite of tools for the Logitech G series keyboards and headsets
+#  Copyright (C) 2010 Brett Smith <tanktarta@blueyonder.co.uk>
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import gzip
+import shutil
+import urllib
+import tempfile
+import unittest
+import threading
+import SocketServer
+import BaseHTTPServer
+from cStringIO import StringIO
+
+import testpaths
+testpaths.add_plugin("rss")
+import rssfetch
+
+FEED = '<?xml version="1.0"?><rss version="2.0"><channel><title>Test</title></channel></rss>'
+
+class FeedHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Serves the responses in the server's routes, answering conditional
+    requests for them with "304 Not Modified"
+    """
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self.server.requests.append(( self.path, self.headers ))
+        status, headers, body = self.server.routes.get(self.path, ( 404, {}, "" ))
+        if status == 200:
+            etag = headers.get("ETag")
+            last_modified = headers.get("Last-Modified")
+            if ( etag is not None and self.headers.get("If-None-Match") == etag ) or \
+               ( last_modified is not None and self.headers.get("If-Modified-Since") == last_modified ):
+                status, body = 304, ""
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+class FeedServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+class UnwritableCache(rssfetch.FeedCache):
+
+    def put(self, response):
+        raise IOError("Cache is not writable")
+
+class FeedFetcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FeedServer(("127.0.0.1", 0), FeedHandler)
+        self.server.routes = {}
+        self.server.requests = []
+        server_thread = threading.Thread(target = self.server.serve_forever, args = ( 0.05, ))
+        server_thread.setDaemon(True)
+        server_thread.start()
+        self.base = "http://127.0.0.1:%d" % self.server.server_address[1]
+        self.cache_dir = tempfile.mkdtemp()
+        self.fetchers = []
+
+    def tearDown(self):
+        for fetcher in self.fetchers:
+            fetcher.close()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.cache_dir)
+
+    def create_fetcher(self, cache_class = rssfetch.FeedCache):
+        fetcher = rssfetch.FeedFetcher(cache_class(self.cache_dir), timeout = 10)
+        self.fetchers.append(fetcher)
+        return fetcher
+
+    def serve(self, path, headers, body = FEED, status = 200):
+        self.server.routes[path] = ( status, headers, body )
+        return self.base + path
+
+    def test_etag(self):
+        url = self.serve("/feed", { "ETag" : '"1"', "Content-Type" : "application/rss+xml" })
+        fetcher = self.create_fetcher()
+        first = fetcher.fetch(url)
+        self.assertFalse(first.not_modified)
+        self.assertEqual(FEED, first.body)
+        self.assertEqual('"1"', first.etag)
+        self.assertEqual({ "content-type" : "application/rss+xml" }, first.headers)
+
+        second = fetcher.fetch(url)
+        self.assertEqual('"1"', self.server.requests[-1][1].get("If-None-Match"))
+        self.assertTrue(second.not_modified)
+        self.assertEqual(FEED, second.body)
+        self.assertEqual({ "content-type" : "application/rss+xml" }, second.headers)
+
+    def test_last_modified(self):
+        last_modified = "Sat, 01 Jan 2011 00:00:00 GMT"
+        url = self.serve("/feed", { "Last-Modified" : last_modified })
+        fetcher = self.create_fetcher()
+        self.assertFalse(fetcher.fetch(url).not_modified)
+        second = fetcher.fetch(url)
+        self.assertEqual(last_modified, self.server.requests[-1][1].get("If-Modified-Since"))
+        self.assertTrue(second.not_modified)
+        self.assertEqual(FEED, second.body)
+
+    def test_changed_feed(self):
+        url = self.serve("/feed", { "ETag" : '"1"' })
+        fetcher = self.create_fetcher()
+        fetcher.fetch(url)
+        self.serve("/feed", { "ETag" : '"2"' }, FEED.replace("Test", "Changed"))
+        response = fetcher.fetch(url)
+        self.assertFalse(response.not_modified)
+        self.assertEqual('"2"', response.etag)
+        self.assertTrue("Changed" in response.body)
+
+    def test_cache_survives_restart(self):
+        url = self.serve("/feed", { "ETag" : '"1"' })
+        self.create_fetcher().fetch(url)
+        response = self.create_fetcher().fetch(url)
+        self.assertTrue(response.not_modified)
+        self.assertEqual(FEED, response.body)
+
+    def test_connection_reused(self):
+        fetcher = self.create_fetcher()
+        for i in range(0, 10):
+            fetcher.fetch(self.serve("/feed%d" % i, { "ETag" : '"1"' }))
+        self.assertEqual(10, fetcher.requests)
+        self.assertEqual(1, fetcher.connections_opened)
+
+    def test_redirect(self):
+        url = self.serve("/old", { "Location" : "/new" }, "", 301)
+        self.serve("/new", { "ETag" : '"1"' })
+        response = self.create_fetcher().fetch(url)
+        self.assertEqual(FEED, response.body)
+        self.assertEqual(url, response.url)
+        self.assertEqual([ "/old", "/new" ], [ r[0] for r in self.server.requests ])
+
+    def test_too_many_redirects(self):
+        url = self.serve("/loop", { "Location" : "/loop" }, "", 302)
+        self.assertRaises(rssfetch.FetchError, self.create_fetcher().fetch, url)
+        self.assertEqual(rssfetch.MAX_REDIRECTS + 1, len(self.server.requests))
+
+    def test_gzip(self):
+        compressed = StringIO()
+        f = gzip.GzipFile(fileobj = compressed, mode = "wb")
+        f.write(FEED)
+        f.close()
+        url = self.serve("/feed", { "ETag" : '"1"', "Content-Encoding" : "gzip" }, compressed.getvalue())
+        fetcher = self.create_fetcher()
+        self.assertEqual(FEED, fetcher.fetch(url).body)
+        self.assertEqual("gzip", self.server.requests[-1][1].get("Accept-Encoding"))
+        self.assertEqual(FEED, fetcher.cache.get(url).body)
+
+    def test_error_then_cached(self):
+        url = self.serve("/feed", { "ETag" : '"1"' })
+        fetcher = self.create_fetcher()
+        fetcher.fetch(url)
+        self.serve("/feed", {}, "Broken", 500)
+        self.assertRaises(rssfetch.FetchError, fetcher.fetch, url)
+
+        # The copy from before the error is kept, and used once the server recovers
+        self.assertEqual(FEED, fetcher.cache.get(url).body)
+        self.serve("/feed", { "ETag" : '"1"' })
+        response = fetcher.fetch(url)
+        self.assertTrue(response.not_modified)
+        self.assertEqual(FEED, response.body)
+
+    def test_not_found(self):
+        url = self.base + "/missing"
+        self.assertRaises(rssfetch.FetchError, self.create_fetcher().fetch, url)
+
+    def test_unwritable_cache(self):
+        url = self.serve("/feed", { "ETag" : '"1"' })
+        self.assertEqual(FEED, self.create_fetcher(UnwritableCache).fetch(url).body)
+
+    def write_local_feed(self, name):
+        path = os.path.join(self.cache_dir, name)
+        f = open(path, "wb")
+        f.write(FEED)
+        f.close()
+        return "file://%s" % urllib.pathname2url(path)
+
+    def test_local_file(self):
+        url = self.write_local_feed("local.xml")
+        fetcher = self.create_fetcher()
+        first = fetcher.fetch(url)
+        self.assertFalse(first.not_modified)
+        self.assertEqual(FEED, first.body)
+        self.assertTrue(fetcher.fetch(url).not_modified)
+
+    def test_local_file_unwritable_cache(self):
+        url = self.write_local_feed("local.xml")
+        self.assertEqual(FEED, self.create_fetcher(UnwritableCache).fetch(url).body)
+
+    def test_missing_local_file(self):
+        url = "file://%s" % urllib.pathname2url(os.path.join(self.cache_dir, "missing.xml"))
+        self.assertRaises(rssfetch.FetchError, self.create_fetcher().fetch, url)
+
+if __name__ == "__main__":
+    unittest.main()
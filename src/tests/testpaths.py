@@ -0,0 +1,83 @@
+#  Gnome15 - Suite of tools for the Logitech G series keyboards and headsets
+#  Copyright (C) 2010 Brett Smith <tanktarta@blueyonder.co.uk>
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+Makes the source tree importable by the tests, the same way it is when
+installed. The gnome15 package is imported from the source directory, and
+the modules of a plugin are imported after adding its directory with
+add_plugin(), as the plugin manager does.
+
+Run the tests from the src directory with :-
+
+python -m unittest discover -s tests
+'''
+
+import os
+import sys
+import unittest
+import contextlib
+
+SRC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+PLUGINS_DIR = os.path.join(SRC_DIR, "plugins")
+
+if not SRC_DIR in sys.path:
+    sys.path.insert(0, SRC_DIR)
+
+def add_plugin(plugin_id):
+    """
+    Add the directory of a plugin to the path, so its modules may be imported.
+
+    Keyword arguments:
+    plugin_id    -- plugin directory name
+    """
+    plugin_dir = os.path.join(PLUGINS_DIR, plugin_id)
+    if not plugin_dir in sys.path:
+        sys.path.insert(0, plugin_dir)
+
+@contextlib.contextmanager
+def without_numpy(module):
+    """
+    Make a module that uses NumPy when it is available run as if it is not.
+
+    Keyword arguments:
+    module       -- module with a numpy attribute (None when not available)
+    """
+    numpy = module.numpy
+    module.numpy = None
+    try:
+        yield
+    finally:
+        module.numpy = numpy
+
+class NumPyTestCase(unittest.TestCase):
+    """
+    Base for the tests of a module that uses NumPy when it is available.
+    Subclass the tests with use_numpy set to False to run them again with
+    the module's numpy attribute set to None (skipped if NumPy is not
+    installed, as the tests will already have run without it).
+    """
+    module = None
+    use_numpy = True
+
+    def setUp(self):
+        self._numpy = self.module.numpy
+        if not self.use_numpy:
+            if self._numpy is None:
+                self.skipTest("NumPy is not installed")
+            self.module.numpy = None
+
+    def tearDown(self):
+        self.module.numpy = self._numpy